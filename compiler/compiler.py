@@ -3,15 +3,25 @@ import numpy as np
 import warnings
 import pickle
 import sys
-import copy
 import subprocess
 import os
-import threading
 import time
 import re
+import tracemalloc
+import bisect
+import heapq
+import itertools
+import operator
+import hashlib
+import json
+import shutil
+import tempfile
+import concurrent.futures
 
 from fsim import chain
 from fsim import npu_isa_sim
+from fsim import lower_chains, diff_states, vrf_extents, fsim_profiler, fifo_segments, update_fifo_occupancy, chain_vrf_accesses
+from fsim import MVU_OPS, EVRF_OPS, ACT_OPS, ADD_OPS, MUL_OPS, LD_OPS, VRF_NONE
 
 '''
 Current Limitations:
@@ -19,9 +29,9 @@ Current Limitations:
 - The NPU front-end does not have a software implementation of the non-linear activation functions in the MFU.
   The instructions to these units are always set to path-through, but the latency of executing them is always
   accounted for (in simulations) and the hardware lookup tables are implemented on the FPGA.
-- The Keras front-end does not pass the actual weights/inputs of specified layers to the NPU performance simulator 
-  or the RTL MIF files generation. Synthetic random weights/inputs are generated under the hood to match the NPU
-  supported precisions.
+- The front-ends quantize the float weights/inputs of the layers to the NPU supported int8 precision with symmetric
+  per-tensor scales (see quantize_int8). Biases are not used. Synthetic random weights are generated under the hood
+  for layers described without weights.
 - The NPU RTL implements 2 identical cores each operating at batch-3 (total batch-6). However, the front-end and 
   simulator views this as a single core for simplicity. During RTL simulation, both cores are fed the same set of
   inputs, and their outputs are verified against the functional and performance simulator.
@@ -34,6 +44,37 @@ The main class in this code is the npu class. It is used to hold all the archite
 parameters for instruction field widths as well. 
 '''
 class npu:
+	# Loader destination of each VRF memory space (MVU VRFs are addressed per tile as mvu#.vrf)
+	VRF_SPACE_OPS = {'evrf': 'extvrf', 'mfu0_add': 'mfu0.vrf0', 'mfu0_mul': 'mfu0.vrf1', 'mfu1_add': 'mfu1.vrf0', 'mfu1_mul': 'mfu1.vrf1'}
+	VIRTUAL_VRF_DEPTH = 1 << 40
+	# Number of ready FIFO segments (in program order) the chain scheduler chooses from
+	SCHED_WINDOW = 8
+	# Pipeline latencies in cycles (written to the performance simulator defines.h and used by the chain scheduler and
+	# the analytical timing model). The MVU reduction latency is ceil(log2(tiles)) + 5.
+	PIPELINE_LATENCIES = {
+		'DPE_MULT_LATENCY'   : 2,
+		'DPE_ADDER_LATENCY'  : 1,
+		'RF_WRITE_LATENCY'   : 1,
+		'RF_READ_LATENCY'    : 1,
+		'MRF_TO_DPE_LATENCY' : 8,
+		'VRF_TO_DPE_LATENCY' : 8,
+		'MVU_ACCUM_LATENCY'  : 4,
+		'MFU_ACT_LATENCY'    : 3,
+		'MFU_ADD_LATENCY'    : 3,
+		'MFU_MUL_LATENCY'    : 3,
+		'LD_WB_LATENCY'      : 5
+	}
+	# Cycles for results to cross the channel between two units and for a write back count to reach the unit tags
+	# (on top of LD_WB_LATENCY), as in the performance simulator
+	CHANNEL_LATENCY = 1
+	TAG_UPDATE_LATENCY = 2
+	# Compile cache contents: flow options that change the compiled program, architecture states and queues (stored as
+	# .npy files that are memory-mapped on load) and the rest of the compiler state (pickled)
+	CACHE_OPTS = ['alloc_policy', 'vrf_reuse']
+	CACHE_ARRAYS = ['mrfs', 'mvu_vrfs', 'ext_vrf', 'mfu0_vrf0', 'mfu0_vrf1', 'mfu1_vrf0', 'mfu1_vrf1', 'ibuf_q', 'golden_obuf_q']
+	CACHE_STATE = ['inst_q', 'last_writer', 'mem_space', 'virtual_blocks', 'highest_tag_so_far', 'mrf_filled_depth', \
+		'sched_start', 'ops', 'unsupported_layers', 'quant_scales']
+
 	def __init__(self, arch_params, flow_opts):
 		# Architecture parameters and used precisions
 		self.arch_params 	= arch_params
@@ -42,32 +83,50 @@ class npu:
 		self.ac_data_type	= np.int32
 
 		# Memory spaces of the NPU and instruction tagging
+		# With -vrf_reuse the VRF spaces hand out addresses in an unbounded virtual space (see reuse_vrfs)
+		alloc_policy = flow_opts['alloc_policy']
+		vrf_alloc_depth = self.VIRTUAL_VRF_DEPTH if flow_opts['vrf_reuse'] else arch_params['vrf_depth']
 		self.mem_space = {
-			'mvu_vrf' 	: np.zeros(arch_params['vrf_depth'], dtype=int),
-			'mvu_mrf' 	: np.zeros(arch_params['mrf_depth'], dtype=int),
-			'evrf' 		: np.zeros(arch_params['vrf_depth'], dtype=int),
-			'mfu0_add'  	: np.zeros(arch_params['vrf_depth'], dtype=int),
-			'mfu0_mul' 	: np.zeros(arch_params['vrf_depth'], dtype=int),
-			'mfu1_add' 	: np.zeros(arch_params['vrf_depth'], dtype=int),
-			'mfu1_mul' 	: np.zeros(arch_params['vrf_depth'], dtype=int)
+			'mvu_vrf' 	: mem_allocator(vrf_alloc_depth, alloc_policy),
+			'mvu_mrf' 	: mem_allocator(arch_params['mrf_depth'], alloc_policy),
+			'evrf' 		: mem_allocator(vrf_alloc_depth, alloc_policy),
+			'mfu0_add'  	: mem_allocator(vrf_alloc_depth, alloc_policy),
+			'mfu0_mul' 	: mem_allocator(vrf_alloc_depth, alloc_policy),
+			'mfu1_add' 	: mem_allocator(vrf_alloc_depth, alloc_policy),
+			'mfu1_mul' 	: mem_allocator(vrf_alloc_depth, alloc_policy)
 		}
+		# Vectors released by free() as (chain count at free time, space, address), waiting for the FIFOs to drain, and
+		# the FIFO occupancy after the first fifo_checked chains
+		self.pending_frees = []
+		self.fifo_occupancy = [0, 0, 0, 0]
+		self.fifo_checked = 0
+		# Virtual allocations (start, word count, vector) per VRF space and peak live words after reuse_vrfs
+		self.virtual_blocks = dict((space, []) for space in self.mem_space if space != 'mvu_mrf')
+		self.vrf_pressure = {}
 		self.highest_tag_so_far = 0
 		self.mrf_filled_depth = 0
-
-		# Architecture states
-		self.mrfs = np.zeros((self.arch_params['tiles'], self.arch_params['dpes'], self.arch_params['mrf_depth'], self.arch_params['lanes']), dtype=self.in_data_type)
-		self.mvu_vrfs   = np.zeros((self.arch_params['tiles'], self.arch_params['vrf_depth'], self.arch_params['lanes']), dtype = self.in_data_type)
-		self.ext_vrf = np.zeros((self.arch_params['vrf_depth'], self.arch_params['lanes']),dtype = self.ac_data_type)  
-		self.mfu0_vrf0  = np.zeros((self.arch_params['vrf_depth'], self.arch_params['lanes']),dtype = self.ac_data_type)
-		self.mfu0_vrf1  = np.zeros((self.arch_params['vrf_depth'], self.arch_params['lanes']),dtype = self.ac_data_type)
-		self.mfu1_vrf0  = np.zeros((self.arch_params['vrf_depth'], self.arch_params['lanes']),dtype = self.ac_data_type)
-		self.mfu1_vrf1  = np.zeros((self.arch_params['vrf_depth'], self.arch_params['lanes']),dtype = self.ac_data_type)
+		# Most recent chain writing back each vector (name -> (position in inst_q, chain)), used for tagging
+		self.last_writer = {}
+		# First chain of the current routine (chains before it were already scheduled by end_npu_program)
+		self.sched_start = 0
+
+		# Architecture states (allocated lazily, the depth axis only grows up to the highest written word -- see grow_state)
+		self.mrfs = np.zeros((self.arch_params['tiles'], self.arch_params['dpes'], 0, self.arch_params['lanes']), dtype=self.in_data_type)
+		self.mvu_vrfs   = np.zeros((self.arch_params['tiles'], 0, self.arch_params['lanes']), dtype = self.in_data_type)
+		self.ext_vrf = np.zeros((0, self.arch_params['lanes']),dtype = self.ac_data_type)  
+		self.mfu0_vrf0  = np.zeros((0, self.arch_params['lanes']),dtype = self.ac_data_type)
+		self.mfu0_vrf1  = np.zeros((0, self.arch_params['lanes']),dtype = self.ac_data_type)
+		self.mfu1_vrf0  = np.zeros((0, self.arch_params['lanes']),dtype = self.ac_data_type)
+		self.mfu1_vrf1  = np.zeros((0, self.arch_params['lanes']),dtype = self.ac_data_type)
 
 		# Instruction, input and golden output queues
 		self.inst_q = []
 		self.ibuf_q = []
 		self.golden_obuf_q = []
 		self.fsim = None
+		# FSim snapshots (architecture state every fsim_snapshot chains) and first (chain, row) output mismatch
+		self.fsim_snapshots = []
+		self.fsim_mismatch = None
 
 		# Instruction field width parameters
 		self.NTAGW = 0
@@ -81,53 +140,163 @@ class npu:
 		self.MIW_EVRF = 0
 		self.MIW_MVU = 0
 		self.MICW = 0
-		self.mvu_minst = 0
-		self.evrf_minst = 0
-		self.mfu0_minst = 0
-		self.mfu1_minst = 0
-		self.ld_minst = 0
-		self.minst_chain = 0
+		# VLIW field layout as (macro-instruction, field, bit offset, width) and the 64-bit words per instruction
+		self.inst_fields = []
+		self.inst_words_per_chain = 0
+		# Encoded instructions of the FSim checkpoints (see checkpoint_inst_words)
+		self.inst_words = {}
 
 		self.operands = []
 		self.unsupported_layers = []
 		self.ops = 0
+		# Quantization scales of the front-end layers (layer name -> weight matrix scales) and inputs ('input')
+		self.quant_scales = {}
+
+		# Peak-memory report of the flow stages (stage, current bytes, peak bytes, architecture state bytes)
+		self.mem_report = []
+
+	# This function grows the depth axis (second to last) of an architecture state array so that it holds at least
+	# depth words. Growth is geometric and capped at the architecture depth; new words are zero.
+	def grow_state(self, name, depth):
+		state = getattr(self, name)
+		cur_depth = state.shape[-2]
+		if(depth <= cur_depth):
+			return state
+		max_depth = self.arch_params['mrf_depth'] if name == 'mrfs' else self.arch_params['vrf_depth']
+		assert depth <= max_depth, 'Cannot grow ' + name + ' beyond ' + str(max_depth) + ' words'
+		new_depth = min(max(depth, 2 * cur_depth), max_depth)
+		new_state = np.zeros(state.shape[:-2] + (new_depth, state.shape[-1]), dtype=state.dtype)
+		new_state[..., :cur_depth, :] = state
+		setattr(self, name, new_state)
+		return new_state
+
+	# This function returns an architecture state padded with zeros to the full architecture depth
+	def full_state(self, state, depth):
+		if(state.shape[-2] >= depth):
+			return state
+		padded = np.zeros(state.shape[:-2] + (depth, state.shape[-1]), dtype=state.dtype)
+		padded[..., :state.shape[-2], :] = state
+		return padded
+
+	# Bytes held by the compiler and FSim architecture states (MRFs are shared, read-only VRF views are not counted)
+	def state_bytes(self):
+		total = self.mrfs.nbytes
+		for name in ['mvu_vrfs', 'ext_vrf', 'mfu0_vrf0', 'mfu0_vrf1', 'mfu1_vrf0', 'mfu1_vrf1']:
+			total += getattr(self, name).nbytes
+			if(self.fsim is not None and getattr(self.fsim, name).flags.owndata):
+				total += getattr(self.fsim, name).nbytes
+		return total
+
+	# Record the current and peak traced memory of a flow stage (only if -mem_report tracing is active)
+	def record_mem_stage(self, stage):
+		if(not tracemalloc.is_tracing()):
+			return
+		current, peak = tracemalloc.get_traced_memory()
+		self.mem_report.append((stage, current, peak, self.state_bytes()))
+		tracemalloc.reset_peak()
+
+	def print_mem_report(self):
+		print(bcolors.HEADER + '=== Peak Memory Report ===' + bcolors.RESET)
+		print('{:<28}{:>14}{:>14}{:>14}'.format('Stage', 'Current (MB)', 'Peak (MB)', 'State (MB)'))
+		for stage, current, peak, state in self.mem_report:
+			print('{:<28}{:>14.3f}{:>14.3f}{:>14.3f}'.format(stage, current / 1e6, peak / 1e6, state / 1e6))
+		print('{:<28}{:>28.3f}'.format('Flow peak', max([peak for _, _, peak, _ in self.mem_report] + [0]) / 1e6))
+
+	# Key of a program in the compile cache: hash of the model description (front-end specific), the seed of the
+	# synthetic data, the architecture parameters, the flow options that change compilation and the compiler version
+	def compile_key(self, model_desc):
+		desc = {
+			'model'   : model_desc,
+			'seed'    : self.flow_opts['seed'],
+			'arch'    : self.arch_params,
+			'opts'    : dict((opt, self.flow_opts[opt]) for opt in self.CACHE_OPTS),
+			'version' : compiler_version()
+		}
+		return hashlib.sha256(json.dumps(desc, sort_keys=True, default=str).encode()).hexdigest()
+
+	# This function stores the compiled program in the compile cache (one directory per key, written to a temporary
+	# directory first so that concurrent runs never see a partial entry)
+	def save_compiled(self, key):
+		cache_dir = self.flow_opts['cache_dir']
+		entry = os.path.join(cache_dir, key)
+		if os.path.isdir(entry):
+			return
+		os.makedirs(cache_dir, exist_ok=True)
+		tmp_entry = tempfile.mkdtemp(dir=cache_dir)
+		os.chmod(tmp_entry, 0o755)
+		for name in self.CACHE_ARRAYS:
+			np.save(os.path.join(tmp_entry, name + '.npy'), np.asarray(getattr(self, name)))
+		with open(os.path.join(tmp_entry, 'state.pkl'), 'wb') as state_file:
+			pickle.dump(dict((name, getattr(self, name)) for name in self.CACHE_STATE), state_file, pickle.HIGHEST_PROTOCOL)
+		try:
+			os.rename(tmp_entry, entry)
+		except OSError:
+			shutil.rmtree(tmp_entry)
+
+	# This function restores a compiled program from the compile cache. Returns False if there is no entry for the key.
+	def load_compiled(self, key):
+		entry = os.path.join(self.flow_opts['cache_dir'], key)
+		if not os.path.isfile(os.path.join(entry, 'state.pkl')):
+			return False
+		for name in self.CACHE_ARRAYS:
+			setattr(self, name, np.load(os.path.join(entry, name + '.npy'), mmap_mode='c'))
+		with open(os.path.join(entry, 'state.pkl'), 'rb') as state_file:
+			for name, value in pickle.load(state_file).items():
+				setattr(self, name, value)
+		print(bcolors.OKGREEN + 'Loaded compiled NPU program from cache (' + key[:12] + ')' + bcolors.RESET)
+		return True
 
 	# This function is used to allocate memory of a specific number of words (size) in a specific memory space.
 	# It returns the start address of the allocated memory or -1 if allocation failed.
 	def alloc_space(self, space, size):
-		alloc_addr = -1
-		idx = 0
 		assert space in self.mem_space.keys(), 'No such memory space exists'
-		space_depth = self.mem_space[space].size
-
-		# Start from address 0 in the specified memory space and look for the first empty contiguous location of the required size
-		while (idx < space_depth and alloc_addr == -1):
-			assert self.mem_space[space][idx] != -1, 'Something wrong with allocation'
-			if (self.mem_space[space][idx] == 0):
-				can_allocate = True
-				for i in range(1, size):
-					if(idx+i >= space_depth):
-						can_allocate = False
-						idx = space_depth
-						break
-					if (self.mem_space[space][idx+i] != 0):
-						can_allocate = False
-						idx = idx + i + self.mem_space[space][idx+i]
-						break
-				if (can_allocate):
-					self.mem_space[space][idx] = size
-					for i in range(1, size):
-						self.mem_space[space][idx+i] = -1
-					alloc_addr = idx
-					idx = space_depth
-			else:
-				idx = idx + self.mem_space[space][idx]
+		self.release_frees()
+		alloc_addr = self.mem_space[space].alloc(size)
 
-		if(space == 'mvu_mrf'):
+		if(space == 'mvu_mrf' and alloc_addr != -1):
 			self.mrf_filled_depth += size
 
 		return alloc_addr
 
+	# Return the words of freed vectors to their allocators once all FIFOs are empty after the last chain that was queued
+	# when they were freed. The last chain of the queue can still be extended, so by default the FIFO occupancy is only
+	# followed up to the chain before it.
+	def release_frees(self, end=None):
+		if(not self.pending_frees):
+			return
+		end = len(self.inst_q) - 1 if end is None else end
+		for inst in lower_chains(self.inst_q[self.fifo_checked:end], self.arch_params['tiles']):
+			update_fifo_occupancy(self.fifo_occupancy, inst, self.arch_params['dpes'], self.arch_params['lanes'])
+			self.fifo_checked += 1
+			if(not any(self.fifo_occupancy)):
+				while(self.pending_frees and self.pending_frees[0][0] <= self.fifo_checked):
+					_, space, addr = self.pending_frees.pop(0)
+					self.mem_space[space].free(addr)
+
+	# Print the occupancy and fragmentation statistics of all memory spaces
+	def print_alloc_report(self):
+		print(bcolors.HEADER + '=== Memory Allocation Report (' + self.flow_opts['alloc_policy'] + '-fit) ===' + bcolors.RESET)
+		print('{:<10}{:>8}{:>8}{:>8}{:>8}{:>9}{:>10}{:>8}{:>8}'.format('Space', 'Depth', 'Used', 'Peak', 'Allocs', 'Frees', 'Blocks', 'Max', 'Frag'))
+		for space, allocator in self.mem_space.items():
+			st = allocator.stats()
+			print('{:<10}{:>8}{:>8}{:>8}{:>8}{:>9}{:>10}{:>8}{:>8.3f}'.format(space, st['depth'], st['used'], st['peak'], st['allocs'], \
+				st['frees'], st['free_blocks'], st['largest_free'], st['fragmentation']))
+
+	# Record that the chain at position pos of the instruction queue writes back the named vector
+	def record_writer(self, name, pos=-1):
+		if(pos < 0):
+			pos += len(self.inst_q)
+		self.last_writer[name] = (pos, self.inst_q[pos])
+
+	# Return the write back count of the most recent chain that writes back one of the named vectors (0 if none)
+	def producer_tag(self, names):
+		latest = None
+		for name in names:
+			writer = self.last_writer.get(name)
+			if(writer is not None and (latest is None or writer[0] > latest[0])):
+				latest = writer
+		return latest[1].wb_so_far if latest is not None else 0
+
 	# This function sets all the parameters for instruction field widths based on those specified by the user
 	def set_inst_params(self):
 		self.NTAGW = int(math.ceil(math.log(self.arch_params['max_tag'], 2)))
@@ -151,241 +320,169 @@ class npu:
 			print('MIW_LD = ' + str(self.MIW_LD))
 			print('MIW_MFU = ' + str(self.MIW_MFU))
 			print('MIW_EVRF = ' + str(self.MIW_EVRF)) 
+		# Bit offsets of the instruction fields (see inst_layout)
+		self.inst_fields = []
+		offset = 0
+		for minst, fields, minst_width in self.inst_layout():
+			assert sum([width for field, width in fields]) == minst_width, 'Field layout of ' + minst + ' does not match its width'
+			for field, width in fields:
+				self.inst_fields.append((minst, field, offset, width))
+				offset += width
+		self.inst_words_per_chain = int(math.ceil(self.MICW / 64.0))
+
+	# Opcode bits of the MFU add/sub/max and mul units (activation functions are set as pass-through,
+	# check limitations listed at the top of this file)
+	MFU_ADD_BITS = {ADD_OPS['add']: 0x02, ADD_OPS['sub_a_b']: 0x04, ADD_OPS['sub_b_a']: 0x06, ADD_OPS['max']: 0x08}
+	MFU_MUL_BITS = {MUL_OPS['mul']: 0x01}
+
+	# VLIW instruction layout: the macro-instructions of a chain from the LSB, each as a list of (field, width) from
+	# its LSB. The widths follow set_inst_params and all the fields of a disabled macro-instruction are zero.
+	def inst_layout(self):
+		mfu_fields = [('batch', 2), ('op', 7), ('tag', self.NTAGW), ('size', self.NSIZEW)] + \
+			[(vrf + '_rd_base' + str(b), self.VRFAW) for vrf in ['vrf1', 'vrf0'] for b in [2, 1, 0]]
+		return [
+			('ld', [('write_to_obuf', 1), ('last_flag', 1), ('batch', 2), ('valid', 1), ('wb', 1), ('wr_size', self.NSIZEW)] + \
+				[(vrf + '_wr_base' + str(b), self.VRFAW) for vrf in ['vrf_id1', 'vrf_id0'] for b in [2, 1, 0]] + \
+				[('dest', 2*self.NVRF)], self.MIW_LD),
+			('mfu1', mfu_fields, self.MIW_MFU),
+			('mfu0', mfu_fields, self.MIW_MFU),
+			('evrf', [('batch', 2), ('valid', 1), ('tag', self.NTAGW), ('op', 1), ('rd_size', self.NSIZEW)] + \
+				[('rd_base' + str(b), self.VRFAW) for b in [2, 1, 0]], self.MIW_EVRF),
+			('mvu', [('valid', 1), ('tag', self.NTAGW), ('words_per_row', self.NSIZEW), ('mrf_rd_size', self.NSIZEW), \
+				('mrf_rd_base', self.MRFAW), ('vrf_rd_size', self.NSIZEW)] + \
+				[('vrf_rd_base' + str(b), self.VRFAW) for b in [2, 1, 0]], self.MIW_MVU)]
+
+	# Chain attributes gathered by inst_field_values: scalars and per-batch base address lists
+	INST_SCALARS = ['batch', 'mvu_op', 'mvu_tag', 'mvu_words_per_row', 'mvu_mrf_rd_sz', 'mvu_mrf_rd_base', 'mvu_vrf_rd_sz', \
+		'extvrf_op', 'extvrf_tag', 'extvrf_rd_sz', 'mfu0_act_op', 'mfu0_add_op', 'mfu0_mul_op', 'mfu0_tag', 'mfu0_vrf_rd_size', \
+		'mfu1_act_op', 'mfu1_add_op', 'mfu1_mul_op', 'mfu1_tag', 'mfu1_vrf_rd_size', 'loader_op', 'write_to_obuf', 'last_flag', \
+		'vrf_id0_wr_size', 'vrf_id0', 'vrf_id1']
+	INST_BASES = ['mvu_vrf_rd_base', 'extvrf_rd_base', 'mfu0_vrf0_rd_base', 'mfu0_vrf1_rd_base', 'mfu1_vrf0_rd_base', \
+		'mfu1_vrf1_rd_base', 'vrf_id0_wr_base', 'vrf_id1_wr_base']
+
+	# Field values of a list of lowered chains as a (chains, fields) array in the order of inst_fields. The chain
+	# attributes are gathered in one pass and every field is then computed for all chains at once.
+	def inst_field_values(self, insts):
+		num_insts = len(insts)
+		scalars = np.fromiter(itertools.chain.from_iterable(map(operator.attrgetter(*self.INST_SCALARS), insts)), \
+			dtype=np.int64, count=num_insts*len(self.INST_SCALARS)).reshape(num_insts, -1)
+		base_lists = [operator.attrgetter(*self.INST_BASES)(inst) for inst in insts]
+		base_values = np.fromiter(itertools.chain.from_iterable(itertools.chain.from_iterable(base_lists)), dtype=np.int64)
+		if(len(base_values) != num_insts*len(self.INST_BASES)*3):
+			# Chains with a batch smaller than 3 (unused base addresses are zero)
+			base_values = np.array([[(list(b) + [0, 0])[:3] for b in bases] for bases in base_lists], dtype=np.int64)
+		base_values = base_values.reshape(num_insts, len(self.INST_BASES), 3)
+		def col(attr):
+			return scalars[:, self.INST_SCALARS.index(attr)]
+		def bases(attr):
+			return base_values[:, self.INST_BASES.index(attr)]
+		values = {}
+		enables = {}
+		batch = col('batch')
+		ones = np.ones(num_insts, dtype=np.int64)
+
+		# MVU
+		enables['mvu'] = (col('mvu_op') != MVU_OPS['nop'])
+		values['mvu', 'valid'] = ones
+		values['mvu', 'tag'] = col('mvu_tag')
+		values['mvu', 'words_per_row'] = col('mvu_words_per_row')
+		values['mvu', 'mrf_rd_size'] = col('mvu_mrf_rd_sz')
+		values['mvu', 'mrf_rd_base'] = col('mvu_mrf_rd_base')
+		values['mvu', 'vrf_rd_size'] = col('mvu_vrf_rd_sz')
+		rd_base = bases('mvu_vrf_rd_base')
+		for b in range(3):
+			values['mvu', 'vrf_rd_base' + str(b)] = rd_base[:, b]
+
+		# eVRF (op is 0 for a move and 1 for a read from the eVRF)
+		evrf_op = col('extvrf_op')
+		enables['evrf'] = (evrf_op != EVRF_OPS['nop'])
+		values['evrf', 'batch'] = batch
+		values['evrf', 'valid'] = ones
+		values['evrf', 'tag'] = col('extvrf_tag')
+		values['evrf', 'op'] = (evrf_op != EVRF_OPS['move'])
+		values['evrf', 'rd_size'] = col('extvrf_rd_sz')
+		rd_base = bases('extvrf_rd_base')
+		for b in range(3):
+			values['evrf', 'rd_base' + str(b)] = rd_base[:, b]
+
+		# MFUs (an MFU is encoded only if none of its stages is a nop)
+		add_bits = np.zeros(len(ADD_OPS), dtype=np.int64)
+		add_bits[list(self.MFU_ADD_BITS.keys())] = list(self.MFU_ADD_BITS.values())
+		mul_bits = np.zeros(len(MUL_OPS), dtype=np.int64)
+		mul_bits[list(self.MFU_MUL_BITS.keys())] = list(self.MFU_MUL_BITS.values())
+		for mfu in ['mfu0', 'mfu1']:
+			add_op = col(mfu + '_add_op')
+			mul_op = col(mfu + '_mul_op')
+			enables[mfu] = (col(mfu + '_act_op') != ACT_OPS['nop']) & (add_op != ADD_OPS['nop']) & (mul_op != MUL_OPS['nop'])
+			values[mfu, 'batch'] = batch
+			values[mfu, 'op'] = 0x40 + add_bits[add_op] + mul_bits[mul_op]
+			values[mfu, 'tag'] = col(mfu + '_tag')
+			values[mfu, 'size'] = col(mfu + '_vrf_rd_size')
+			for vrf in ['vrf0', 'vrf1']:
+				rd_base = bases(mfu + '_' + vrf + '_rd_base')
+				for b in range(3):
+					values[mfu, vrf + '_rd_base' + str(b)] = rd_base[:, b]
+
+		# Loader (one-hot 2-bit destination fields: 01 for the first destination, 11 for the second one)
+		loader_op = col('loader_op')
+		enables['ld'] = (loader_op != LD_OPS['nop'])
+		values['ld', 'write_to_obuf'] = col('write_to_obuf')
+		values['ld', 'last_flag'] = col('last_flag')
+		values['ld', 'batch'] = batch
+		values['ld', 'valid'] = ones
+		values['ld', 'wb'] = (loader_op == LD_OPS['wb']) | (loader_op == LD_OPS['flush'])
+		values['ld', 'wr_size'] = col('vrf_id0_wr_size')
+		for vrf in ['vrf_id0', 'vrf_id1']:
+			wr_base = bases(vrf + '_wr_base')
+			for b in range(3):
+				values['ld', vrf + '_wr_base' + str(b)] = wr_base[:, b]
+		vrf_id0 = col('vrf_id0')
+		vrf_id1 = col('vrf_id1')
+		values['ld', 'dest'] = np.where(vrf_id0 != VRF_NONE, 0x1 << (2*np.maximum(vrf_id0, 0)), 0) + \
+			np.where(vrf_id1 != VRF_NONE, 0x3 << (2*np.maximum(vrf_id1, 0)), 0)
+
+		fields = np.zeros((num_insts, len(self.inst_fields)), dtype=np.int64)
+		for f, (minst, field, offset, width) in enumerate(self.inst_fields):
+			fields[:, f] = values[minst, field] * enables[minst]
+		return fields
 
-	# This function puts together the macro-instructions into one VLIW instruction (chain)
-	def set_inst(self,inst):
-		self.set_mvu_minst(inst)
-		self.set_evrf_minst(inst)
-		self.set_mfu0_minst(inst)
-		self.set_mfu1_minst(inst)
-		self.set_ld_minst(inst)
-		self.minst_chain = 0
-		shift = 0
-		self.minst_chain += (int(self.ld_minst) << shift)
-		shift += self.MIW_LD
-		self.minst_chain += (int(self.mfu1_minst) << shift)
-		shift += self.MIW_MFU
-		self.minst_chain += (int(self.mfu0_minst) << shift)
-		shift += self.MIW_MFU
-		self.minst_chain += (int(self.evrf_minst) << shift)
-		shift += self.MIW_EVRF
-		self.minst_chain += (int(self.mvu_minst) << shift)
-
-	# This function sets the fields of the MVU macro-instruction
-	def set_mvu_minst(self, inst):		
-		self.mvu_minst=0
-		shift=0
-		if inst.mvu_op_type!='nop':
-			self.mvu_minst=1
-			shift+=1
-			self.mvu_minst+=(int(inst.mvu_tag) << shift)
-			shift+=self.NTAGW
-			self.mvu_minst =(int(inst.mvu_words_per_row) << shift) + self.mvu_minst
-			shift+=self.NSIZEW 
-			self.mvu_minst+=(int(inst.mvu_mrf_rd_sz) << shift)
-			shift+=self.NSIZEW 
-			self.mvu_minst+=(int(inst.mvu_mrf_rd_base) << shift)
-			shift+=self.MRFAW
-			self.mvu_minst+=(int(inst.mvu_vrf_rd_sz) <<shift)
-			shift+=self.NSIZEW 
-			self.mvu_minst =(int(inst.mvu_vrf_rd_base[2])<<shift) + self.mvu_minst
-			shift+=self.VRFAW
-			self.mvu_minst =(int(inst.mvu_vrf_rd_base[1])<<shift) + self.mvu_minst
-			shift+=self.VRFAW
-			self.mvu_minst =(int(inst.mvu_vrf_rd_base[0])<<shift) + self.mvu_minst
-			if(self.mvu_minst < 0):
-				digits = len(bin(self.mvu_minst)[2:])
-				self.mvu_minst = self.mvu_minst + (2**digits)
-
-	# This function sets the fields of the eVRF macro-instruction
-	def set_evrf_minst(self, inst):
-		self.evrf_minst=0
-		shift=0
-		if inst.extvrf_op_type!='nop':
-			self.evrf_minst+=(int(inst.batch)<<shift)
-			shift+=2
-			self.evrf_minst+=(0x1<<shift) # MOV
-			shift+=1
-			self.evrf_minst+=(int(inst.extvrf_tag)<<shift)
-			shift+=self.NTAGW
-			if inst.extvrf_op_type=='move':
-				self.evrf_minst+=(0x0<<shift)
-			else:
-				self.evrf_minst+=(0x1<<shift)
-			shift+=1
-			self.evrf_minst+=(int(inst.extvrf_rd_sz)<<shift)
-			shift+=self.NSIZEW 
-			self.evrf_minst+=(int(inst.extvrf_rd_base[2])<<shift)
-			shift+=self.VRFAW
-			self.evrf_minst+=(int(inst.extvrf_rd_base[1])<<shift)
-			shift+=self.VRFAW
-			self.evrf_minst+=(int(inst.extvrf_rd_base[0])<<shift)
-			if(self.evrf_minst < 0):
-				digits = len(bin(self.evrf_minst)[2:])
-				self.evrf_minst = self.evrf_minst + (2**digits)
-
-	# This function sets the fields of the MFU0 macro-instruction
-	def set_mfu0_minst(self, inst):
-		self.mfu0_minst=0
-		shift=0
-		if (inst.mfu0_act_op_type!='nop' and inst.mfu0_add_op_type!='nop' and inst.mfu0_mul_op_type!='nop'):
-			self.mfu0_minst+=(int(inst.batch)<<shift)
-			shift+=2
-			self.mfu0_minst+=(0x40<<shift)
-			# Activation functions set as pass-through (check limitations listed at the top of this file)
-			#if(inst.mfu0_act_op_type=='relu'):
-			#    self.mfu0_minst+=(0x10<<shift)
-			#elif(inst.mfu0_act_op_type=='sig'):
-			#    self.mfu0_minst+=(0x20<<shift)
-			#elif(inst.mfu0_act_op_type=='tanh'):
-			#    self.mfu0_minst+=(0x30<<shift)
-
-			if(inst.mfu0_add_op_type=='add'):
-				self.mfu0_minst+=(0x02<<shift)
-			elif(inst.mfu0_add_op_type=='sub_a_b'):
-				self.mfu0_minst+=(0x04<<shift)
-			elif(inst.mfu0_add_op_type=='sub_b_a'):
-				self.mfu0_minst+=(0x06<<shift)
-			elif(inst.mfu0_add_op_type=='max'):
-				self.mfu0_minst+=(0x08<<shift)
-
-			if(inst.mfu0_mul_op_type=='mul'):
-				self.mfu0_minst+=(0x01<<shift)
-
-			shift+=7
-			self.mfu0_minst+=(int(inst.mfu0_tag)<<shift)
-			shift+=self.NTAGW 
-			self.mfu0_minst+=(int(inst.mfu0_vrf_rd_size)<<shift)
-			shift+=self.NSIZEW 
-			self.mfu0_minst+=(int(inst.mfu0_vrf1_rd_base[2])<<shift)
-			shift+=self.VRFAW
-			self.mfu0_minst+=(int(inst.mfu0_vrf1_rd_base[1])<<shift)
-			shift+=self.VRFAW
-			self.mfu0_minst+=(int(inst.mfu0_vrf1_rd_base[0])<<shift)
-			shift+=self.VRFAW
-			self.mfu0_minst+=(int(inst.mfu0_vrf0_rd_base[2])<<shift)
-			shift+=self.VRFAW
-			self.mfu0_minst+=(int(inst.mfu0_vrf0_rd_base[1])<<shift)
-			shift+=self.VRFAW
-			self.mfu0_minst+=(int(inst.mfu0_vrf0_rd_base[0])<<shift)
-
-	# This function sets the fields of the MFU1 macro-instruction
-	def set_mfu1_minst(self, inst):
-		self.mfu1_minst=0
-		shift=0
-		if (inst.mfu1_act_op_type!='nop' and inst.mfu1_add_op_type!='nop' and inst.mfu1_mul_op_type!='nop'):
-			self.mfu1_minst+=(int(inst.batch)<<shift)
-			shift+=2
-			self.mfu1_minst+=(0x40<<shift)
-			# Activation functions set as pass-through (check limitations listed at the top of this file)
-			#if(inst.mfu1_act_op_type=='relu'):
-			#    self.mfu1_minst+=(0x10<<shift)
-			#elif(inst.mfu1_act_op_type=='sig'):
-			#    self.mfu1_minst+=(0x20<<shift)
-			#elif(inst.mfu1_act_op_type=='tanh'):
-			#    self.mfu1_minst+=(0x30<<shift)
-
-			if(inst.mfu1_add_op_type=='add'):
-				self.mfu1_minst+=(0x02<<shift)
-			elif(inst.mfu1_add_op_type=='sub_a_b'):
-				self.mfu1_minst+=(0x04<<shift)
-			elif(inst.mfu1_add_op_type=='sub_b_a'):
-				self.mfu1_minst+=(0x06<<shift)
-			elif(inst.mfu1_add_op_type=='max'):
-				self.mfu1_minst+=(0x08<<shift)
-
-			if(inst.mfu1_mul_op_type=='mul'):
-				self.mfu1_minst+=(0x01<<shift)
-
-			shift+=7
-			self.mfu1_minst+=(int(inst.mfu1_tag)<<shift)
-			shift+=self.NTAGW 
-			self.mfu1_minst+=(int(inst.mfu1_vrf_rd_size)<<shift)
-			shift+=self.NSIZEW 
-			self.mfu1_minst+=(int(inst.mfu1_vrf1_rd_base[2])<<shift)
-			shift+=self.VRFAW
-			self.mfu1_minst+=(int(inst.mfu1_vrf1_rd_base[1])<<shift)
-			shift+=self.VRFAW
-			self.mfu1_minst+=(int(inst.mfu1_vrf1_rd_base[0])<<shift)
-			shift+=self.VRFAW
-			self.mfu1_minst+=(int(inst.mfu1_vrf0_rd_base[2])<<shift)
-			shift+=self.VRFAW
-			self.mfu1_minst+=(int(inst.mfu1_vrf0_rd_base[1])<<shift)
-			shift+=self.VRFAW
-			self.mfu1_minst+=(int(inst.mfu1_vrf0_rd_base[0])<<shift)
-
-
-	# This function sets the fields of the Loader macro-instruction
-	def set_ld_minst(self, inst):
-		self.ld_minst=0
-		shift=0
-		if inst.loader_src!='nop':
-			self.ld_minst=(int(inst.write_to_obuf)<<shift)
-			shift+=1
-			self.ld_minst+=(int(inst.last_flag)<<shift)
-			shift+=1
-			self.ld_minst+=(int(inst.batch)<<shift)
-			shift+=2
-			self.ld_minst+=(0x1<<shift)
-			shift+=1
-			if inst.loader_src=='wb':
-				self.ld_minst+=(0x1<<shift)
-			elif inst.loader_src=='flush':
-				self.ld_minst+=(0x1<<shift)
-			else:
-				self.ld_minst+=(0x0<<shift)
-			shift+=1 
-			self.ld_minst+=(int(inst.vrf_id0_wr_size)<<shift)
-			shift+=self.NSIZEW 
-			self.ld_minst+=(int(inst.vrf_id1_wr_base[2])<<shift)
-			shift+=self.VRFAW
-			self.ld_minst+=(int(inst.vrf_id1_wr_base[1])<<shift)
-			shift+=self.VRFAW
-			self.ld_minst+=(int(inst.vrf_id1_wr_base[0])<<shift)
-			shift+=self.VRFAW
-			self.ld_minst+=(int(inst.vrf_id0_wr_base[2])<<shift)
-			shift+=self.VRFAW
-			self.ld_minst+=(int(inst.vrf_id0_wr_base[1])<<shift)
-			shift+=self.VRFAW
-			self.ld_minst+=(int(inst.vrf_id0_wr_base[0])<<shift)
-			shift+=self.VRFAW
-			if(inst.vrf_id0_op=='--'):
-				vrf_id=0x0
-			elif(inst.vrf_id0_op[0:3]=='mvu'):
-				vrf_id=inst.vrf_id0_op.split(".")
-				vrf_id=0x1<<(2*int(vrf_id[0][3:]))
-			elif(inst.vrf_id0_op=='extvrf'):
-				vrf_id=0x1<<(2*self.NTILE)
-			elif(inst.vrf_id0_op=='mfu0.vrf0'):
-				vrf_id=0x1<<(2*self.NTILE+2)
-			elif(inst.vrf_id0_op=='mfu0.vrf1'):
-				vrf_id=0x1<<(2*self.NTILE+4)
-			elif(inst.vrf_id0_op=='mfu1.vrf0'):
-				vrf_id=0x1<<(2*self.NTILE+6)
-			elif(inst.vrf_id0_op=='mfu1.vrf1'):
-				vrf_id=0x1<<(2*self.NTILE+8)
-			else:
-				vrf_id=0x0
-			self.ld_minst+=vrf_id<<shift
-
-			if(inst.vrf_id1_op=='--'):
-				vrf_id=0x0
-			elif(inst.vrf_id1_op[0:3]=='mvu'):
-				vrf_id=inst.vrf_id1_op.split(".")
-				vrf_id=0x3<<(2*int(vrf_id[0][3:]))
-			elif(inst.vrf_id1_op=='extvrf'):
-				vrf_id=0x3<<(2*self.NTILE)
-			elif(inst.vrf_id1_op=='mfu0.vrf0'):
-				vrf_id=0x3<<(2*self.NTILE+2)
-			elif(inst.vrf_id1_op=='mfu0.vrf1'):
-				vrf_id=0x3<<(2*self.NTILE+4)
-			elif(inst.vrf_id1_op=='mfu1.vrf0'):
-				vrf_id=0x3<<(2*self.NTILE+6)
-			elif(inst.vrf_id1_op=='mfu1.vrf1'):
-				vrf_id=0x3<<(2*self.NTILE+8)
-			else:
-				vrf_id=0x0
-			self.ld_minst+=vrf_id<<shift
+	'''
+	This function encodes a list of chains into VLIW instructions. The result is a (chains, inst_words_per_chain)
+	array of little-endian 64-bit words where bit i of an instruction is bit i%64 of its word i//64. Each field is
+	packed for all chains at once, and the words are decoded back to check that every value fits its field.
+	'''
+	def encode_insts(self, insts):
+		insts = lower_chains(insts, self.NTILE)
+		values = self.inst_field_values(insts)
+		words = np.zeros((len(insts), self.inst_words_per_chain), dtype='<u8')
+		for f, (minst, field, offset, width) in enumerate(self.inst_fields):
+			value = values[:, f].astype(np.uint64) & np.uint64((1 << width) - 1)
+			words[:, offset // 64] |= value << np.uint64(offset % 64)
+			if(offset % 64 + width > 64):
+				words[:, offset // 64 + 1] |= value >> np.uint64(64 - (offset % 64))
+		mismatches = np.argwhere(self.decode_insts(words) != values)
+		assert len(mismatches) == 0, 'Field ' + '.'.join(self.inst_fields[mismatches[0][1]][:2]) + ' of instruction ' + \
+			str(mismatches[0][0]) + ' does not fit in ' + str(self.inst_fields[mismatches[0][1]][3]) + ' bits'
+		return words
+
+	# This function decodes (chains, inst_words_per_chain) VLIW words back into the (chains, fields) values of inst_fields
+	def decode_insts(self, words):
+		values = np.zeros((len(words), len(self.inst_fields)), dtype=np.int64)
+		for f, (minst, field, offset, width) in enumerate(self.inst_fields):
+			value = words[:, offset // 64] >> np.uint64(offset % 64)
+			if(offset % 64 + width > 64):
+				value |= words[:, offset // 64 + 1] << np.uint64(64 - (offset % 64))
+			values[:, f] = (value & np.uint64((1 << width) - 1)).astype(np.int64)
+		return values
+
+	# Encoded instructions of an FSim checkpoint. They are encoded once and shared by all the dump paths.
+	def checkpoint_inst_words(self, checkpoint_name):
+		if checkpoint_name not in self.inst_words:
+			self.set_inst_params()
+			with open('./dump/' + checkpoint_name + '-inst', 'rb') as src_file:
+				insts = np.load(src_file, allow_pickle=True, fix_imports=True, encoding='latin1')
+			self.inst_words[checkpoint_name] = self.encode_insts(insts)
+		return self.inst_words[checkpoint_name]
 
 	'''
 	This function is used for allocating memory for vectors and matrices depending on the dimensions
@@ -408,19 +505,37 @@ class npu:
 			if (space_name != 'temp'):
 				allocated_mem.alloc_addr = self.alloc_space(space_name, allocated_mem.word_count)
 				assert allocated_mem.alloc_addr != -1, 'Cannot allocate vector ' + name
+				if(self.flow_opts['vrf_reuse']):
+					self.virtual_blocks[space_name].append((allocated_mem.alloc_addr, allocated_mem.word_count, allocated_mem))
 		else:
 			assert values != [], 'You have to specify matrix data'
 			allocated_mem = matrix(name, dimension_x, dimension_y, space_name, tiles, dpes, lanes, self.in_data_type, values)
 			allocated_mem.alloc_addr = self.alloc_space(space_name, allocated_mem.word_count)
 			assert allocated_mem.alloc_addr != -1, 'Cannot allocate matrix ' + name
-			tile_cols = allocated_mem.dimension_x_padded / tiles
-			tile_rows = allocated_mem.dimension_y_padded / dpes
-			for y in range(allocated_mem.dimension_y_padded):
-				for x in range(allocated_mem.dimension_x_padded):
-					self.mrfs[int(x / tile_cols)][int(y % dpes)][allocated_mem.alloc_addr + int((x % tile_cols) / lanes) + (int(y / dpes) * int(tile_cols/lanes))][int(x % lanes)] = allocated_mem.data[y][x]
+			self.grow_state('mrfs', allocated_mem.alloc_addr + allocated_mem.word_count)
+			mrf_layout(allocated_mem.data, tiles, dpes, lanes, \
+				self.mrfs[:, :, allocated_mem.alloc_addr:allocated_mem.alloc_addr + allocated_mem.word_count, :])
 
 		return allocated_mem
 
+	'''
+	This function releases the memory words of a vector allocated by malloc so that later allocations in the same
+	memory space can reuse them. Matrices are persistent (the MRFs are loaded once before the program runs) and temp
+	vectors are never allocated, so only vectors in the VRF memory spaces can be freed. Tags only order reads after
+	writes, so a later load could overwrite the words before a queued chain has read them. The words are therefore
+	only handed out again after the next point where all FIFOs are empty (see release_frees), when every chain queued
+	before free() has finished its reads. This is the same rule reuse_vrfs uses.
+	'''
+	def free(self, vec):
+		assert vec.space_name != 'temp', 'Vector ' + vec.name + ' is a temp variable and cannot be freed'
+		assert vec.space_name != 'mvu_mrf', 'Matrix ' + vec.name + ' is persistent and cannot be freed'
+		assert vec.alloc_addr != -1, 'Vector ' + vec.name + ' is not allocated'
+		# With -vrf_reuse, words are reclaimed by the liveness analysis in reuse_vrfs
+		if(self.flow_opts['vrf_reuse']):
+			return
+		self.pending_frees.append((len(self.inst_q), vec.space_name, vec.alloc_addr))
+		vec.alloc_addr = -1
+
 	'''
 	This function performs matrix-vector multiplication. Returns a vector data structure.
 	vector_in: input vector that resides in the mvu_vrf memory space.
@@ -449,10 +564,7 @@ class npu:
 			names.append(vectors[i].name)
 
 		#Calculate the tag for this matvec operation based on the most recently committed vector
-		for i in reversed(self.inst_q):
-			if(i.results[-1] in names):
-				tag = i.wb_so_far
-				break
+		tag = self.producer_tag(names)
 		if (tag > self.highest_tag_so_far):
 			self.highest_tag_so_far = tag
 
@@ -504,10 +616,7 @@ class npu:
 		for i in range(batch):
 			names.append(vectors[i].name)
 
-		for i in reversed(self.inst_q):
-			if(i.results[-1] in names):
-				tag = i.wb_so_far
-				break
+		tag = self.producer_tag(names)
 		if (tag > self.highest_tag_so_far):
 			self.highest_tag_so_far = tag
 		
@@ -673,11 +782,7 @@ class npu:
 		names = []
 		for b in range(batch):
 			names.append(vrf_vectors[b].name)
-		tag = 0
-		for i in reversed(self.inst_q):
-			if(i.results[-1] in names):
-				tag = i.wb_so_far
-				break
+		tag = self.producer_tag(names)
 		if (tag > self.highest_tag_so_far):
 			self.highest_tag_so_far = tag
 		prev_inst = self.inst_q[-1]
@@ -778,11 +883,7 @@ class npu:
 		names = []
 		for b in range(batch):
 			names.append(vrf_vectors[b].name)
-		tag = 0
-		for i in reversed(self.inst_q):
-			if(i.results[-1] in names):
-				tag = i.wb_so_far
-				break
+		tag = self.producer_tag(names)
 		if (tag > self.highest_tag_so_far):
 			self.highest_tag_so_far = tag
 		prev_inst = self.inst_q[-1]
@@ -885,6 +986,7 @@ class npu:
 		prev_inst.write_to_obuf = write_to_obuf
 		prev_inst.loader_src = 'wb'
 		prev_inst.results[-1] = dst1[0].name
+		self.record_writer(dst1[0].name)
 
 		# Do the same for second destination if exists
 		if (dst2 != None):
@@ -938,6 +1040,7 @@ class npu:
 				for i in range(7, -1, -1):
 					inst.flags[i] = True
 				self.inst_q.append(inst)
+				self.record_writer(dst[0].name)
 				remaining_entries -= dst[0].word_count
 
 	'''
@@ -990,6 +1093,7 @@ class npu:
 				for i in range(7, -1, -1):
 					inst.flags[i] = True
 				self.inst_q.append(inst)
+				self.record_writer(dst1[0].name)
 				remaining_entries -= dst1[0].word_count
 
 	'''
@@ -1047,7 +1151,7 @@ class npu:
 			if(len(vectors[0].data) > len(dst1[0].data)):
 				wb_count = self.inst_q[-1].wb_so_far
 				inst = chain(batch)
-				#wb_count = wb_count + 1
+				wb_count = wb_count + 1
 				inst.wb_so_far = wb_count
 				inst.vrf_id0_wr_size = int((len(vectors[0].data) - len(dst1[0].data))/self.arch_params['lanes'])
 				inst.loader_src = 'flush'
@@ -1093,7 +1197,7 @@ class npu:
 			if(len(vectors[0].data) > len(dst1[0].data)):
 				wb_count = self.inst_q[-1].wb_so_far
 				inst = chain(batch)
-				#wb_count = wb_count + 1
+				wb_count = wb_count + 1
 				inst.wb_so_far = wb_count
 				inst.vrf_id0_wr_size = int((len(vectors[0].data) - len(dst1[0].data))/self.arch_params['lanes'])
 				inst.loader_src = 'flush'
@@ -1136,7 +1240,7 @@ class npu:
 			if(remaining_entries > 0):
 				inst = chain(batch);
 				inst.results[-1] = dst1[0].name
-				#wb_count = wb_count + 1
+				wb_count = wb_count + 1
 				inst.wb_so_far = wb_count
 				inst.vrf_id0_op = '--'
 				for b in range(batch):
@@ -1148,6 +1252,7 @@ class npu:
 				for i in range(7, -1, -1):
 					inst.flags[i] = True
 				self.inst_q.append(inst)
+				self.record_writer(dst1[0].name)
 				remaining_entries -= dst1[0].word_count
 
 		#Functional Model
@@ -1166,7 +1271,7 @@ class npu:
 		if(len(vectors[0].data) > len(dst1[0].data)):
 			wb_count = self.inst_q[-1].wb_so_far
 			inst = chain(batch)
-			#wb_count = wb_count + 1
+			wb_count = wb_count + 1
 			inst.wb_so_far = wb_count
 			inst.vrf_id0_wr_size = int((len(vectors[0].data) - len(dst1[0].data))/self.arch_params['lanes'])
 			inst.loader_src = 'flush'
@@ -1221,6 +1326,7 @@ class npu:
 				inst.write_to_obuf = write_to_obuf
 				inst.flags[-1] = True
 				self.inst_q.append(inst)
+				self.record_writer(vectors[0].name)
 		else:
 			inst = chain(batch);
 			inst.results[-1] = vectors[0].name
@@ -1244,6 +1350,7 @@ class npu:
 			inst.write_to_obuf = write_to_obuf
 			inst.flags[-1] = True
 			self.inst_q.append(inst)
+			self.record_writer(vectors[0].name)
 
 		if(write_to_obuf == 1):
 			temp_data = []
@@ -1254,12 +1361,281 @@ class npu:
 				for b in range(batch):
 					self.golden_obuf_q.append(list(temp_data[b][i]))
 
+	# Pipeline stages of a lowered chain as (unit, busy cycles, latency of the first result, latency of the last result,
+	# tag) with the units numbered MVU 0, eVRF 1, MFU0 2, MFU1 3 and LD 4. The MVU issues one MRF word per cycle for all
+	# batch vectors and accumulates rows in chunks of 3 * lanes / 10, so its first result waits for the first chunk and
+	# its last one drains the last chunk of every batch vector. The other units handle one word per cycle.
+	def chain_stages(self, inst):
+		lat = self.PIPELINE_LATENCIES
+		hop = self.CHANNEL_LATENCY
+		stages = []
+		if(inst.mvu_op == MVU_OPS['matvec']):
+			reduction_latency = int(math.ceil(math.log(self.arch_params['tiles'], 2))) + 5
+			mvu_latency = lat['VRF_TO_DPE_LATENCY'] + lat['DPE_MULT_LATENCY'] + lat['DPE_ADDER_LATENCY'] * \
+				int(math.ceil(math.log(self.arch_params['lanes'], 2))) + lat['MVU_ACCUM_LATENCY'] + reduction_latency + hop
+			rows = inst.mvu_mrf_rd_sz // inst.mvu_vrf_rd_sz
+			chunk = 3 * self.arch_params['lanes'] // 10
+			first_rows = chunk if rows > 2 * chunk - 1 else rows
+			last_rows = rows
+			while(last_rows > 2 * chunk - 1):
+				last_rows -= chunk
+			stages.append((0, inst.mvu_mrf_rd_sz, mvu_latency + first_rows * inst.mvu_vrf_rd_sz, \
+				mvu_latency + last_rows * inst.batch, inst.mvu_tag))
+		if(inst.extvrf_op != EVRF_OPS['nop']):
+			evrf_latency = lat['RF_READ_LATENCY'] + lat['RF_WRITE_LATENCY'] + hop
+			stages.append((1, inst.extvrf_rd_sz * inst.batch, evrf_latency, evrf_latency, inst.extvrf_tag))
+		mfu_latency = lat['MFU_ACT_LATENCY'] + lat['MFU_ADD_LATENCY'] + lat['MFU_MUL_LATENCY'] + hop
+		for unit, mfu in [(2, 'mfu0'), (3, 'mfu1')]:
+			if(getattr(inst, mfu + '_en')):
+				stages.append((unit, getattr(inst, mfu + '_vrf_rd_size') * inst.batch, mfu_latency, mfu_latency, \
+					getattr(inst, mfu + '_tag')))
+		if(inst.loader_op != LD_OPS['nop']):
+			stages.append((4, inst.vrf_id0_wr_size * inst.batch, lat['LD_WB_LATENCY'], lat['LD_WB_LATENCY'], None))
+		return stages
+
+	# Issue a chain on the pipeline model. units holds the cycle at which each unit becomes free and stream the cycle
+	# at which the output FIFO data of the previous chain is available (used by write backs that only drain it); both
+	# are updated in place. No unit starts before ready, or before tag_ready(tag) if given. Returns the cycle the chain
+	# starts and the cycle its results are written back.
+	def issue_chain(self, stages, units, stream, ready, tag_ready=None):
+		start = None
+		flow = max(ready, stream[0]) if (len(stages) == 1 and stages[0][0] == 4) else ready
+		flow_end = flow
+		for unit, cycles, first_latency, last_latency, tag in stages:
+			unit_start = max(units[unit], flow)
+			if(tag_ready is not None and tag is not None):
+				unit_start = max(unit_start, tag_ready(tag))
+			units[unit] = max(unit_start + cycles, flow_end)
+			start = unit_start if start is None else start
+			flow = unit_start + first_latency
+			flow_end = units[unit] + last_latency
+			if(unit != 4):
+				stream[0] = flow
+		return (ready if start is None else start), flow_end
+
+	'''
+	This function is an analytical timing model of the NPU program (enabled with -estimate, which skips the functional
+	and performance simulations). The chains are issued in program order on the pipeline model (chain_stages with the
+	PIPELINE_LATENCIES): each unit starts a chain once it is free, once the results of the previous unit of the chain
+	start arriving and once the write back count reaches its tag. A write back count is reached TAG_UPDATE_LATENCY
+	cycles after the write back of the chain that increments it. Returns the start and finish cycle of every chain and
+	the total number of cycles.
+	'''
+	def estimate_cycles(self):
+		inst_stream = lower_chains(self.inst_q, self.arch_params['tiles'])
+		units = [0] * 5
+		stream = [0]
+		wb_ready = {}
+		starts = np.zeros(len(inst_stream), dtype=int)
+		finishes = np.zeros(len(inst_stream), dtype=int)
+		wb_count = 0
+		for idx, inst in enumerate(inst_stream):
+			starts[idx], finishes[idx] = self.issue_chain(self.chain_stages(inst), units, stream, 0, \
+				lambda tag: wb_ready.get(tag, 0))
+			if(inst.src.wb_so_far != wb_count):
+				wb_count = inst.src.wb_so_far
+				wb_ready[wb_count] = int(finishes[idx]) + self.TAG_UPDATE_LATENCY
+		total_cycles = int(finishes.max()) if len(inst_stream) > 0 else 0
+		return starts, finishes, total_cycles
+
+	def print_estimate(self, verbose):
+		print(bcolors.HEADER + '=== Analytical Performance Estimate ===' + bcolors.RESET)
+		starts, finishes, cycles = self.estimate_cycles()
+		if(verbose):
+			print('{:<8}{:>10}{:>10}'.format('Chain', 'Start', 'Finish'))
+			for idx in range(len(starts)):
+				print('{:<8}{:>10}{:>10}'.format(idx, starts[idx], finishes[idx]))
+		freq = self.flow_opts['freq']
+		runtime_ms = cycles / (freq * 1000.0)
+		tops = self.ops / (runtime_ms / 1000.0) / 1e12 if cycles > 0 else 0
+		print('Estimated runtime ... ' + bcolors.OKGREEN + str(cycles) + ' cycles - ' + str(round(runtime_ms, 5)) + ' ms - ' + \
+			str(round(tops, 2)) + ' TOPS' + bcolors.RESET)
+		return cycles
+
+	'''
+	This function is a dependency-aware list scheduler for the chains emitted since the last end_npu_program call
+	(enabled with -schedule). Chains are moved in units of FIFO segments (runs of chains that end with all FIFOs empty),
+	so that chains sharing FIFO data stay together. Segments are ordered by:
+	- read-after-write dependencies on VRF words and tag dependencies (the reader waits for the writer to complete)
+	- write-after-read and write-after-write dependencies on VRF words, and the order of input loads (input buffer)
+	  and output writes (output buffer), which only have to keep their relative order
+	Among the ready segments (the first SCHED_WINDOW in program order), the next one is picked by a priority on the
+	pipeline model (chain_stages with the PIPELINE_LATENCIES): earliest start, longest path to the end of the program,
+	earliest completion, or slack. The order with the fewest predicted cycles is kept, and the original order is left
+	untouched unless one is faster. The write back counts (wb_so_far) and all tags are then recomputed for the new
+	order. Returns the predicted cycles of the original and of the scheduled order.
+	'''
+	def schedule_chains(self):
+		first = self.sched_start
+		chains = self.inst_q[first:]
+		tiles = self.arch_params['tiles']
+		stream = lower_chains(chains, tiles)
+		segments = fifo_segments(stream, self.arch_params['dpes'], self.arch_params['lanes'])
+		num_segs = len(segments)
+		if(num_segs < 2):
+			return 0, 0
+		seg_of_chain = np.zeros(len(chains), dtype=int)
+		for s, (seg_start, seg_end) in enumerate(segments):
+			seg_of_chain[seg_start:seg_end] = s
+
+		# Chains owning each write back count (the chain that increments it) and the old count before the range
+		wb_base = self.inst_q[first - 1].wb_so_far if first > 0 else 0
+		old_wb = [inst.wb_so_far for inst in chains]
+		increments = [old_wb[0] - wb_base] + [old_wb[c] - old_wb[c - 1] for c in range(1, len(chains))]
+		wb_owner = dict((old_wb[c], c) for c in range(len(chains)) if increments[c] > 0)
+		tag_fields = ['mvu_tag', 'extvrf_tag', 'mfu0_tag', 'mfu1_tag']
+
+		# Dependency graph between segments
+		stride = max(list(vrf_extents(stream, tiles).values()) + [0]) + 1
+		timed_preds = [set() for _ in range(num_segs)]
+		order_preds = [set() for _ in range(num_segs)]
+		last_writer = {}
+		readers = {}
+		last_input = -1
+		last_output = -1
+		for s, (seg_start, seg_end) in enumerate(segments):
+			read_keys = set()
+			write_keys = set()
+			for c in range(seg_start, seg_end):
+				inst = stream[c]
+				reads, writes = chain_vrf_accesses(inst, tiles)
+				for vrf_ids, addr in reads:
+					for vrf_id in vrf_ids:
+						read_keys.update((vrf_id * stride + np.unique(addr)).tolist())
+				for vrf_ids, addr in writes:
+					for vrf_id in vrf_ids:
+						write_keys.update((vrf_id * stride + np.unique(addr)).tolist())
+				for field in tag_fields:
+					owner = wb_owner.get(getattr(inst, field))
+					if(owner is not None and seg_of_chain[owner] != s):
+						timed_preds[s].add(int(seg_of_chain[owner]))
+				if(inst.loader_op == LD_OPS['in']):
+					if(last_input >= 0 and last_input != s):
+						order_preds[s].add(last_input)
+					last_input = s
+				if(inst.write_to_obuf == 1 and inst.loader_op in [LD_OPS['in'], LD_OPS['wb']]):
+					if(last_output >= 0 and last_output != s):
+						order_preds[s].add(last_output)
+					last_output = s
+			for key in read_keys:
+				if(key in last_writer and last_writer[key] != s):
+					timed_preds[s].add(last_writer[key])
+			for key in write_keys:
+				if(key in last_writer and last_writer[key] != s):
+					order_preds[s].add(last_writer[key])
+				order_preds[s].update([r for r in readers.get(key, []) if r != s])
+			for key in read_keys:
+				readers.setdefault(key, []).append(s)
+			for key in write_keys:
+				last_writer[key] = s
+				readers[key] = []
+		succs = [[] for _ in range(num_segs)]
+		num_preds = [0] * num_segs
+		for s in range(num_segs):
+			order_preds[s] -= timed_preds[s]
+			for p in timed_preds[s] | order_preds[s]:
+				succs[p].append(s)
+				num_preds[s] += 1
+
+		# Stages of the chains of each segment and longest path (in busy cycles) to the end of the program
+		seg_stages = [[self.chain_stages(stream[c]) for c in range(seg_start, seg_end)] for seg_start, seg_end in segments]
+		seg_cycles = [sum([max([stage[1] for stage in stages] + [0]) for stages in chain_stages]) for chain_stages in seg_stages]
+		path = list(seg_cycles)
+		for s in range(num_segs - 1, -1, -1):
+			for n in succs[s]:
+				path[s] = max(path[s], seg_cycles[s] + path[n])
+
+		def issue_segment(s, units, stream_ready, done):
+			ready = max([done[p] for p in timed_preds[s]] + [0])
+			seg_start = None
+			seg_done = ready
+			for stages in seg_stages[s]:
+				start, chain_done = self.issue_chain(stages, units, stream_ready, ready)
+				seg_start = start if seg_start is None else seg_start
+				seg_done = max(seg_done, chain_done)
+			return seg_start, seg_done
+
+		# Predicted cycles of the original order
+		units = [0] * 5
+		stream_ready = [0]
+		done = [0] * num_segs
+		for s in range(num_segs):
+			done[s] = issue_segment(s, units, stream_ready, done)[1]
+		original_cycles = max(done)
+
+		# List scheduling with a few priority functions of (start cycle, completion cycle, segment); the best order wins
+		# and the original order is kept unless one of them is predicted to be faster
+		def list_schedule(priority):
+			units = [0] * 5
+			stream_ready = [0]
+			done = [0] * num_segs
+			preds_left = list(num_preds)
+			ready_segs = [s for s in range(num_segs) if preds_left[s] == 0]
+			order = []
+			while(ready_segs):
+				best = None
+				for s in ready_segs[:self.SCHED_WINDOW]:
+					start, seg_done = issue_segment(s, list(units), list(stream_ready), done)
+					key = priority(start, seg_done, s)
+					if(best is None or key < best[0]):
+						best = (key, s)
+				s = best[1]
+				ready_segs.remove(s)
+				done[s] = issue_segment(s, units, stream_ready, done)[1]
+				order.append(s)
+				for n in succs[s]:
+					preds_left[n] -= 1
+					if(preds_left[n] == 0):
+						bisect.insort(ready_segs, n)
+			assert len(order) == num_segs, 'Chain scheduler found a dependency cycle'
+			return max(done), order
+
+		scheduled_cycles, order = original_cycles, list(range(num_segs))
+		for priority in [lambda start, seg_done, s: (start, -path[s], s), lambda start, seg_done, s: (-path[s], start, s), \
+			lambda start, seg_done, s: (seg_done, -path[s], s), lambda start, seg_done, s: (start - path[s], s)]:
+			cycles, candidate = list_schedule(priority)
+			if(cycles < scheduled_cycles):
+				scheduled_cycles, order = cycles, candidate
+
+		# Reorder the chains, recompute the write back counts and remap the tags to the new counts of their owners
+		new_chains = [c for s in order for c in range(segments[s][0], segments[s][1])]
+		new_wb = [0] * len(chains)
+		wb_count = wb_base
+		for c in new_chains:
+			wb_count += increments[c]
+			new_wb[c] = wb_count
+		for c in new_chains:
+			inst = chains[c]
+			for field in tag_fields:
+				owner = wb_owner.get(getattr(inst, field))
+				if(owner is not None):
+					setattr(inst, field, new_wb[owner])
+			inst.wb_so_far = new_wb[c]
+		self.inst_q[first:] = [chains[c] for c in new_chains]
+
+		# Rebuild the tagging book-keeping for the new order
+		self.last_writer = {}
+		for pos, inst in enumerate(self.inst_q):
+			if(inst.results[-1] != ''):
+				self.last_writer[inst.results[-1]] = (pos, inst)
+		self.highest_tag_so_far = max([getattr(inst, field) for inst in self.inst_q for field in tag_fields] + [0])
+		return original_cycles, scheduled_cycles
+
 	'''
 	This function is used to mark the end of an NPU program by setting the "last instruction" flag for
 	the latest instruction added to the queue. If multiple NPU routines are to be written in a single
 	NPU program, each routine must end by calling the end_npu_program() function.
 	'''
 	def end_npu_program(self):
+		# The routine is complete, so all its chains count for the release of freed vectors (in program order, which
+		# the scheduler keeps for reads before later writes)
+		self.release_frees(len(self.inst_q))
+		if(self.flow_opts['schedule']):
+			original_cycles, scheduled_cycles = self.schedule_chains()
+			if(original_cycles > 0):
+				print('Chain scheduler: predicted ' + str(original_cycles) + ' -> ' + str(scheduled_cycles) + ' cycles (' + \
+					str(round((1.0 - 1.0 * scheduled_cycles / original_cycles) * 100, 2)) + '% fewer)')
+		self.sched_start = len(self.inst_q)
 		idx = -1
 		while True:
 			if (self.inst_q[idx].loader_src == 'flush'):
@@ -1268,42 +1644,334 @@ class npu:
 				break
 		self.inst_q[idx].last_flag = 1
 
+	# VRF address fields of a chain that are active (read or written), as (field, memory space, MVU tile or None for
+	# all tiles, words per batch element, is_read)
+	def vrf_fields(self, inst):
+		fields = []
+		if(inst.mvu_op_type == 'matvec'):
+			fields.append(('mvu_vrf_rd_base', 'mvu_vrf', None, inst.mvu_vrf_rd_sz, True))
+		if(inst.extvrf_op_type == 'extvrf'):
+			fields.append(('extvrf_rd_base', 'evrf', 0, inst.extvrf_rd_sz, True))
+		for mfu in ['mfu0', 'mfu1']:
+			if(getattr(inst, mfu + '_add_op_type') not in ['nop', 'move']):
+				fields.append((mfu + '_vrf0_rd_base', mfu + '_add', 0, getattr(inst, mfu + '_vrf_rd_size'), True))
+			if(getattr(inst, mfu + '_mul_op_type') == 'mul'):
+				fields.append((mfu + '_vrf1_rd_base', mfu + '_mul', 0, getattr(inst, mfu + '_vrf_rd_size'), True))
+		if(inst.loader_src in ['in', 'wb']):
+			space_of_op = dict((op, space) for space, op in self.VRF_SPACE_OPS.items())
+			for field, vrf_op in [('vrf_id0_wr_base', inst.vrf_id0_op), ('vrf_id1_wr_base', inst.vrf_id1_op)]:
+				if(vrf_op[0:3] == 'mvu'):
+					fields.append((field, 'mvu_vrf', int(re.search('mvu(\d+)', vrf_op).group(1)), inst.vrf_id0_wr_size, False))
+				elif(vrf_op in space_of_op):
+					fields.append((field, space_of_op[vrf_op], 0, inst.vrf_id0_wr_size, False))
+		return fields
+
+	'''
+	This function assigns physical addresses to the VRF vectors of a program compiled with -vrf_reuse. In this mode
+	malloc hands out addresses in an unbounded virtual space per VRF memory space. A liveness analysis over the chains
+	finds the range of chains in which each allocation is live, and a linear scan packs allocations with disjoint
+	live ranges onto the same words:
+	- An allocation is live from its first access to its last one. If any of its words is read before being written,
+	  it is live from the start of the program, so it still reads zeros.
+	- The end is extended to the next point where all FIFOs are empty. Every unit has then finished the reads of the
+	  last reader before the loader moves on to a later chain that could overwrite the words. Tags only order reads
+	  after writes.
+	- Allocations that are accessed through a single base address (e.g. a write back spanning vectors) move together.
+	Chain address fields and the alloc_addr of the vectors are rewritten in place, unused vectors get -1.
+	'''
+	def reuse_vrfs(self):
+		if(not self.flow_opts['vrf_reuse'] or self.vrf_pressure):
+			return self.vrf_pressure
+		tiles = self.arch_params['tiles']
+		inst_stream = lower_chains(self.inst_q, tiles)
+		drain_point = np.zeros(len(inst_stream), dtype=int)
+		for seg_start, seg_end in fifo_segments(inst_stream, self.arch_params['dpes'], self.arch_params['lanes']):
+			drain_point[seg_start:seg_end] = seg_end - 1
+
+		# Per-space tables of the virtual allocations
+		spaces = {}
+		for space, blocks in self.virtual_blocks.items():
+			starts = np.array([start for start, _, _ in blocks], dtype=int)
+			ends = np.array([start + size for start, size, _ in blocks], dtype=int)
+			depth = int(ends.max()) if blocks else 0
+			banks = tiles if space == 'mvu_vrf' else 1
+			spaces[space] = {
+				'starts'      : starts,
+				'ends'        : ends,
+				'parent'      : list(range(len(blocks))),
+				'first'       : np.full(len(blocks), -1),
+				'last'        : np.full(len(blocks), -1),
+				'first_read'  : np.full((banks, depth), len(inst_stream)),
+				'first_write' : np.full((banks, depth), len(inst_stream))
+			}
+
+		def find(parent, i):
+			while(parent[i] != i):
+				parent[i] = parent[parent[i]]
+				i = parent[i]
+			return i
+
+		# Liveness: first and last access of each allocation and first read/write of each word
+		for idx, inst in enumerate(self.inst_q):
+			for field, space, bank, size, is_read in self.vrf_fields(inst):
+				sp = spaces[space]
+				if(size == 0):
+					continue
+				for base in getattr(inst, field)[:inst.batch]:
+					first_block = int(np.searchsorted(sp['starts'], base, side='right')) - 1
+					last_block = int(np.searchsorted(sp['starts'], base + size - 1, side='right')) - 1
+					assert first_block >= 0 and base + size <= sp['ends'][last_block], \
+						'Chain ' + str(idx) + ' accesses ' + space + ' words outside of any allocated vector'
+					for b in range(first_block, last_block + 1):
+						sp['parent'][find(sp['parent'], b)] = find(sp['parent'], first_block)
+					sp['first'][first_block:last_block + 1] = np.where(sp['first'][first_block:last_block + 1] < 0, idx, \
+						sp['first'][first_block:last_block + 1])
+					sp['last'][first_block:last_block + 1] = idx
+					table = sp['first_read'] if is_read else sp['first_write']
+					rows = table[:, base:base + size] if bank is None else table[bank:bank + 1, base:base + size]
+					np.minimum(rows, idx, out=rows)
+
+		# Linear scan over the live ranges of the allocation groups
+		offsets = {}
+		for space, sp in spaces.items():
+			groups = {}
+			for b in range(len(sp['starts'])):
+				groups.setdefault(find(sp['parent'], b), []).append(b)
+			live_ranges = []
+			for members in groups.values():
+				accessed = [b for b in members if sp['first'][b] >= 0]
+				if(not accessed):
+					continue
+				v_start = int(sp['starts'][members[0]])
+				v_end = int(sp['ends'][members[-1]])
+				first_read = sp['first_read'][:, v_start:v_end]
+				live_in = ((first_read < len(inst_stream)) & (first_read <= sp['first_write'][:, v_start:v_end])).any()
+				start = -1 if live_in else int(min(sp['first'][accessed]))
+				end = int(drain_point[max(sp['last'][accessed])])
+				live_ranges.append((start, v_start, v_end, end, members))
+
+			allocator = mem_allocator(self.arch_params['vrf_depth'], self.flow_opts['alloc_policy'])
+			block_offsets = np.full(len(sp['starts']), -1)
+			active = []
+			for start, v_start, v_end, end, members in sorted(live_ranges):
+				while(active and active[0][0] < start):
+					allocator.free(heapq.heappop(active)[1])
+				p_start = allocator.alloc(v_end - v_start)
+				assert p_start != -1, 'Cannot fit the live ' + space + ' vectors in ' + str(self.arch_params['vrf_depth']) + ' words'
+				heapq.heappush(active, (end, p_start))
+				block_offsets[members] = p_start - v_start
+			offsets[space] = block_offsets
+			self.mem_space[space] = allocator
+			self.vrf_pressure[space] = allocator.peak
+
+		# Rewrite the chain address fields and the vector allocation addresses
+		for inst in self.inst_q:
+			for field, space, bank, size, is_read in self.vrf_fields(inst):
+				bases = getattr(inst, field)
+				starts = spaces[space]['starts']
+				remapped = [int(base + offsets[space][np.searchsorted(starts, base, side='right') - 1]) for base in bases[:inst.batch]]
+				setattr(inst, field, remapped + bases[inst.batch:])
+		for space, blocks in self.virtual_blocks.items():
+			for b, (start, size, vec) in enumerate(blocks):
+				vec.alloc_addr = int(start + offsets[space][b]) if offsets[space][b] >= 0 else -1
+		return self.vrf_pressure
+
+	def print_vrf_pressure(self):
+		print(bcolors.HEADER + '=== VRF Reuse (peak live words per memory space) ===' + bcolors.RESET)
+		print('{:<10}{:>10}{:>10}{:>8}'.format('Space', 'Virtual', 'Peak', 'Depth'))
+		for space, peak in self.vrf_pressure.items():
+			virtual = sum([size for _, size, _ in self.virtual_blocks[space]])
+			print('{:<10}{:>10}{:>10}{:>8}'.format(space, virtual, peak, self.arch_params['vrf_depth']))
+
+	# Create an FSim instance. VRFs are handed over as read-only (copy-on-write) views if they already cover the words
+	# the program touches, otherwise as zero-padded copies of that depth. The MRFs are shared read-only.
+	def new_fsim(self, mvu_engine, fsim_mode, fsim_check=[]):
+		inst_stream = lower_chains(self.inst_q, self.arch_params['tiles'])
+		extents = vrf_extents(inst_stream, self.arch_params['tiles'])
+		initial_vrfs = []
+		for name in ['mvu_vrfs', 'ext_vrf', 'mfu0_vrf0', 'mfu0_vrf1', 'mfu1_vrf0', 'mfu1_vrf1']:
+			state = getattr(self, name)
+			if(state.shape[-2] >= extents[name]):
+				state = state.view()
+				state.flags.writeable = False
+			else:
+				state = self.full_state(state, extents[name])
+			initial_vrfs.append(state)
+		fsim = npu_isa_sim(inst_stream, self.ibuf_q, *initial_vrfs, \
+			self.arch_params['tiles'], self.arch_params['dpes'], self.arch_params['lanes'], self.arch_params['vrf_depth'], mvu_engine, fsim_mode, fsim_check)
+		mrfs = self.mrfs.view()
+		mrfs.flags.writeable = False
+		fsim.mvu_mrfs = mrfs
+		return fsim
+
 	'''
 	This function uses FSim to perform a functional simulation for the NPU program written by the user,
 	and compare its results to the golden results generated by the functional model in each of the 
-	compiler functions.
-	'''
-	def fsim_npu_program(self, verbose=0):
-		# Initialize FSim
-		inst_stream = copy.deepcopy(self.inst_q)
-		input_buffer = copy.deepcopy(self.ibuf_q)
-		initial_mvu_vrfs = copy.deepcopy(self.mvu_vrfs)
-		initial_ext_vrf = copy.deepcopy(self.ext_vrf)
-		initial_mfu0_vrf0 = copy.deepcopy(self.mfu0_vrf0)
-		initial_mfu0_vrf1 = copy.deepcopy(self.mfu0_vrf1)
-		initial_mfu1_vrf0 = copy.deepcopy(self.mfu1_vrf0)
-		initial_mfu1_vrf1 = copy.deepcopy(self.mfu1_vrf1)
+	compiler functions. Every fsim_snapshot chains a snapshot of the architecture state is kept in
+	self.fsim_snapshots, and a simulation can be resumed from any of them (resume_from). With fsim_abort,
+	output rows are compared with the golden rows as they are produced and the simulation stops at the
+	first mismatch. Without it, a failing run with snapshots is bisected to the chain producing the first
+	wrong output row (see bisect_fsim).
+	'''
+	def fsim_npu_program(self, verbose=0, resume_from=None):
+		# Initialize FSim (the chains are lowered once, the compiler-side chains are left untouched)
+		self.fsim = self.new_fsim(self.flow_opts['mvu_engine'], self.flow_opts['fsim_mode'], self.flow_opts['fsim_check'])
+		if(self.flow_opts['fsim_profile']):
+			self.fsim.profiler = fsim_profiler()
 		inst_count = len(self.inst_q)
-		self.fsim = npu_isa_sim(inst_stream, list(input_buffer), initial_mvu_vrfs, initial_ext_vrf, initial_mfu0_vrf0, initial_mfu0_vrf1, initial_mfu1_vrf0, initial_mfu1_vrf1,\
-			self.arch_params['tiles'], self.arch_params['dpes'], self.arch_params['lanes'], self.arch_params['vrf_depth'])
-		self.fsim.mvu_mrfs = self.mrfs
+		if(resume_from is not None):
+			self.fsim.load_state(resume_from)
+			self.fsim_snapshots = [snap for snap in self.fsim_snapshots if snap['pc'] <= self.fsim.pc]
+		else:
+			self.fsim_snapshots = []
+		snapshot_interval = self.flow_opts['fsim_snapshot']
+		early_abort = self.flow_opts['fsim_abort']
+		self.fsim_mismatch = None
+
+		# Simulate independent groups of chains on a process pool (snapshots, early abort, profiling and
+		# verbose output need the serial simulation)
+		if(self.flow_opts['fsim_jobs'] > 1 and resume_from is None and not (snapshot_interval or early_abort or \
+			self.fsim.profiler is not None or verbose)):
+			num_groups, num_waves = self.fsim.run_parallel(self.flow_opts['fsim_jobs'])
+			print('FSim: ' + str(num_groups) + ' independent chain group(s) in ' + str(num_waves) + ' wave(s) on ' + \
+				str(self.flow_opts['fsim_jobs']) + ' processes')
 
 		# Simulate the instructions in instruction queue
-		for i in range(inst_count):
+		while(self.fsim.pc < inst_count):
+			i = self.fsim.pc
+			if(snapshot_interval > 0 and i % snapshot_interval == 0 and \
+				not (self.fsim_snapshots and self.fsim_snapshots[-1]['pc'] == i)):
+				self.fsim_snapshots.append(self.fsim.save_state())
 			if(verbose):
 				print("-------------- Starting simulation of instruction " + str(i+1) + " --------------")
+			obuf_len = len(self.fsim.obuf_q)
 			self.fsim.step(verbose) 
 			if(verbose):
 				print("-------------- Finished simulation of instruction " + str(i+1) + " --------------")
 
+			# Streaming comparison of the output rows produced by this chain
+			if(early_abort):
+				for r in range(obuf_len, len(self.fsim.obuf_q)):
+					if(r >= len(self.golden_obuf_q) or not np.array_equal(self.fsim.obuf_q[r], self.golden_obuf_q[r])):
+						self.fsim_mismatch = (i, r)
+						break
+				if(self.fsim_mismatch is not None):
+					break
+
+		if(self.flow_opts['fsim_mode'] == 'dataflow'):
+			print('FSim dataflow mode: ' + str(self.fsim.num_fused) + '/' + str(inst_count) + ' chains fused, ' + \
+				str(self.fsim.num_checked) + ' cross-checked against the step engine')
+
+		# Profiler summary and per chain/unit traces
+		if(self.fsim.profiler is not None):
+			print(bcolors.HEADER + '=== FSim Profile ===' + bcolors.RESET)
+			self.fsim.profiler.print_summary(self.flow_opts['fsim_profile_sort'])
+			trace_name = self.flow_opts['checkpoint_name'] + '-fsim_profile'
+			self.fsim.profiler.write_csv(trace_name + '.csv')
+			self.fsim.profiler.write_json(trace_name + '.json')
+			print('FSim traces written to ' + trace_name + '.csv and ' + trace_name + '.json')
+
 		# Verify results
-		if (np.array_equal(self.fsim.obuf_q, self.golden_obuf_q)):
+		if(self.fsim_mismatch is not None):
+			chain_idx, r = self.fsim_mismatch
+			print(bcolors.FAIL + 'Simulation FAILED! Output row ' + str(r) + ' produced by instruction ' + str(chain_idx+1) + \
+				' differs from the golden output (aborted)' + bcolors.RESET)
+			print('FSim: ' + str(self.fsim.obuf_q[r]))
+			if(r < len(self.golden_obuf_q)):
+				print('Gold: ' + str(self.golden_obuf_q[r]))
+		elif (np.array_equal(self.fsim.obuf_q, self.golden_obuf_q)):
 			print(bcolors.OKGREEN + 'Simulation finished successfully!' + bcolors.RESET)
 		else:
 			print(bcolors.FAIL + 'Simulation FAILED!' + bcolors.RESET)
 			for r in range(len(self.fsim.obuf_q)):
 				print('FSim: ' + str(self.fsim.obuf_q[r]))
 				print('Gold: ' + str(self.golden_obuf_q[r]))
+			# Locate the chain that produced the first wrong output row
+			if(self.fsim_snapshots):
+				self.bisect_fsim()
+
+	'''
+	This function finds the first chain that diverges from the golden output, i.e. the chain that produces the
+	first output row differing from golden_obuf_q. After an early abort this is the chain that stopped the
+	simulation. Otherwise the snapshots of the last fsim_npu_program run are bisected on the length of their
+	output queue, and only the chains after the last snapshot without the wrong row are replayed (from the first
+	chain if there are no snapshots). With ref_mvu_engine set, the architecture state is instead compared with a
+	reference FSim engine (e.g. the loop MVU with the step engine): each snapshot interval is replayed with the
+	reference engine and compared with the next snapshot, and only the first diverging interval is then replayed
+	chain by chain. Returns the chain index or None.
+	'''
+	def bisect_fsim(self, ref_mvu_engine=None, ref_fsim_mode='step', verbose=0):
+		if(ref_mvu_engine is not None):
+			return self.bisect_fsim_engine(ref_mvu_engine, ref_fsim_mode, verbose)
+		if(self.fsim_mismatch is not None):
+			chain_idx, r = self.fsim_mismatch
+			print(bcolors.FAIL + 'First diverging instruction: ' + str(chain_idx+1) + ' (output row ' + str(r) + ')' + bcolors.RESET)
+			return chain_idx
+
+		# First output row that differs from the golden output
+		obuf_q = self.fsim.obuf_q
+		r = min(len(obuf_q), len(self.golden_obuf_q))
+		for i in range(r):
+			if(not np.array_equal(obuf_q[i], self.golden_obuf_q[i])):
+				r = i
+				break
+		if(r == len(obuf_q)):
+			if(r == len(self.golden_obuf_q)):
+				print(bcolors.OKGREEN + 'No divergence from the golden output' + bcolors.RESET)
+			else:
+				print(bcolors.FAIL + 'FSim produced only ' + str(r) + ' of ' + str(len(self.golden_obuf_q)) + ' output rows' + bcolors.RESET)
+			return None
+
+		# Output queues only grow, so the snapshots are ordered by their number of output rows
+		obuf_lens = [len(snap['obuf_q']) for snap in self.fsim_snapshots]
+		start = bisect.bisect_right(obuf_lens, r) - 1
+		replay_fsim = self.new_fsim(self.flow_opts['mvu_engine'], self.flow_opts['fsim_mode'])
+		if(start >= 0):
+			replay_fsim.load_state(self.fsim_snapshots[start])
+		while(len(replay_fsim.obuf_q) <= r):
+			chain_idx = replay_fsim.pc
+			replay_fsim.step()
+		if(verbose):
+			print('FSim: ' + str(replay_fsim.obuf_q[r]))
+			if(r < len(self.golden_obuf_q)):
+				print('Gold: ' + str(self.golden_obuf_q[r]))
+		print(bcolors.FAIL + 'First diverging instruction: ' + str(chain_idx+1) + ' (output row ' + str(r) + ')' + bcolors.RESET)
+		return chain_idx
+
+	'''
+	This function finds the first chain whose architectural effect differs from a reference FSim engine (see
+	bisect_fsim). Returns the chain index or None.
+	'''
+	def bisect_fsim_engine(self, ref_mvu_engine, ref_fsim_mode, verbose=0):
+		assert self.fsim_snapshots, 'No FSim snapshots available (run fsim_npu_program with fsim_snapshot > 0)'
+		snapshots = self.fsim_snapshots + [self.fsim.save_state()]
+		ref_fsim = self.new_fsim(ref_mvu_engine, ref_fsim_mode)
+		dut_fsim = self.new_fsim(self.flow_opts['mvu_engine'], self.flow_opts['fsim_mode'])
+		for start, end in zip(snapshots[:-1], snapshots[1:]):
+			ref_fsim.load_state(start)
+			while(ref_fsim.pc < end['pc']):
+				ref_fsim.step()
+			diff = diff_states(ref_fsim.save_state(), end)
+			if(not diff):
+				continue
+			if(verbose):
+				print('Divergence between instructions ' + str(start['pc']+1) + ' and ' + str(end['pc']) + ': ' + ', '.join(diff))
+
+			# Replay the diverging interval chain by chain with both engines
+			ref_fsim.load_state(start)
+			dut_fsim.load_state(start)
+			while(ref_fsim.pc < end['pc']):
+				chain_idx = ref_fsim.pc
+				ref_fsim.step()
+				dut_fsim.step()
+				diff = ref_fsim.diff_state(dut_fsim)
+				if(diff):
+					print(bcolors.FAIL + 'First diverging instruction: ' + str(chain_idx+1) + ' (' + ', '.join(diff) + ')' + bcolors.RESET)
+					return chain_idx
+			# The interval only diverges when it is simulated in one go (e.g. the snapshot was modified)
+			return end['pc'] - 1
+		print(bcolors.OKGREEN + 'No divergence from the reference FSim engine' + bcolors.RESET)
+		return None
 
 	'''
 	This function dumps the FSim data structures containing the architecture states (i.e. MRFs, VRFs),
@@ -1339,21 +2007,21 @@ class npu:
 
 		# VRFs checkpoints
 		mvuvrffile = open('./dump/' + checkpoint_name + '-mvu_vrf', 'wb')
-		np.save(mvuvrffile, self.mvu_vrfs)
+		np.save(mvuvrffile, self.full_state(self.mvu_vrfs, self.arch_params['vrf_depth']))
 		mvuvrffile.close()
 		count += 1
 		if (verbose):
 			print('Dumped ' + checkpoint_name + '-mvu_vrf checkpoint')
 
 		extvrffile = open('./dump/' + checkpoint_name + '-ext_vrf', 'wb')
-		np.save(extvrffile, self.ext_vrf)
+		np.save(extvrffile, self.full_state(self.ext_vrf, self.arch_params['vrf_depth']))
 		extvrffile.close()
 		count += 1
 		if (verbose):
 			print('Dumped ' + checkpoint_name + '-ext_vrf checkpoint')
 
 		mfuvrffile = open('./dump/' + checkpoint_name + '-mfu_vrf', 'wb')
-		np.save(mfuvrffile, self.mfu0_vrf0)
+		np.save(mfuvrffile, self.full_state(self.mfu0_vrf0, self.arch_params['vrf_depth']))
 		mfuvrffile.close()
 		count += 1
 		if (verbose):
@@ -1614,190 +2282,115 @@ class npu:
 			header_file.write("`endif\n")
 
 	'''
-	This function is used to launch the RTL simulation in case specified by the user. This requires 
-	Synopsys VCS to be set up properly
+	This function runs the RTL simulation script rtl/run_sim.sh (this requires Synopsys VCS to be set up properly) and
+	returns its result as a dictionary (passed, cycles and sim_time, the wall time in seconds). The script writes to
+	its standard output, which is read through a pipe: every line is copied to rtl/rtl_sim_log, and the testbench
+	messages report the progress of the simulation steps through the progress callback (see flow_progress).
 	'''
-	def launch_rtl_sim(self, checkpoint_name, num_tiles, num_dpes, num_lanes, vrf_depth, mrf_depth, max_tag, mrf_filled_depth):
+	def launch_rtl_sim(self, checkpoint_name, num_tiles, num_dpes, num_lanes, vrf_depth, mrf_depth, max_tag, mrf_filled_depth, progress):
 		#self.write_verilog_header_file(num_tiles, num_dpes, num_lanes, vrf_depth, mrf_depth, max_tag, mrf_filled_depth)
-		subprocess.call('cd ../rtl; sed -i -e \'s/\r$//\' run_sim.sh; ./run_sim.sh; cd ../compiler', shell=True)
+		progress('Setting up simulation')
+		start_time = time.time()
+		subprocess.call(['sed', '-i', '-e', 's/\\r$//', 'run_sim.sh'], cwd='../rtl')
+		result = {'passed': False, 'cycles': None, 'sim_time': 0}
+		with open('../rtl/rtl_sim_log', 'w') as log:
+			sim = subprocess.Popen(['./run_sim.sh'], cwd='../rtl', stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+			for line in sim.stdout:
+				log.write(line)
+				if('Simulation setup done' in line):
+					progress('Loading inputs')
+				elif('input vectors were loaded successfully' in line):
+					progress('Running simulation')
+				match = re.search('(SUCCESS|FAILURE)! .* Runtime = *(\\d+) cycle', line)
+				if(match):
+					result['passed'] = (match.group(1) == 'SUCCESS')
+					result['cycles'] = int(match.group(2))
+			sim.wait()
+		result['sim_time'] = time.time() - start_time
+		return result
 
 	'''
-	This function uses the FSim checkpoints to generate MRF, instructions, input, and output files for PCIe demo.
+	This function uses the FSim checkpoints to generate the PCIe bundle of the PCIe demo (see write_pcie_bundle) with
+	the MRF, instructions, input and golden output sections. The host sends every input/output vector once per core
+	and per program loop, so the replication is only recorded in the bundle header.
 	'''
 	def dump_pcie_files(self, checkpoint_name, num_tiles, num_dpes, num_lanes, program_loops):
-		precision_in = 8
-		precision_out = 32
-		mask = int(np.power(2, precision_in)) - 1
-
-		# MRF file
-		src_path = './dump/' + checkpoint_name + '-mvu_mrf'
-		with open (src_path,'rb') as src_file:
+		with open('./dump/' + checkpoint_name + '-mvu_mrf', 'rb') as src_file:
 			mrfs = np.load(src_file)
-			file_path = './pcie_dump/mrfs.dat'
-			with open (file_path, 'w') as mrf_file:
-				mrf_file.write(str(num_tiles*num_dpes) + ' ' + str(self.mrf_filled_depth) + ' ' + str(num_lanes) + '\n')
-				for i in range(num_tiles):
-					for j in range(num_dpes):
-						for k in range(self.mrf_filled_depth):
-							for l in range(num_lanes):
-								mrf_file.write(str(mrfs[i][j][k][l]) + ' ')
-							mrf_file.write('\n')
-
-		# Inputs file
-		src_path = './dump/' + checkpoint_name + '-output'
-		outputs_file = open(src_path,'rb')
-		outputs = np.load(outputs_file)
-		outputs_file.close()
-		src_path = './dump/' + checkpoint_name + '-input'
-		with open(src_path,'rb') as src_file:
+		with open('./dump/' + checkpoint_name + '-input', 'rb') as src_file:
 			inputs = np.load(src_file)
-			file_path = './pcie_dump/inputs.dat'
-			with open (file_path,'w') as inputs_file:
-				inputs_file.write(str(2 * program_loops * len(inputs)) + ' ' + str(num_lanes) + ' ' + str(2 * program_loops * len(outputs)) + ' ' + str(num_lanes) + ' ' + str(2 * len(inputs)) + '\n')
-				for l in range(program_loops):
-					for i in range(len(inputs)):
-						for j in range(num_lanes):
-							inputs_file.write(str(inputs[i][j]) + ' ')
-						inputs_file.write('\n')
-						for j in range(num_lanes):
-							inputs_file.write(str(inputs[i][j]) + ' ')
-						inputs_file.write('\n')
-
-		# Instructions
-		self.set_inst_params()
-		src_path = './dump/' + checkpoint_name + '-inst'
-		with open(src_path,'rb') as src_file:
-			insts = np.load(src_file, allow_pickle=True, fix_imports=True, encoding='latin1')
-			file_path = './pcie_dump/instructions_bin.dat'
-			with open (file_path,'w') as inst_file:
-				inst_file.write(str(len(insts)+1) + '\n')
-				for i, inst in enumerate(insts):
-					self.set_inst(inst)
-					inst_str = bin(self.minst_chain & int(pow(2, self.MICW)-1))[2:].zfill(512)
-					inst_file.write(inst_str)
-					inst_file.write('\n')
-				inst_str = '1'*self.MICW
-				inst_file.write(inst_str)
-				inst_file.write('\n')
-
-			file_path = './pcie_dump/instructions.dat'
-			with open (file_path,'w') as inst_file:
-				inst_byte_width = int(math.ceil(self.MICW * 1.0 / 8.0))
-				inst_file.write(str(len(insts)+1) + ' ' + str(inst_byte_width) + '\n')
-				for i, inst in enumerate(insts):
-					self.set_inst(inst)
-					inst_str = bin(self.minst_chain & int(pow(2, self.MICW)-1))[2:].zfill(inst_byte_width*8)
-					for j in range(inst_byte_width):
-						partial_inst_str = inst_str[(inst_byte_width*8) - ((j+1)*8): (inst_byte_width*8) - (j*8)];
-						value = 0;
-						for k in range(8):
-							if (partial_inst_str[7-k] == '1'):
-								value += int(pow(2,k))
-						inst_file.write(str(value) + ' ')
-					inst_file.write('\n')
-				inst_file.write(str(program_loops % 256) + ' ')
-				inst_file.write(str(program_loops >> 8) + ' ')
-				for i in range(inst_byte_width-2):
-					inst_file.write('255 ')
-				inst_file.write('\n')
-
-		# Outputs file
-		mask = int(np.power(2, precision_out)) - 1
-		file_path = './pcie_dump/outputs.dat'
-		with open (file_path,'w') as outputs_file:
-			for l in range(program_loops):
-				for i in range(len(outputs)):
-					for j in range(num_lanes):
-						outputs_file.write(str(outputs[i][j] & int(pow(2, 8)-1)) + ' ')
-					outputs_file.write('\n')
-					for j in range(num_lanes):
-						outputs_file.write(str(outputs[i][j] & int(pow(2, 8)-1)) + ' ')
-					outputs_file.write('\n')
-
-	'''
-	This function uses the FSim checkpoints to generate low-level binary NPU checkpoints. These
-	checkpoints will later be used to generate the PAC C header file. Make sure to set the precision_in
-	and precision_out to correct number of bits in case the RTL is changed (parameters EW & ACCW in RTL).
-	'''
-	def dump_binary_files(self, checkpoint_name, num_tiles, num_dpes, num_lanes):
-		precision_in = 8
-		precision_out = 32
-		mask = int(np.power(2, precision_in)) - 1
+		with open('./dump/' + checkpoint_name + '-output', 'rb') as src_file:
+			outputs = np.load(src_file)
+
+		# Instructions followed by the program loops word (16-bit loop count padded with ones)
+		words = self.checkpoint_inst_words(checkpoint_name)
+		inst_byte_width = int(math.ceil(self.MICW * 1.0 / 8.0))
+		loops_word = np.full((1, inst_byte_width), 255, dtype=np.uint8)
+		loops_word[0, :2] = [program_loops % 256, (program_loops >> 8) % 256]
 
-		# Dump MRF data
-		path = './dump/' + checkpoint_name + '-mvu_mrf'
-		with open (path,'rb') as mrffile:
+		sections = [('mrfs', mrfs.reshape(num_tiles * num_dpes, mrfs.shape[2], -1)[:, :self.mrf_filled_depth, :num_lanes]), \
+			('insts', [words.view(np.uint8)[:, :inst_byte_width], loops_word]), \
+			('inputs', inputs[np.newaxis, :, :num_lanes]), \
+			('outputs', outputs[np.newaxis, :, :num_lanes])]
+		write_pcie_bundle('./pcie_dump/npu_bundle.bin', sections, program_loops, PCIE_CORES)
+
+	'''
+	This function gathers the arrays of the low-level NPU checkpoints from the FSim checkpoints as uint8 arrays: the MRF
+	image (one entry per DPE with lane l in byte l of each word), the input vectors, the instructions followed by the end
+	of program instruction (all ones) and the output vectors (lowest byte of each lane). The MRF checkpoint only holds
+	the allocated depth, the remaining words of the MRF image are zero.
+	'''
+	def checkpoint_arrays(self, checkpoint_name, num_tiles, num_dpes, num_lanes):
+		with open('./dump/' + checkpoint_name + '-mvu_mrf', 'rb') as mrffile:
 			mrfs = np.load(mrffile)
-			for i in range(num_tiles):
-				for j in range(num_dpes):
-					dump_path = './pac_dump/mvu-mrf' + format(i * num_dpes + j, '03d')
-					with open (dump_path,'wb') as dump_file:
-						for k in range(len(mrfs[i][j])):
-							val = 0
-							for l in range(num_lanes):
-								temp = mrfs[i][j][k][l].item()
-								temp &= mask
-								val += (temp << (precision_in * l))
-							val_str = bin(val)[2:].zfill(num_lanes * precision_in)
-							dump_file.write(val_str.encode())
-							dump_file.write('\n'.encode())
-
-		# Dump input vectors
-		path = './dump/' + checkpoint_name + '-input'
-		with open(path,'rb') as inputfile:
-			inputs = np.load(inputfile)
-			dump_path = './pac_dump/input'
-			with open (dump_path,'wb') as dump_file:
-				for i in range(len(inputs)):
-					val = 0
-					for j in range(num_lanes):
-						temp = inputs[i][j].item() 
-						if((((temp >> (precision_in-1)) & 0x1) == 0x1)):
-							temp -= int(np.power(2, precision_in))
-						temp &= mask 
-						val +=  (temp << (precision_in * j))
-					val_str = hex(val)[2:].zfill(int(num_lanes * precision_in / 4))
-					dump_file.write(val_str.encode())
-					dump_file.write('\n'.encode())
-
-		# Dump instructions
-		self.set_inst_params()
-		path = './dump/' + checkpoint_name + '-inst'
-		with open(path,'rb') as instfile:
-			insts = np.load(instfile, allow_pickle=True, fix_imports=True, encoding='latin1')
-			dump_path = './pac_dump/top_sched'
-			with open (dump_path,'wb') as dump_file:
-				for i, inst in enumerate(insts):
-					self.set_inst(inst)
-					inst_str = bin(self.minst_chain & int(pow(2, self.MICW)-1))[2:].zfill(self.MICW)
-					dump_file.write(inst_str.encode())
-					dump_file.write('\n'.encode())
-				inst_str = '1'*self.MICW
-				dump_file.write(inst_str.encode())
-				dump_file.write('\n'.encode())
-
-		# Dump output vectors
-		mask = int(np.power(2, precision_in)) - 1  #Changed for demo
-		path = './dump/' + checkpoint_name + '-output'
-		with open(path,'rb') as outputfile:
-			outputs = np.load(outputfile)
-			dump_path = './pac_dump/output'
-			with open (dump_path,'wb') as dump_file:
-				for i in range(len(outputs)):
-					val = 0	            
-					for j in range(num_lanes):
-						temp = outputs[i][j].item()
-						temp &= mask
-						val += (temp << (precision_in * j)) #Changed for demo
-					val_str = hex(val)[2:].zfill(int(num_lanes * precision_in / 4)) #Changed for demo
-					dump_file.write(val_str.encode())
-					dump_file.write('\n'.encode())
-
-	def launch_perf_sim(self, num_tiles, num_dpes, num_lanes, vrf_depth, mrf_depth, verbose = False):
+		mrf_image = np.zeros((num_tiles * num_dpes, self.arch_params['mrf_depth'], num_lanes), dtype=np.uint8)
+		mrf_image[:, :mrfs.shape[2]] = mrfs.reshape(num_tiles * num_dpes, mrfs.shape[2], -1)[:, :, :num_lanes].astype(np.uint8)
+
+		with open('./dump/' + checkpoint_name + '-input', 'rb') as inputfile:
+			inputs = np.load(inputfile)[:, :num_lanes].astype(np.uint8)
+
+		words = self.checkpoint_inst_words(checkpoint_name)
+		inst_bytes = int(math.ceil(self.MICW / 8.0))
+		end_inst = np.packbits(np.ones(self.MICW, dtype=np.uint8), bitorder='little')
+		insts = np.concatenate([words.view(np.uint8)[:, :inst_bytes], end_inst[np.newaxis]])
+
+		with open('./dump/' + checkpoint_name + '-output', 'rb') as outputfile:
+			outputs = np.load(outputfile)[:, :num_lanes].astype(np.uint8)
+
+		return mrf_image, inputs, insts, outputs
+
+	'''
+	This function uses the FSim checkpoints to generate low-level binary NPU checkpoints in the packed dump format
+	(see write_packed_dump): one file for all the MRFs, the input vectors, the instructions and the output vectors.
+	These checkpoints will later be used to generate the MIF files. Make sure to set the precision_in to the correct
+	number of bits in case the RTL is changed (parameter EW in RTL).
+	'''
+	def dump_binary_files(self, checkpoint_name, num_tiles, num_dpes, num_lanes, progress):
+		precision_in = 8
+		mrf_image, inputs, insts, outputs = self.checkpoint_arrays(checkpoint_name, num_tiles, num_dpes, num_lanes)
+		progress('Dumping MRF data')
+		write_packed_dump('./pac_dump/mvu-mrf.bin', mrf_image, num_lanes * precision_in)
+		progress('Dumping input vectors')
+		write_packed_dump('./pac_dump/input.bin', inputs[np.newaxis], num_lanes * precision_in)
+		progress('Dumping instructions')
+		write_packed_dump('./pac_dump/top_sched.bin', insts[np.newaxis], self.MICW)
+		progress('Dumping output vectors')
+		write_packed_dump('./pac_dump/output.bin', outputs[np.newaxis], num_lanes * precision_in)
+		progress()
+
+	'''
+	This function generates the files of the C++ performance simulator, builds it and runs it. It returns the result
+	of the simulation as a dictionary (passed, cycles and sim_time, the wall time of the simulator in seconds) parsed
+	from the simulator output, which is also written to simulator/perf_sim_log. The progress of the steps is reported
+	through the progress callback (see flow_progress).
+	'''
+	def launch_perf_sim(self, num_tiles, num_dpes, num_lanes, vrf_depth, mrf_depth, progress, verbose = False):
+		progress('Generating simulation files')
 		num_tiles = len(self.fsim.mvu_mrfs)
 		num_dpes = len(self.fsim.mvu_mrfs[0])
-		mrf_depth = len(self.fsim.mvu_mrfs[0][0])
+		mrf_depth = self.arch_params['mrf_depth']
 		num_lanes = len(self.fsim.mvu_mrfs[0][0][0])
+		mvu_mrfs = self.full_state(self.fsim.mvu_mrfs, mrf_depth)
 		vrf_depth = self.arch_params['vrf_depth']
 
 		dump_path = '../simulator/inc/defines.h'
@@ -1822,19 +2415,13 @@ class npu:
 			defines.write('#define FIFO_DEPTH 512\n\n')
 
 			defines.write('// Latency Parameters\n')
-			defines.write('#define DPE_MULT_LATENCY 2\n')
-			defines.write('#define DPE_ADDER_LATENCY 1\n')
-			defines.write('#define RF_WRITE_LATENCY 1\n')
-			defines.write('#define RF_READ_LATENCY 1\n')
-			defines.write('#define MRF_TO_DPE_LATENCY 8\n')
-			defines.write('#define VRF_TO_DPE_LATENCY 8\n')
-			defines.write('#define MVU_ACCUM_LATENCY 4\n')
-			defines.write('#define MVU_REDUCTION_LATENCY (unsigned int)(ceil(log2(TILES))+5)\n')
-			defines.write('#define MFU_ACT_LATENCY 3\n')
-			defines.write('#define MFU_ADD_LATENCY 3\n')
-			defines.write('#define MFU_MUL_LATENCY 3\n')
-			defines.write('#define MFU_LATENCY MFU_ACT_LATENCY+MFU_ADD_LATENCY+MFU_MUL_LATENCY\n')
-			defines.write('#define LD_WB_LATENCY 5\n\n')
+			for name, latency in self.PIPELINE_LATENCIES.items():
+				defines.write('#define ' + name + ' ' + str(latency) + '\n')
+				if(name == 'MVU_ACCUM_LATENCY'):
+					defines.write('#define MVU_REDUCTION_LATENCY (unsigned int)(ceil(log2(TILES))+5)\n')
+				elif(name == 'MFU_MUL_LATENCY'):
+					defines.write('#define MFU_LATENCY MFU_ACT_LATENCY+MFU_ADD_LATENCY+MFU_MUL_LATENCY\n')
+			defines.write('\n')
 
 			defines.write('// Precision\n')
 			defines.write('#define TYPE int\n')
@@ -1854,7 +2441,7 @@ class npu:
 				with open(dump_path, 'w') as dump_file:
 					for m in range(mrf_depth):
 						for l in range(num_lanes):
-							dump_file.write(str(self.fsim.mvu_mrfs[t][d][m][l]) + ' ')
+							dump_file.write(str(mvu_mrfs[t][d][m][l]) + ' ')
 						dump_file.write('\n')
 
 		dump_path = '../simulator/register_files/vrf_file.txt'
@@ -1875,208 +2462,81 @@ class npu:
 				dump_file.write('\n')
 	            
 		dump_path = '../simulator/register_files/instructions.txt'
-		num_inst = len(self.inst_q)
+		insts = lower_chains(self.inst_q, num_tiles)
+		# Perf-sim opcode codes of the lowered MFU activation and add/sub units (everything else is 0)
+		act_codes = {ACT_OPS['tanh']: 1, ACT_OPS['sig']: 2, ACT_OPS['relu']: 3}
+		add_codes = {ADD_OPS['add']: 1, ADD_OPS['sub_a_b']: 2, ADD_OPS['sub_b_a']: 3}
+		evrf_codes = {EVRF_OPS['move']: '1 0 ', EVRF_OPS['extvrf']: '1 1 '}
+		ld_codes = {LD_OPS['wb']: '1 0 ', LD_OPS['in']: '1 1 ', LD_OPS['flush']: '2 0 '}
+		pad = lambda inst: '0 ' * (3-inst.batch)
 		with open(dump_path, 'w') as dump_file:
-			for i in range(num_inst):
-				inst = self.inst_q[i]
-				
+			for inst in insts:
 				# MVU macro-op
-				if(inst.mvu_op_type == 'matvec'):
-					dump_file.write('1 ')
-				else:
-					dump_file.write('0 ')
-				dump_file.write(str(inst.mvu_vrf_rd_base[0]) + ' ')
-				dump_file.write(str(inst.mvu_vrf_rd_base[1]) + ' ')
-				dump_file.write(str(inst.mvu_vrf_rd_base[2]) + ' ')
-				dump_file.write(str(inst.mvu_vrf_rd_sz) + ' ')
-				dump_file.write(str(inst.mvu_mrf_rd_base) + ' ')
-				dump_file.write(str(inst.mvu_mrf_rd_sz) + ' ')
-				dump_file.write(str(inst.mvu_tag) + '\n')
-				
-				# eVRF macro-op
-				if(inst.extvrf_op_type == 'move'):
-					dump_file.write('1 0 ')
-				elif(inst.extvrf_op_type == 'extvrf'):
-					dump_file.write('1 1 ')
-				else:
-					dump_file.write('0 0 ')
-
-				for i in range(inst.batch):
-					dump_file.write(str(inst.extvrf_rd_base[i]) + ' ')
-				for i in range(3-inst.batch):
-					dump_file.write('0 ')
-
-				dump_file.write(str(inst.extvrf_rd_sz) + ' ')
-				dump_file.write(str(inst.batch) + ' ')
-				dump_file.write(str(inst.extvrf_tag) + '\n')
-				
-				# MFU0 macro-op
-				if((inst.mfu0_act_op_type == 'nop') and (inst.mfu0_act_op_type == 'nop') \
-				    and (inst.mfu0_act_op_type == 'nop')):
-					dump_file.write('0 ')
-				else:
-					dump_file.write('1 ')
-				dump_file.write(str(inst.mfu0_vrf_rd_size) + ' ')
-				if(inst.mfu0_act_op_type == 'tanh'):
-					dump_file.write('1 ')
-				elif(inst.mfu0_act_op_type == 'sig'):
-					dump_file.write('2 ')
-				elif(inst.mfu0_act_op_type == 'relu'):
-					dump_file.write('3 ')
-				else:
-					dump_file.write('0 ')
-				if(inst.mfu0_add_op_type == 'add'):
-					dump_file.write('1 ')
-				elif(inst.mfu0_add_op_type == 'sub_a_b'):
-					dump_file.write('2 ')
-				elif(inst.mfu0_add_op_type == 'sub_b_a'):
-					dump_file.write('3 ')
-				else:
-					dump_file.write('0 ')
-
-				for addr in inst.mfu0_vrf0_rd_base:
-					dump_file.write(str(addr) + ' ')
-				for i in range(3-inst.batch):
-					dump_file.write('0 ')
-				#dump_file.write(str(inst.mfu0_vrf0_rd_base) + ' ')
-
-				if(inst.mfu0_mul_op_type == 'mul'):
-					dump_file.write('1 ')
-				else:
-					dump_file.write('0 ')
-
-				for addr in inst.mfu0_vrf1_rd_base:
-					dump_file.write(str(addr) + ' ')
-				for i in range(3-inst.batch):
-					dump_file.write('0 ')
-				#dump_file.write(str(inst.mfu0_vrf1_rd_base) + ' ')
-
-				dump_file.write(str(inst.batch) + ' ')
-				dump_file.write(str(inst.mfu0_tag) + '\n')
-				
-				# MFU1 macro-op
-				if((inst.mfu1_act_op_type == 'nop') and (inst.mfu1_act_op_type == 'nop') \
-				    and (inst.mfu1_act_op_type == 'nop')):
-					dump_file.write('0 ')
-				else:
-					dump_file.write('1 ')
-				dump_file.write(str(inst.mfu1_vrf_rd_size) + ' ')
-				if(inst.mfu1_act_op_type == 'tanh'):
-					dump_file.write('1 ')
-				elif(inst.mfu1_act_op_type == 'sig'):
-					dump_file.write('2 ')
-				elif(inst.mfu1_act_op_type == 'relu'):
-					dump_file.write('3 ')
-				else:
-					dump_file.write('0 ')
-				if(inst.mfu1_add_op_type == 'add'):
-					dump_file.write('1 ')
-				elif(inst.mfu1_add_op_type == 'sub_a_b'):
-					dump_file.write('2 ')
-				elif(inst.mfu1_add_op_type == 'sub_b_a'):
-					dump_file.write('3 ')
-				else:
-					dump_file.write('0 ')
-
-				for addr in inst.mfu1_vrf0_rd_base:
-					dump_file.write(str(addr) + ' ')
-				for i in range(3-inst.batch):
-					dump_file.write('0 ')
-				#dump_file.write(str(inst.mfu1_vrf0_rd_base) + ' ')
-
-				if(inst.mfu1_mul_op_type == 'mul'):
-					dump_file.write('1 ')
-				else:
-					dump_file.write('0 ')
+				dump_file.write(('1 ' if inst.mvu_op == MVU_OPS['matvec'] else '0 ') + \
+					' '.join(str(a) for a in inst.mvu_vrf_rd_base[0:3]) + ' ' + \
+					str(inst.mvu_vrf_rd_sz) + ' ' + str(inst.mvu_mrf_rd_base) + ' ' + str(inst.mvu_mrf_rd_sz) + ' ' + \
+					str(inst.mvu_tag) + '\n')
 
-				for addr in inst.mfu1_vrf1_rd_base:
-					dump_file.write(str(addr) + ' ')
-				for i in range(3-inst.batch):
-					dump_file.write('0 ')
-				#dump_file.write(str(inst.mfu1_vrf1_rd_base) + ' ')
+				# eVRF macro-op
+				dump_file.write(evrf_codes.get(inst.extvrf_op, '0 0 ') + \
+					''.join(str(a) + ' ' for a in inst.extvrf_rd_base[:inst.batch]) + pad(inst) + \
+					str(inst.extvrf_rd_sz) + ' ' + str(inst.batch) + ' ' + str(inst.extvrf_tag) + '\n')
+
+				# MFU0/MFU1 macro-ops (the enable bit only checks the activation op)
+				for mfu in ['mfu0', 'mfu1']:
+					act_op = getattr(inst, mfu + '_act_op')
+					dump_file.write(('0 ' if act_op == ACT_OPS['nop'] else '1 ') + \
+						str(getattr(inst, mfu + '_vrf_rd_size')) + ' ' + \
+						str(act_codes.get(act_op, 0)) + ' ' + \
+						str(add_codes.get(getattr(inst, mfu + '_add_op'), 0)) + ' ' + \
+						''.join(str(a) + ' ' for a in getattr(inst, mfu + '_vrf0_rd_base')) + pad(inst) + \
+						('1 ' if getattr(inst, mfu + '_mul_op') == MUL_OPS['mul'] else '0 ') + \
+						''.join(str(a) + ' ' for a in getattr(inst, mfu + '_vrf1_rd_base')) + pad(inst) + \
+						str(inst.batch) + ' ' + str(getattr(inst, mfu + '_tag')) + '\n')
 
-				dump_file.write(str(inst.batch) + ' ')
-				dump_file.write(str(inst.mfu1_tag) + '\n')
-				
 				# LD macro-op
-				if(inst.loader_src == 'wb'):
-					dump_file.write('1 0 ')
-				elif(inst.loader_src == 'in'):
-					dump_file.write('1 1 ')
-				elif(inst.loader_src == 'flush'):
-					dump_file.write('2 0 ')
-				else:
-					dump_file.write('0 0 ')
-				dump_file.write(str(inst.vrf_id0_wr_size) + ' ')
-				## DST0
-				if((inst.vrf_id0_wr_size == 0) or (inst.loader_src == 'flush')):
-					dump_file.write('0 ')
-				else:
-					dump_file.write('1 ')
-				if(inst.vrf_id0_op.startswith('mvu')):
-					vrf_id = re.search('mvu(.*)vrf', inst.vrf_id0_op)
-					dump_file.write(vrf_id.group(1)[:-1] + ' ')
-				elif(inst.vrf_id0_op == 'extvrf'):
-					dump_file.write(str(num_tiles) + ' ')
-				elif(inst.vrf_id0_op == 'mfu0.vrf0'):
-					dump_file.write(str(num_tiles+1) + ' ')
-				elif(inst.vrf_id0_op == 'mfu0.vrf1'):
-					dump_file.write(str(num_tiles+2) + ' ')
-				elif(inst.vrf_id0_op == 'mfu1.vrf0'):
-					dump_file.write(str(num_tiles+3) + ' ')
-				elif(inst.vrf_id0_op == 'mfu1.vrf1'):
-					dump_file.write(str(num_tiles+4) + ' ')
-				else:
-					dump_file.write('0 ')
-
-				for addr in inst.vrf_id0_wr_base:
-					dump_file.write(str(addr) + ' ')
-				for i in range(3-inst.batch):
-					dump_file.write('0 ')
-				#dump_file.write(str(inst.vrf_id0_wr_base) + ' ')
-
-				## DST1
-				if((inst.vrf_id1_wr_size == 0) or (inst.loader_src == 'flush')):
-					dump_file.write('0 ')
-				else:
-					dump_file.write('1 ')
-				if(inst.vrf_id1_op.startswith('mvu')):
-					vrf_id = re.search('mvu(.*)vrf', inst.vrf_id1_op)
-					dump_file.write(vrf_id.group(1)[:-1] + ' ')
-				elif(inst.vrf_id1_op == 'extvrf'):
-					dump_file.write(str(num_tiles) + ' ')
-				elif(inst.vrf_id1_op == 'mfu0.vrf0'):
-					dump_file.write(str(num_tiles+1) + ' ')
-				elif(inst.vrf_id1_op == 'mfu0.vrf1'):
-					dump_file.write(str(num_tiles+2) + ' ')
-				elif(inst.vrf_id1_op == 'mfu1.vrf0'):
-					dump_file.write(str(num_tiles+3) + ' ')
-				elif(inst.vrf_id1_op == 'mfu1.vrf1'):
-					dump_file.write(str(num_tiles+4) + ' ')
-				else:
-					dump_file.write('0 ')
-
-				for addr in inst.vrf_id1_wr_base:
-					dump_file.write(str(addr) + ' ')
-				for i in range(3-inst.batch):
-					dump_file.write('0 ')
-				#dump_file.write(str(inst.vrf_id1_wr_base) + ' ')
-
-				dump_file.write(str(inst.batch) + ' ')
-				if(inst.write_to_obuf == True):
-					dump_file.write('1 \n')
-				else:
-					dump_file.write('0 \n')
+				dump_file.write(ld_codes.get(inst.loader_op, '0 0 ') + str(inst.vrf_id0_wr_size) + ' ')
+				for vrf_id, wr_size, wr_base in [(inst.vrf_id0, inst.vrf_id0_wr_size, inst.vrf_id0_wr_base), \
+					(inst.vrf_id1, inst.vrf_id1_wr_size, inst.vrf_id1_wr_base)]:
+					dump_file.write(('0 ' if (wr_size == 0 or inst.loader_op == LD_OPS['flush']) else '1 ') + \
+						(str(vrf_id) if vrf_id != VRF_NONE else '0') + ' ' + \
+						''.join(str(a) + ' ' for a in wr_base) + pad(inst))
+				dump_file.write(str(inst.batch) + ' ' + ('1 \n' if inst.write_to_obuf == 1 else '0 \n'))
 	           
-		dump_path = '../simulator/gen_done'
-		with open(dump_path, 'w') as dump_file:
-			dump_file.write('1')
-		
-		subprocess.call('./perf_sim.sh', shell=True)	
+		progress('Building simulator')
+		with open('../simulator/make_log', 'w') as log:
+			subprocess.call(['make'], cwd='../simulator', stdout=log, stderr=subprocess.STDOUT)
+		if not os.path.isfile('../simulator/npu_sim'):
+			return {'passed': False, 'cycles': None, 'sim_time': 0}
+
+		progress('Running simulation')
+		sim = subprocess.run(['./npu_sim'], cwd='../simulator', stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+		with open('../simulator/perf_sim_log', 'w') as log:
+			log.write(sim.stdout)
+		with open('../simulator/make_clean_log', 'w') as log:
+			subprocess.call(['make', 'clean'], cwd='../simulator', stdout=log, stderr=subprocess.STDOUT)
+
+		# Cycle count and duration of the simulation loop as reported by the simulator
+		cycles = re.search('Total Simulation Time = (\\d+) cycle', sim.stdout)
+		duration = re.search('Simulation Duration = ([\\d.]+) sec', sim.stdout)
+		return {'passed': ('Outputs match!' in sim.stdout), 'cycles': int(cycles.group(1)) if cycles else None, \
+			'sim_time': float(duration.group(1)) if duration else 0}
+
+	# Prints the result of an RTL or performance simulation (see launch_rtl_sim and launch_perf_sim)
+	def print_sim_result(self, result, sim_name):
+		if(result['passed']):
+			runtime_ms = result['cycles'] * 1.0 / (self.flow_opts['freq']*1000)
+			print(bcolors.OKGREEN + 'PASSED (' + str(result['cycles']) + ' cycles - ' + str(round(runtime_ms, 5)) + \
+				' ms - ' + str(round(self.ops/(runtime_ms/1000)/1000000000000, 2)) + ' TOPS)' + bcolors.RESET)
+			print(bcolors.OKBLUE + sim_name + ' took ' + str(round(result['sim_time'], 3)) + ' sec' + bcolors.RESET)
+		else:
+			print(bcolors.FAIL + 'FAILED' + bcolors.RESET)
 
 
 	def run_flow(self):
 		self.end_npu_program()
+		# Results of the RTL and performance simulations (see print_sim_result)
+		self.flow_results = {}
 
 		print('\n')
 		if self.unsupported_layers:
@@ -2096,7 +2556,6 @@ class npu:
 		rtl_simulation = self.flow_opts['rtl_sim']
 		perf_simulation = self.flow_opts['perf_sim']
 		verbose = self.flow_opts['verbose']
-		freq = self.flow_opts['freq']
 		mif_gen = self.flow_opts['mif_gen']
 		pcie_gen = self.flow_opts['pcie_gen']
 		program_loops = self.flow_opts['program_loops']
@@ -2110,20 +2569,30 @@ class npu:
 			sys.exit(1)
 
 		# Make sure that dump files from previous runs are deleted
-		if os.path.isfile('./pac_dump/mvu-mrf0'):
-			subprocess.call('rm ./pac_dump/mvu-mrf*', shell=True)
-		if os.path.isfile('./pac_dump/input'):
-			subprocess.call('rm ./pac_dump/input', shell=True)
-		if os.path.isfile('./pac_dump/output'):
-			subprocess.call('rm ./pac_dump/output', shell=True)
-		if os.path.isfile('./pac_dump/top_sched'):
-			subprocess.call('rm ./pac_dump/top_sched', shell=True)
-		if os.path.isfile('./pac_dump/top_sched.mif'):
-			subprocess.call('rm ./pac_dump/top_sched.mif', shell=True)
+		for dump_name in PACKED_DUMP_NAMES + ['top_sched.mif']:
+			if os.path.isfile('./pac_dump/' + dump_name):
+				subprocess.call(['rm', './pac_dump/' + dump_name], shell=False)
 
 		# Step 1: Compile NPU program written by the user in npu_program() function
 		print(bcolors.HEADER + '=== Compiling NPU Program ===' + bcolors.RESET)
+		if(self.flow_opts['vrf_reuse']):
+			self.reuse_vrfs()
 		print(bcolors.OKGREEN + 'NPU program compiled successfully! It contains ' + str(len(self.inst_q)) + ' NPU instruction(s)' + bcolors.RESET)
+		if(self.flow_opts['vrf_reuse']):
+			self.print_vrf_pressure()
+		if(self.flow_opts['alloc_report']):
+			self.print_alloc_report()
+		self.record_mem_stage('Compilation')
+
+		# With -estimate, report the analytical timing model instead of running the simulations
+		if(self.flow_opts['estimate']):
+			self.print_estimate(verbose)
+			self.record_mem_stage('Performance estimate')
+			subprocess.call('rm -rf __pycache__/', shell=True)
+			if(self.flow_opts['mem_report'] and tracemalloc.is_tracing()):
+				self.print_mem_report()
+				tracemalloc.stop()
+			return True
 
 		# -------------------------------------------------------------------------
 
@@ -2134,148 +2603,53 @@ class npu:
 		sys.stdout.flush()
 		if os.path.isdir('./dump'):
 			subprocess.call('rm -r ./dump', shell=True)
+		self.inst_words = {}
 		checkpoints_count = self.generate_fsim_checkpoints(checkpoint_name, verbose)
 		print(bcolors.OKGREEN + 'DONE' + bcolors.RESET)
+		self.record_mem_stage('Functional simulation')
 
 		# -------------------------------------------------------------------------
 		
 		# Generate PCIe files
 		if(pcie_gen):
-			if os.path.isfile('./pcie_dump/mrfs.dat'):
-				subprocess.call('rm ./pcie_dump/mrfs.dat', shell=True)
-			if os.path.isfile('./pcie_dump/inputs.dat'):
-				subprocess.call('rm ./pcie_dump/inputs.dat', shell=True)
-			if os.path.isfile('./pcie_dump/outputs.dat'):
-				subprocess.call('rm ./pcie_dump/outputs.dat', shell=True)
-			if os.path.isfile('./pcie_dump/instructions.dat'):
-				subprocess.call('rm ./pcie_dump/instructions.dat', shell=True)
+			if os.path.isfile('./pcie_dump/npu_bundle.bin'):
+				subprocess.call('rm ./pcie_dump/npu_bundle.bin', shell=True)
 
 			print(bcolors.HEADER + '=== Generating PCIE Files ===' + bcolors.RESET)
-			thread1 = threading.Thread(target = self.dump_pcie_files, args = (checkpoint_name, num_tiles, num_dpes, num_lanes, program_loops))
-			thread1.start()
-
-			sys.stdout.write('Dumping MRF data ... ')
+			sys.stdout.write('Dumping PCIe bundle ... ')
 			sys.stdout.flush()
-			mrf_file_name = './pcie_dump/mrfs.dat'
-			while not os.path.isfile(mrf_file_name):
-				time.sleep(0.2)
+			self.dump_pcie_files(checkpoint_name, num_tiles, num_dpes, num_lanes, program_loops)
 			print(bcolors.OKGREEN + 'DONE' + bcolors.RESET)
-
-			sys.stdout.write('Dumping inputs file ... ')
-			sys.stdout.flush()
-			while not os.path.isfile('./pcie_dump/inputs.dat'):
-				time.sleep(0.2)
-			print(bcolors.OKGREEN + 'DONE' + bcolors.RESET)
-
-			sys.stdout.write('Dumping instructions file ... ')
-			sys.stdout.flush()
-			while not os.path.isfile('./pcie_dump/instructions.dat'):
-				time.sleep(0.2)
-			print(bcolors.OKGREEN + 'DONE' + bcolors.RESET)
-
-			sys.stdout.write('Dumping outputs file ... ')
-			sys.stdout.flush()
-			while not os.path.isfile('./pcie_dump/outputs.dat'):
-				time.sleep(0.2)
-			print(bcolors.OKGREEN + 'DONE' + bcolors.RESET)
-
-			thread1.join()
+			self.record_mem_stage('PCIe files')
 		# -------------------------------------------------------------------------
 
 		# Step 3: Generate PAC C header file
 
-		# Use the checkpoints generated by FSim (python data structures) to generate binary low-level NPU checkpoints
+		# Use the checkpoints generated by FSim (python data structures) to generate the PAC header file
 		if(pac_gen):
 			print(bcolors.HEADER + '=== Generating PAC Header File ===' + bcolors.RESET)
-			thread1 = threading.Thread(target = self.dump_binary_files, args = (checkpoint_name, num_tiles, num_dpes, num_lanes))
-			thread1.start()
-
-			sys.stdout.write('Dumping MRF data ... ')
-			sys.stdout.flush()
-			while not os.path.isfile('./pac_dump/mvu-mrf' + str(num_tiles * num_dpes - 1)):
-				time.sleep(0.2)
-			print(bcolors.OKGREEN + 'DONE' + bcolors.RESET)
-
-			sys.stdout.write('Dumping input vectors ... ')
-			sys.stdout.flush()
-			while not os.path.isfile('./pac_dump/input'):
-				time.sleep(0.2)
-			print(bcolors.OKGREEN + 'DONE' + bcolors.RESET)
-
-			sys.stdout.write('Dumping instructions ... ')
-			sys.stdout.flush()
-			while not os.path.isfile('./pac_dump/input'):
-				time.sleep(0.2)
-			print(bcolors.OKGREEN + 'DONE' + bcolors.RESET)
-
-			sys.stdout.write('Dumping output vectors ... ')
-			sys.stdout.flush()
-			while not os.path.isfile('./pac_dump/input'):
-				time.sleep(0.2)
-			print(bcolors.OKGREEN + 'DONE' + bcolors.RESET)
-
-			thread1.join()
-
-			# Transform the binary low-level NPU checkpoints into the PAC header file format
 			sys.stdout.write('Generating C header file ... ')
 			sys.stdout.flush()
-			transform_list_to_mif(num_lanes)
-			generate_header_file(checkpoint_name)
+			mrf_image, inputs, insts, outputs = self.checkpoint_arrays(checkpoint_name, num_tiles, num_dpes, num_lanes)
+			generate_header_file(checkpoint_name, mrf_image, inputs, insts, outputs, self.flow_opts['pac_blob'])
 			print(bcolors.OKGREEN + 'DONE' + bcolors.RESET)
-
-			# After generating C header file, clean all the checkpoints created along the way
-			subprocess.call('rm ./pac_dump/mvu-mrf* ./pac_dump/input ./pac_dump/output ./pac_dump/top_sched.mif', shell=True)
+			self.record_mem_stage('PAC header file')
 
 		# -------------------------------------------------------------------------
 		# Generate MIF files
 		if(mif_gen):
 			print(bcolors.HEADER + '=== Generating MIF Files ===' + bcolors.RESET)
-			thread1 = threading.Thread(target = self.dump_binary_files, args = (checkpoint_name, num_tiles, num_dpes, num_lanes))
-			thread1.start()
-
-			sys.stdout.write('Dumping MRF data ... ')
-			sys.stdout.flush()
-			if(num_tiles * num_dpes - 1 < 10):
-				mrf_mif_name = './pac_dump/mvu-mrf00'
-			elif(num_tiles * num_dpes - 1 < 100):
-				mrf_mif_name = './pac_dump/mvu-mrf0'
-			else:
-				mrf_mif_name = './pac_dump/mvu-mrf'
-			while not os.path.isfile(mrf_mif_name + str(num_tiles * num_dpes - 1)):
-				time.sleep(0.2)
-			print(bcolors.OKGREEN + 'DONE' + bcolors.RESET)
-
-			sys.stdout.write('Dumping input vectors ... ')
-			sys.stdout.flush()
-			while not os.path.isfile('./pac_dump/input'):
-				time.sleep(0.2)
-			print(bcolors.OKGREEN + 'DONE' + bcolors.RESET)
-
-			sys.stdout.write('Dumping instructions ... ')
-			sys.stdout.flush()
-			while not os.path.isfile('./pac_dump/top_sched'):
-				time.sleep(0.2)
-			print(bcolors.OKGREEN + 'DONE' + bcolors.RESET)
-
-			sys.stdout.write('Dumping output vectors ... ')
-			sys.stdout.flush()
-			while not os.path.isfile('./pac_dump/output'):
-				time.sleep(0.2)
-			print(bcolors.OKGREEN + 'DONE' + bcolors.RESET)
-
-			thread1.join()
+			self.dump_binary_files(checkpoint_name, num_tiles, num_dpes, num_lanes, flow_progress())
 
 			# Transform the binary low-level NPU checkpoints into MIF files
 			sys.stdout.write('Converting checkpoints to MIFs ... ')
 			sys.stdout.flush()
-			transform_list_to_mif(num_lanes)
-			subprocess.call('rm ./pac_dump/input ./pac_dump/output', shell=True)
-			if(os.path.isdir('../rtl/mif_files') == False):
-				subprocess.call('mkdir ../rtl/mif_files', shell=True)
-			subprocess.call('mv ./pac_dump/*.mif ../rtl/mif_files/', shell=True)
-			print(bcolors.OKGREEN + 'DONE' + bcolors.RESET)
+			written, total = transform_list_to_mif(num_lanes, '../rtl/mif_files/', self.flow_opts['mif_jobs'])
+			subprocess.call(['rm'] + ['./pac_dump/' + dump_name for dump_name in PACKED_DUMP_NAMES], shell=False)
+			print(bcolors.OKGREEN + 'DONE' + bcolors.RESET + ' (' + str(written) + ' of ' + str(total) + ' files changed)')
 
 			self.write_verilog_header_file(num_tiles, num_dpes, num_lanes, vrf_depth, mrf_depth, self.arch_params['max_tag'], self.mrf_filled_depth)
+			self.record_mem_stage('MIF files')
 
 		# -------------------------------------------------------------------------
 		# Step 4: Perform RTL simulation
@@ -2290,93 +2664,19 @@ class npu:
 				subprocess.call('rm ../rtl/sim_done', shell=True)
 
 			print(bcolors.HEADER + '=== Launching RTL Simulation ===' + bcolors.RESET)
-
-			start_time = time.time()
-
-			thread1 = threading.Thread(target = self.launch_rtl_sim, args = (checkpoint_name, num_tiles, num_dpes, num_lanes, vrf_depth, mrf_depth, self.arch_params['max_tag'], self.mrf_filled_depth))
-			thread1.start()
-
-			sys.stdout.write('Setting up simulation ... ')
-			sys.stdout.flush()
-			while not os.path.isfile('../rtl/init_done'):
-				time.sleep(0.2)
-			print(bcolors.OKGREEN + 'DONE' + bcolors.RESET)
-
-			'''sys.stdout.write('Loading MRFs ... ')
-			sys.stdout.flush()
-			while not os.path.isfile('../rtl/mrf_done'):
-				time.sleep(0.2)
-			print(bcolors.OKGREEN + 'DONE' + bcolors.RESET)'''
-
-			sys.stdout.write('Loading inputs ... ')
-			sys.stdout.flush()
-			while not os.path.isfile('../rtl/input_done'):
-				time.sleep(0.2)
-			print(bcolors.OKGREEN + 'DONE' + bcolors.RESET)
-
-			sys.stdout.write('Running simulation ... ')
-			sys.stdout.flush()
-			while not os.path.isfile('../rtl/sim_done'):
-				time.sleep(0.2)
-
-			end_time = time.time()
-			time.sleep(2)
-			
-			file = open('../rtl/sim_done', 'r')
-			lines = file.readlines()
-			if (lines[0] == 'PASS\n'):
-				runtime_ms = int(lines[1]) * 1.0 / (freq*1000)
-				print(bcolors.OKGREEN + 'PASSED (' + lines[1] + ' cycles - ' + str(round(runtime_ms, 5)) + ' ms - ' + str(round(self.ops/(runtime_ms/1000)/1000000000000, 2)) + ' TOPS)' + bcolors.RESET)
-				print(bcolors.OKBLUE + 'RTL simulation took ' + str(round(end_time-start_time, 3)) + ' sec' + bcolors.RESET)
-			else:
-				print(bcolors.FAIL + 'FAILED' + bcolors.RESET)
-
-			thread1.join()
+			self.flow_results['rtl_sim'] = self.launch_rtl_sim(checkpoint_name, num_tiles, num_dpes, num_lanes, vrf_depth, mrf_depth, \
+				self.arch_params['max_tag'], self.mrf_filled_depth, flow_progress())
+			self.print_sim_result(self.flow_results['rtl_sim'], 'RTL simulation')
+			self.record_mem_stage('RTL simulation')
 
 		# -------------------------------------------------------------------------
 
 		# Step 5: Perform Performance simulation
 		if(perf_simulation == 1):
-			if os.path.isfile('../simulator/gen_done'):
-				subprocess.call('rm ../simulator/gen_done', shell=True)
-			if os.path.isfile('../simulator/sim_done'):
-				subprocess.call('rm ../simulator/sim_done', shell=True)
-
 			print(bcolors.HEADER + '=== Launching C++ Performance Simulation ===' + bcolors.RESET)
-
-			thread1 = threading.Thread(target = self.launch_perf_sim, args = (num_tiles, num_dpes, num_lanes, vrf_depth, mrf_depth))
-			thread1.start()
-
-			sys.stdout.write('Generating simulation files ... ')
-			sys.stdout.flush()
-			while not os.path.isfile('../simulator/gen_done'):
-				time.sleep(0.2)
-			print(bcolors.OKGREEN + 'DONE' + bcolors.RESET)
-
-			sys.stdout.write('Building simulator ... ')
-			sys.stdout.flush()
-			while not os.path.isfile('../simulator/npu_sim'):
-				time.sleep(0.2)
-			print(bcolors.OKGREEN + 'DONE' + bcolors.RESET)
-
-			sys.stdout.write('Running simulation ... ')
-			sys.stdout.flush()
-			while not os.path.isfile('../simulator/sim_done'):
-				time.sleep(0.2)
-			time.sleep(2)
-
-			file = open('../simulator/sim_done', 'r')
-			lines = file.readlines()
-			if (lines[0] == 'PASS\n'):
-				runtime_ms = int(lines[1]) * 1.0 / (freq*1000)
-				print(bcolors.OKGREEN + 'PASSED (' + str(int(lines[1])) + ' cycles - ' + str(round(runtime_ms, 5)) + \
-					' ms - ' + str(round(self.ops/(runtime_ms/1000)/1000000000000, 2)) + ' TOPS)' + bcolors.RESET)
-				sim_time = int(lines[2])
-				print(bcolors.OKBLUE + 'C++ simulation took ' + str(round(sim_time, 3)) + ' sec' + bcolors.RESET)
-			else:
-				print(bcolors.FAIL + 'FAILED' + bcolors.RESET)
-
-			thread1.join()
+			self.flow_results['perf_sim'] = self.launch_perf_sim(num_tiles, num_dpes, num_lanes, vrf_depth, mrf_depth, flow_progress())
+			self.print_sim_result(self.flow_results['perf_sim'], 'C++ simulation')
+			self.record_mem_stage('Performance simulation')
 
 		# -------------------------------------------------------------------------
 
@@ -2385,12 +2685,12 @@ class npu:
 		if(perf_simulation == 1):
 			subprocess.call('rm ../simulator/make_log', shell=True)
 			subprocess.call('rm ../simulator/make_clean_log', shell=True)
-			subprocess.call('rm ../simulator/gen_done', shell=True)
-			subprocess.call('rm ../simulator/sim_done', shell=True)
 			subprocess.call('rm ../simulator/register_files/*.txt', shell=True)
 		if(rtl_simulation == 1):
 			subprocess.call('rm ../rtl/*_done', shell=True)
-			subprocess.call('rm ../rtl/mif_files/*.mif', shell=True)
+		if(self.flow_opts['mem_report'] and tracemalloc.is_tracing()):
+			self.print_mem_report()
+			tracemalloc.stop()
 		return True
 
 ##############################################################################################
@@ -2442,6 +2742,7 @@ class vector:
 '''
 The matrix class defines the persistent weight matrices. It has same parameters as the vector class in addition to:
 - dimension_y: the M dimension of the matrix as specified by the user (vertical dimension -- without padding)
+- scale: per-tensor quantization scale of the matrix data (1 if the data is already int8, see quantize_int8)
 '''
 class matrix:
 	def __init__(self, name, dimension_x, dimension_y, space_name, tiles, dpes, lanes, in_data_type, data):
@@ -2456,14 +2757,209 @@ class matrix:
 		self.dimension_x_padded = int(math.ceil(1.0 * dimension_x / tiles / lanes) * tiles * lanes)
 		self.word_count = int(self.dimension_x_padded / tiles / lanes) * int(self.dimension_y_padded / dpes)
 		self.alloc_addr = -1
-		self.useful_data = data
+		# Float data is quantized to int8 straight into the padded matrix (scale: float value of one int8 step)
 		self.data = np.zeros((self.dimension_y_padded, self.dimension_x_padded), dtype=in_data_type)
-		self.data[:self.useful_data.shape[0],:self.useful_data.shape[1]] = self.useful_data 
+		self.scale = quantize_int8(data, self.data[:np.shape(data)[0], :np.shape(data)[1]])
+		self.useful_data = self.data[:np.shape(data)[0], :np.shape(data)[1]]
 
 	# Print some information about the matrix	
 	def info(self):
 		print('Matrix ' + self.name + ' , Size: ' + str(self.dimension_x) + 'x' + str(self.dimension_y) + ' element(s), Mem Space: ' +  self.space_name + ', Base Address: ' + str(self.alloc_addr) + ', Word Count: ' + str(self.word_count))
 
+'''
+This function lays out a padded matrix (dimension_y_padded x dimension_x_padded) the way it is stored in the MRFs.
+Element (y, x) goes to tile x / tile_cols, DPE y % dpes, lane x % lanes and word (x % tile_cols) / lanes +
+(y / dpes) * (tile_cols / lanes), where tile_cols = dimension_x_padded / tiles. It returns an array of shape
+(tiles, dpes, word_count, lanes) that is copied into the MRFs starting at the matrix allocation address. If out (the
+MRF words of the matrix) is given, the matrix is written into it one row group at a time instead, without building
+the full image.
+'''
+def mrf_layout(data, tiles, dpes, lanes, out=None):
+	rows, cols = data.shape
+	words_per_row = cols // tiles // lanes
+	# (row group, DPE, tile, word, lane) -> (tile, DPE, row group, word, lane)
+	image = data.reshape(rows // dpes, dpes, tiles, words_per_row, lanes).transpose(2, 1, 0, 3, 4)
+	if out is None:
+		return image.reshape(tiles, dpes, (rows // dpes) * words_per_row, lanes)
+	for group in range(rows // dpes):
+		out[:, :, group * words_per_row:(group + 1) * words_per_row, :] = image[:, :, group]
+	return out
+
+# Rows (first axis entries) quantized at a time by quantize_int8
+QUANT_BLOCK = 256
+
+'''
+This function quantizes a tensor to int8 with a symmetric per-tensor scale (data ~ scale * q, q in [-127, 127]) and
+writes it to out, an int8 array of the same shape (e.g. the unpadded part of a matrix). The tensor is converted
+QUANT_BLOCK rows at a time, so no full-size temporaries are created. Integer data in the int8 range is copied as is
+(scale 1). Returns the scale.
+'''
+def quantize_int8(data, out):
+	data = np.asarray(data)
+	assert data.shape == out.shape, 'Cannot quantize a tensor of shape ' + str(data.shape) + ' into ' + str(out.shape)
+	if(np.issubdtype(data.dtype, np.integer)):
+		assert data.size == 0 or (data.min() >= -128 and data.max() <= 127), 'Integer data has to be in the int8 range'
+		out[...] = data
+		return 1.0
+	scale = int8_scale(data)
+	for start in range(0, max(len(data), 1), QUANT_BLOCK):
+		block = np.rint(data[start:start + QUANT_BLOCK] / scale)
+		out[start:start + QUANT_BLOCK] = np.clip(block, -127, 127)
+	return scale
+
+# Per-tensor int8 quantization scale of a tensor (1 for integer tensors and all-zero tensors)
+def int8_scale(data):
+	data = np.asarray(data)
+	if(np.issubdtype(data.dtype, np.integer) or data.size == 0):
+		return 1.0
+	max_abs = max(float(data.max()), -float(data.min()))
+	return max_abs / 127.0 if max_abs > 0 else 1.0
+
+# Hash of the compiler sources, used as the compiler version in the compile cache keys
+def compiler_version():
+	version = hashlib.sha256()
+	src_dir = os.path.dirname(os.path.abspath(__file__))
+	for src in ['compiler.py', 'npu_layers.py', 'fsim.py']:
+		with open(os.path.join(src_dir, src), 'rb') as src_file:
+			version.update(src_file.read())
+	return version.hexdigest()
+
+'''
+Max segment tree over the indices 0..n-1 (all values start at 0). first_at_least(value, lo) returns the lowest index
+i >= lo whose value is at least value (or -1), in time logarithmic in n. Nodes are kept in a dict and zero nodes are
+dropped, so only the paths to non-zero leaves take memory (the virtual VRF spaces are 2^40 words deep).
+'''
+class max_tree:
+	def __init__(self, n):
+		self.size = 1
+		while(self.size < n):
+			self.size *= 2
+		self.tree = {}
+
+	def update(self, i, value):
+		i += self.size
+		while(i > 0):
+			if(value):
+				self.tree[i] = value
+			else:
+				self.tree.pop(i, None)
+			i //= 2
+			value = max(self.tree.get(2 * i, 0), self.tree.get(2 * i + 1, 0))
+
+	def max(self):
+		return self.tree.get(1, 0)
+
+	def first_at_least(self, value, lo=0):
+		if(lo >= self.size):
+			return -1
+		i = lo + self.size
+		while(self.tree.get(i, 0) < value):
+			# Move to the next subtree on the right of the current one
+			while(i & 1):
+				i //= 2
+			if(i == 0):
+				return -1
+			i += 1
+		# Descend to the leftmost leaf that is large enough
+		while(i < self.size):
+			i = 2 * i if self.tree.get(2 * i, 0) >= value else 2 * i + 1
+		return i - self.size
+
+'''
+The mem_allocator class does the book-keeping of one NPU memory space. Free memory is kept as disjoint blocks indexed
+by start and end address, with two max trees on top, so that allocation and free are logarithmic in the memory depth:
+- policy: first (lowest address that fits, same addresses as a linear scan from address 0) or best (smallest block
+  that fits, ties broken by lowest address)
+- alloc(size): returns the start address of the allocated words or -1 if no free block is large enough
+- free(addr): releases the block allocated at addr and merges it with its free neighbours
+- stats(): occupancy and fragmentation statistics (fragmentation = 1 - largest free block / free words)
+'''
+class mem_allocator:
+	POLICIES = ['first', 'best']
+
+	def __init__(self, depth, policy='first'):
+		assert policy in mem_allocator.POLICIES, 'Unsupported allocation policy ' + str(policy)
+		self.depth = depth
+		self.policy = policy
+		# Free blocks: start -> size, end -> start, and a tree over the start addresses holding the block sizes
+		self.free_sizes = {}
+		self.free_ends = {}
+		self.by_start = max_tree(depth)
+		# Best fit: a tree over the block sizes (1 if a free block of that size exists) and a min-heap of the starts
+		# of the blocks of each size (entries of blocks that are no longer free are dropped lazily)
+		self.by_size = max_tree(depth + 1)
+		self.starts_of_size = {}
+		if(depth > 0):
+			self.add_free_block(0, depth)
+		# Allocated blocks: start -> size
+		self.used_blocks = {}
+		self.used = 0
+		self.peak = 0
+		self.allocs = 0
+		self.frees = 0
+
+	def add_free_block(self, start, size):
+		self.free_sizes[start] = size
+		self.free_ends[start + size] = start
+		self.by_start.update(start, size)
+		heapq.heappush(self.starts_of_size.setdefault(size, []), start)
+		self.by_size.update(size, 1)
+
+	def remove_free_block(self, start):
+		size = self.free_sizes.pop(start)
+		del self.free_ends[start + size]
+		self.by_start.update(start, 0)
+		starts = self.starts_of_size[size]
+		while(starts and self.free_sizes.get(starts[0]) != size):
+			heapq.heappop(starts)
+		if(not starts):
+			self.by_size.update(size, 0)
+		return size
+
+	def alloc(self, size):
+		if(size <= 0 or size > self.by_start.max()):
+			return -1
+		if(self.policy == 'best'):
+			start = self.starts_of_size[self.by_size.first_at_least(1, size)][0]
+		else:
+			start = self.by_start.first_at_least(size)
+		block_size = self.remove_free_block(start)
+		if(block_size > size):
+			self.add_free_block(start + size, block_size - size)
+		self.used_blocks[start] = size
+		self.used += size
+		self.peak = max(self.peak, self.used)
+		self.allocs += 1
+		return start
+
+	def free(self, addr):
+		assert addr in self.used_blocks, 'No allocated block starts at address ' + str(addr)
+		size = self.used_blocks.pop(addr)
+		self.used -= size
+		self.frees += 1
+		start = addr
+		# Merge with the free block right after and right before the released one
+		if((addr + size) in self.free_sizes):
+			size += self.remove_free_block(addr + size)
+		if(addr in self.free_ends):
+			start = self.free_ends[addr]
+			size += self.remove_free_block(start)
+		self.add_free_block(start, size)
+
+	def stats(self):
+		free_words = self.depth - self.used
+		largest_free = self.by_start.max()
+		return {
+			'depth'         : self.depth,
+			'used'          : self.used,
+			'peak'          : self.peak,
+			'allocs'        : self.allocs,
+			'frees'         : self.frees,
+			'free_blocks'   : len(self.free_sizes),
+			'largest_free'  : largest_free,
+			'fragmentation' : (1.0 - 1.0 * largest_free / free_words) if free_words > 0 else 0.0
+		}
+
 # Used for colored printing to the terminal.
 class bcolors:
 	HEADER = '\033[95m'
@@ -2476,335 +2972,305 @@ class bcolors:
 	UNDERLINE = '\033[4m'
 	RESET = "\033[0;0m"
 
-def transform_list_to_mif(num_lanes):
+'''
+Progress of the steps of a flow stage, reported by the stage functions through callbacks. Calling it with the name of
+a step marks the previous step as done and starts printing the new one, calling it without a step marks the last step
+as done.
+'''
+class flow_progress:
+	def __init__(self):
+		self.step = None
+
+	def __call__(self, step = None):
+		if(self.step is not None):
+			print(bcolors.OKGREEN + 'DONE' + bcolors.RESET)
+		self.step = step
+		if(step is not None):
+			sys.stdout.write(step + ' ... ')
+			sys.stdout.flush()
+
+'''
+Packed binary dump format of the PAC and MIF flows, one mmap-able file per memory. A file starts with a header:
+- magic: 'NPUDUMP' followed by the format version (8 bytes)
+- entries: number of memory instances, e.g. one per MRF (uint32)
+- depth: number of words of each entry (uint32)
+- width: word width in bits (uint32)
+- word_bytes: number of bytes of each word (uint32)
+- index: byte offset of the words of each entry in the file (uint64 per entry)
+The words start at the first index offset (aligned to PACKED_DUMP_ALIGN bytes). Each word is stored little-endian (bit
+i of a word is bit i%8 of its byte i//8) with the unused bits set to zero. All values are little-endian.
+'''
+PACKED_DUMP_MAGIC = b'NPUDUMP1'
+PACKED_DUMP_HEADER = np.dtype([('magic', 'S8'), ('entries', '<u4'), ('depth', '<u4'), ('width', '<u4'), ('word_bytes', '<u4')])
+PACKED_DUMP_ALIGN = 64
+# Packed dumps written by dump_binary_files into pac_dump
+PACKED_DUMP_NAMES = ['mvu-mrf.bin', 'input.bin', 'output.bin', 'top_sched.bin']
+
+# Writes an (entries, depth, word_bytes) array of words with the given width in bits as a packed dump
+def write_packed_dump(path, words, width):
+	entries, depth, word_bytes = words.shape
+	assert word_bytes == int(math.ceil(width / 8.0)), 'Words of ' + str(word_bytes) + ' bytes cannot hold ' + str(width) + ' bits'
+	header = np.array([(PACKED_DUMP_MAGIC, entries, depth, width, word_bytes)], dtype=PACKED_DUMP_HEADER)
+	data_offset = int(math.ceil((header.nbytes + 8 * entries) / float(PACKED_DUMP_ALIGN))) * PACKED_DUMP_ALIGN
+	index = data_offset + (np.arange(entries, dtype='<u8') * depth * word_bytes)
+	with open(path, 'wb') as dump_file:
+		dump_file.write(header.tobytes())
+		dump_file.write(index.tobytes())
+		dump_file.write(bytes(data_offset - header.nbytes - index.nbytes))
+		np.ascontiguousarray(words, dtype=np.uint8).tofile(dump_file)
+
+# Reads a packed dump. Returns the word width in bits and an (entries, depth, word_bytes) memory map of the words.
+def read_packed_dump(path):
+	header = np.fromfile(path, dtype=PACKED_DUMP_HEADER, count=1)
+	assert len(header) == 1 and header[0]['magic'] == PACKED_DUMP_MAGIC, path + ' is not a packed NPU dump'
+	entries, depth, width, word_bytes = [int(header[0][field]) for field in ['entries', 'depth', 'width', 'word_bytes']]
+	index = np.fromfile(path, dtype='<u8', count=entries, offset=header.nbytes)
+	assert np.array_equal(np.diff(index), [depth * word_bytes] * (entries - 1)), path + ' has non-contiguous entries'
+	return width, np.memmap(path, dtype=np.uint8, mode='r', offset=int(index[0]), shape=(entries, depth, word_bytes))
+
+'''
+PCIe bundle of the PCIe demo (npu_bundle.bin), read by the host with patch/npu_test/npu_bundle.hpp or read_pcie_bundle.
+All values are little-endian. The file starts with a header:
+- magic: 'NPUPCIE' (8 bytes, zero padded)
+- version, header_bytes (size of the header and the section table), program_loops, cores, num_sections (uint32)
+followed by a table of sections:
+- name (8 bytes, zero padded), offset of the section data (uint64), dim0, dim1, row_bytes (uint32)
+Each section holds dim0 x dim1 rows of row_bytes bytes (lane l in byte l, truncated to 8 bits) aligned to
+PACKED_DUMP_ALIGN bytes: mrfs (one block of words per MRF), insts (instructions and the program loops word), inputs
+and outputs (dim0 = 1). Every input/output row is sent once per core and per program loop.
+'''
+PCIE_BUNDLE_MAGIC = b'NPUPCIE'
+PCIE_BUNDLE_VERSION = 1
+PCIE_BUNDLE_HEADER = np.dtype([('magic', 'S8'), ('version', '<u4'), ('header_bytes', '<u4'), ('program_loops', '<u4'), \
+	('cores', '<u4'), ('num_sections', '<u4'), ('reserved', '<u4')])
+PCIE_BUNDLE_SECTION = np.dtype([('name', 'S8'), ('offset', '<u8'), ('dim0', '<u4'), ('dim1', '<u4'), ('row_bytes', '<u4'), \
+	('reserved', '<u4')])
+# Rows written per chunk and number of NPU cores fed with copies of the inputs by the host
+PCIE_BUNDLE_CHUNK = 4096
+PCIE_CORES = 2
+
+# Writes a PCIe bundle. The sections are (name, data) where the data is a (dim0, dim1, row_bytes) integer array or a
+# list of (rows, row_bytes) arrays concatenated into dim1 rows (dim0 = 1). The data is streamed in chunks of rows.
+def write_pcie_bundle(path, sections, program_loops, cores):
+	blocks = [data if isinstance(data, list) else list(data) for name, data in sections]
+	header = np.zeros(1, dtype=PCIE_BUNDLE_HEADER)
+	table = np.zeros(len(sections), dtype=PCIE_BUNDLE_SECTION)
+	offset = header.nbytes + table.nbytes
+	header[0] = (PCIE_BUNDLE_MAGIC, PCIE_BUNDLE_VERSION, offset, program_loops, cores, len(sections), 0)
+	for i, (name, data) in enumerate(sections):
+		offset = int(math.ceil(offset / float(PACKED_DUMP_ALIGN))) * PACKED_DUMP_ALIGN
+		dim0 = 1 if isinstance(data, list) else len(data)
+		dim1 = sum([len(block) for block in blocks[i]]) // dim0
+		row_bytes = np.shape(blocks[i][0])[-1] if blocks[i] else 0
+		table[i] = (name.encode(), offset, dim0, dim1, row_bytes, 0)
+		offset += dim0 * dim1 * row_bytes
+
+	with open(path, 'wb') as bundle_file:
+		bundle_file.write(header.tobytes())
+		bundle_file.write(table.tobytes())
+		for i in range(len(sections)):
+			bundle_file.write(bytes(int(table[i]['offset']) - bundle_file.tell()))
+			for block in blocks[i]:
+				for row in range(0, len(block), PCIE_BUNDLE_CHUNK):
+					block[row:row+PCIE_BUNDLE_CHUNK].astype(np.uint8).tofile(bundle_file)
+
+# Reads a PCIe bundle. Returns the header fields as a dict and the sections as a dict of (dim0, dim1, row_bytes) memory
+# maps. Use pcie_stream_rows for the rows of the input/output streams sent by the host.
+def read_pcie_bundle(path):
+	header = np.fromfile(path, dtype=PCIE_BUNDLE_HEADER, count=1)
+	assert len(header) == 1 and header[0]['magic'] == PCIE_BUNDLE_MAGIC, path + ' is not an NPU PCIe bundle'
+	assert header[0]['version'] == PCIE_BUNDLE_VERSION, path + ' has version ' + str(header[0]['version']) + \
+		', expected ' + str(PCIE_BUNDLE_VERSION)
+	info = dict([(field, int(header[0][field])) for field in ['version', 'program_loops', 'cores']])
+	table = np.fromfile(path, dtype=PCIE_BUNDLE_SECTION, count=int(header[0]['num_sections']), offset=header.nbytes)
+	sections = {}
+	for entry in table:
+		shape = (int(entry['dim0']), int(entry['dim1']), int(entry['row_bytes']))
+		if (np.prod(shape) == 0):
+			sections[entry['name'].decode()] = np.zeros(shape, dtype=np.uint8)
+		else:
+			sections[entry['name'].decode()] = np.memmap(path, dtype=np.uint8, mode='r', offset=int(entry['offset']), shape=shape)
+	return info, sections
+
+# Indices of the rows of an input/output section in the stream sent by the host (every row once per core, repeated
+# for each program loop)
+def pcie_stream_rows(info, num_rows):
+	return np.tile(np.repeat(np.arange(num_rows), info['cores']), info['program_loops'])
+
+# Digits of a (words, word_bytes) array of packed words as a (words, digits) array of ASCII codes, MSB first: width
+# bits for the 'BIN' radix or width/4 lowercase hex digits for the 'HEX' radix
+def packed_word_digits(words, width, radix):
+	if(radix == 'BIN'):
+		return np.unpackbits(words, axis=1, bitorder='little')[:, :width][:, ::-1] + ord('0')
+	nibbles = np.stack([words & 0xf, words >> 4], axis=2).reshape(len(words), -1)[:, :width // 4][:, ::-1]
+	return np.frombuffer(b'0123456789abcdef', dtype=np.uint8)[nibbles]
+
+# Text of a MIF file from a (depth, digits) array of ASCII digits. The depth and width come from the array, so the
+# file is built in one pass.
+def mif_text(digits, width, radix):
+	text = np.ascontiguousarray(digits, dtype=np.uint8).tobytes().decode()
+	line_width = digits.shape[1]
+	return 'DEPTH = ' + str(len(digits)) + ';\nWIDTH = ' + str(width) + ';\nADDRESS_RADIX = DEC;\nDATA_RADIX = ' + radix + \
+		';\nCONTENT\nBEGIN\n' + ''.join([str(i) + ': ' + text[i*line_width : (i+1)*line_width] + ';\n' \
+		for i in range(len(digits))]) + 'END;\n'
+
+# Writes a text file unless it already exists with the same content hash. Returns 1 if the file was written, 0 if not.
+def write_if_changed(path, text):
+	data = text.encode()
+	if(os.path.isfile(path) and os.path.getsize(path) == len(data)):
+		with open(path, 'rb') as old_file:
+			if(hashlib.sha256(old_file.read()).digest() == hashlib.sha256(data).digest()):
+				return 0
+	with open(path, 'wb') as new_file:
+		new_file.write(data)
+	return 1
+
+# Writes the per-DSP MIF files of some MRFs of a packed MRF dump (runs in the MIF worker processes, which map the
+# dump themselves instead of receiving the MRF data). Returns the number of files written.
+def write_mrf_mifs(dump_path, mrf_ids, num_dsps, mif_dir):
+	width, mrfs = read_packed_dump(dump_path)
+	dsp_width = width // num_dsps
+	written = 0
+	for mrf_id in mrf_ids:
+		digits = packed_word_digits(mrfs[mrf_id], width, 'BIN')
+		# One MIF per DSP block (10 lanes) of each MRF, from the most significant lanes
+		for i in range(num_dsps):
+			written += write_if_changed(os.path.join(mif_dir, 'mvu-mrf' + format(mrf_id, '03d') + '_' + str(i) + '.mif'), \
+				mif_text(digits[:, dsp_width*i : dsp_width*(i+1)], dsp_width, 'BIN'))
+	return written
+
+'''
+Transforms the packed binary NPU checkpoints in pac_dump into the MIF files of the RTL in mif_dir. The per-DSP MRF
+MIFs are written serially, or by a pool of jobs processes (one batch of MRFs per task) with -mif_jobs. Files whose
+content hash did not change are left untouched, so iterative RTL runs only rewrite the MIFs that actually changed.
+Returns the number of MIF files written and the total number of MIF files.
+'''
+def transform_list_to_mif(num_lanes, mif_dir='./pac_dump/', jobs=1):
 	dump_dir = './pac_dump/'
 	num_dsps = int(num_lanes / 10)
+	os.makedirs(mif_dir, exist_ok=True)
+	written = 0
+
+	width, insts = read_packed_dump(dump_dir + 'top_sched.bin')
+	written += write_if_changed(os.path.join(mif_dir, 'top_sched.mif'), \
+		mif_text(packed_word_digits(insts[0], width, 'BIN'), width, 'BIN'))
+
+	width, inputs = read_packed_dump(dump_dir + 'input.bin')
+	written += write_if_changed(os.path.join(mif_dir, 'input.mif'), \
+		mif_text(packed_word_digits(inputs[0], width, 'HEX'), width, 'HEX'))
+
+	# The self-tester reads the lower and upper halves of the output vectors separately
+	width, outputs = read_packed_dump(dump_dir + 'output.bin')
+	digits = packed_word_digits(outputs[0], width, 'HEX')
+	half = width // 8
+	written += write_if_changed(os.path.join(mif_dir, 'output.mif'), mif_text(digits, width, 'HEX'))
+	written += write_if_changed(os.path.join(mif_dir, 'output_lower.mif'), mif_text(digits[:, half:], width // 2, 'HEX'))
+	written += write_if_changed(os.path.join(mif_dir, 'output_upper.mif'), mif_text(digits[:, :half], width // 2, 'HEX'))
+
+	width, mrfs = read_packed_dump(dump_dir + 'mvu-mrf.bin')
+	num_mrfs = len(mrfs)
+	del mrfs
+	if(jobs > 1 and num_mrfs > 1):
+		batches = [range(first, num_mrfs, jobs) for first in range(min(jobs, num_mrfs))]
+		with concurrent.futures.ProcessPoolExecutor(max_workers=len(batches)) as pool:
+			futures = [pool.submit(write_mrf_mifs, dump_dir + 'mvu-mrf.bin', batch, num_dsps, mif_dir) for batch in batches]
+			written += sum([future.result() for future in futures])
+	else:
+		written += write_mrf_mifs(dump_dir + 'mvu-mrf.bin', range(num_mrfs), num_dsps, mif_dir)
+
+	return written, 5 + num_mrfs * num_dsps
+
+# \xNN escapes of every byte value, as a (256, 4) array of ASCII codes
+C_BYTE_ESCAPES = np.frombuffer(''.join(['\\x' + format(b, '02x') for b in range(256)]).encode(), dtype=np.uint8).reshape(256, 4)
+
+# A (words, word_bytes) array of packed words with every word zero-padded to at least 64 bytes
+def pad_words(words):
+	padded = np.zeros((len(words), max(64, words.shape[1])), dtype=np.uint8)
+	padded[:, :words.shape[1]] = words
+	return padded
+
+# C string literal lines of a (words, word_bytes) array of packed words, one per word padded to 64 bytes
+def c_string_text(words):
+	padded = pad_words(words)
+	lines = np.empty((len(padded), 4 * padded.shape[1] + 3), dtype=np.uint8)
+	lines[:, 0] = ord('"')
+	lines[:, 1:-2] = C_BYTE_ESCAPES[padded].reshape(len(padded), -1)
+	lines[:, -2] = ord('"')
+	lines[:, -1] = ord('\n')
+	return lines.tobytes().decode()
 
-	for filename in os.listdir(dump_dir):
-		if((filename == 'top_sched') or (filename == 'input')):
-			dump_file = open(dump_dir+filename, 'r')
-			mif_file = open(dump_dir+filename+'.mif', 'w')
-			
-			depth = 0
-			for line in dump_file:
-				depth = depth + 1
-			width = int(len(line.strip()))
-			dump_file.close()
-
-			mif_file.write('DEPTH = ' + str(depth) + ';\n')
-			if((filename == 'input') or (filename == 'output')):
-				mif_file.write('WIDTH = ' + str(width*4) + ';\n')
-			else:
-				mif_file.write('WIDTH = ' + str(width) + ';\n')
-			mif_file.write('ADDRESS_RADIX = DEC;\n')
-			if((filename == 'input') or (filename == 'output')):
-				mif_file.write('DATA_RADIX = HEX;\n')
-			else:
-				mif_file.write('DATA_RADIX = BIN;\n')
-			mif_file.write('CONTENT\n')
-			mif_file.write('BEGIN\n')
-			
-			line_num = 0
-			dump_file = open(dump_dir+filename, 'r')
-			for line in dump_file:
-				mif_file.write(str(line_num) + ': ' + line.strip() + ';\n')
-				line_num = line_num + 1
-			mif_file.write('END;\n')
-			dump_file.close()
-			mif_file.close()
-
-			if((filename != 'input') and (filename != 'output')):
-				subprocess.call(['rm', dump_dir+filename], shell=False)
-
-		elif(filename == 'output'):
-			dump_file = open(dump_dir+filename, 'r')
-			mif_file_lower = open(dump_dir+filename+'_lower.mif', 'w')
-			mif_file_upper = open(dump_dir+filename+'_upper.mif', 'w')
-			mif_file = open(dump_dir+filename+'.mif', 'w')
-			
-			depth = 0
-			for line in dump_file:
-				depth = depth + 1
-			width = int(len(line.strip()))
-			dump_file.close()
-
-			mif_file_lower.write('DEPTH = ' + str(depth) + ';\n')
-			mif_file_lower.write('WIDTH = ' + str(width*2) + ';\n')
-			mif_file_lower.write('ADDRESS_RADIX = DEC;\n')
-			mif_file_lower.write('DATA_RADIX = HEX;\n')
-			mif_file_lower.write('CONTENT\n')
-			mif_file_lower.write('BEGIN\n')
-			mif_file_upper.write('DEPTH = ' + str(depth) + ';\n')
-			mif_file_upper.write('WIDTH = ' + str(width*2) + ';\n')
-			mif_file_upper.write('ADDRESS_RADIX = DEC;\n')
-			mif_file_upper.write('DATA_RADIX = HEX;\n')
-			mif_file_upper.write('CONTENT\n')
-			mif_file_upper.write('BEGIN\n')
-
-			mif_file.write('DEPTH = ' + str(depth) + ';\n')
-			mif_file.write('WIDTH = ' + str(width*4) + ';\n')
-			mif_file.write('ADDRESS_RADIX = DEC;\n')
-			mif_file.write('DATA_RADIX = HEX;\n')
-			mif_file.write('CONTENT\n')
-			mif_file.write('BEGIN\n')
-			
-			line_num = 0
-			dump_file = open(dump_dir+filename, 'r')
-			for line in dump_file:
-				line_str = line.strip()
-				mif_file_lower.write(str(line_num) + ': ' + line_str[int(width/2): width] + ';\n')
-				mif_file_upper.write(str(line_num) + ': ' + line_str[0: int(width/2)] + ';\n')
-				mif_file.write(str(line_num) + ': ' + line_str + ';\n')
-				line_num = line_num + 1
-			mif_file_lower.write('END;\n')
-			mif_file_upper.write('END;\n')
-			mif_file.write('END;\n')
-			dump_file.close()
-			mif_file_lower.close()
-			mif_file_upper.close()
-			mif_file.close()
-
-		elif(filename.find('mrf') != -1):
-			dump_file = open(dump_dir+filename, 'r')
-			mif_files = []
-			for i in range(num_dsps):
-				mif_files.append(open(dump_dir+filename+'_'+str(i)+'.mif', 'w'))
-			
-			depth = 0
-			for line in dump_file:
-				depth = depth + 1
-			width = len(line.strip())
-			dump_file.close()
-
-			for i in range(num_dsps):
-				mif_files[i].write('DEPTH = ' + str(depth) + ';\n')
-				mif_files[i].write('WIDTH = ' + str(int(width/4)) + ';\n')
-				mif_files[i].write('ADDRESS_RADIX = DEC;\n')
-				mif_files[i].write('DATA_RADIX = BIN;\n')
-				mif_files[i].write('CONTENT\n')
-				mif_files[i].write('BEGIN\n')
-			
-			line_num = 0
-			dump_file = open(dump_dir+filename, 'r')
-			flag_first = 1
-			for line in dump_file:
-				line_str = line.strip()
-				line_size = len(line_str)
-				line_stepsize = int(len(line_str)/num_dsps)
-				for i in range(num_dsps):
-					mif_files[i].write(str(line_num) + ': ' + line_str[(line_stepsize*i) : (line_stepsize*(i+1))] + ';\n')
-				line_num = line_num + 1
-				flag_first = 0
-
-			for i in range(num_dsps):
-				mif_files[i].write('END;\n')
-				mif_files[i].close()
-			dump_file.close()
-			
-			if((filename != 'input') and (filename != 'output')):
-				subprocess.call(['rm', dump_dir+filename], shell=False)
-
-def numericalSort(value):
-	numbers = re.compile(r'(\d+)')
-	parts = numbers.split(value)
-	parts[1::2] = map(int, parts[1::2])
-	return parts
-
-def RoundUp(x):
-	return ((x + 7) & (-8))
-
-def generate_header_file(filename):
-	depth = -1
-	width = -1
-	radix = ""
-	inst_depth = -1
-	inst_width = -1
-	inst_radix = ""
-	mif_path= './pac_dump/'
-	in_ = open(mif_path+'mvu-mrf0.mif','r') 
-	for line in in_:
-		if (depth != -1) and (width != -1):
-			break
-		mtx = re.match('DEPTH = (\d+);', line)
-		if mtx:
-			depth = int(mtx.groups()[0])
-			continue
-		mtx = re.match('WIDTH = (\d+);', line)
-		if mtx:
-			width = int(mtx.groups()[0]);
-			continue
-
-	in_ = open(mif_path+'top_sched.mif','r') 
-	for line in in_:
-		if (inst_depth != -1) and (inst_width != -1):
-			break
-		mtx = re.match('DEPTH = (\d+);', line)
-		if mtx:
-			inst_depth = int(mtx.groups()[0])
-			continue
-		mtx = re.match('WIDTH = (\d+);', line)
-		if mtx:
-			inst_width = int(mtx.groups()[0]);
-			continue
-
-	dre_src = '([0-9]+):\s+((0|1){' + str(width) + '})'
-	dre = re.compile(dre_src)
-
-	dre_src_inst = '([0-9]+):\s+((0|1){' + str(inst_width) + '})'
-	dre_inst = re.compile(dre_src_inst)
-
-	dre_input = re.compile(r"\L$")
-	total_mrf = 0
-
-	header_file = open(mif_path + filename + '.h', 'w')
-	variables_string = ''
-
-	#Files are sorted; careful while changing if-else order
-	for file in sorted(os.listdir(mif_path),key=numericalSort):
-		try:
-			if file.startswith("input"):		
-				data = []
-				tmp_vec = []
-				i=0
-				header_file.write('char input_vectors[] = \n')
-				with open(mif_path+'/'+file) as f:
-					for line in f:
-						line = line[:-2]
-						data.append(line)
-					for d in data:
-						bytes = []
-						rev_d = d[::-1]
-						if(len(rev_d)%8 != 0):
-							padded_zeros = RoundUp(len(rev_d))-len(rev_d)
-							tmp_str = "0" * padded_zeros 
-							rev_d = rev_d + tmp_str
-						
-						for i in range(0,len(rev_d),2):
-							curr_byte = rev_d[i:i+2]
-							rev_byte  = curr_byte[::-1]
-						bytes.append(int(rev_byte,16))
-
-						out = '"'
-						for b in bytes:
-							if(b<16):
-								out = out + '\\x0' + format(b, 'x')
-							else:
-								out = out + '\\x' + format(b, 'x')
-						for i in range(len(bytes),64):
-							out = out + '\\x00'
-
-						out = out + '"'
-						header_file.write(out + "\n")
-				header_file.write(';' + "\n")
-				variables_string = variables_string + 'uint32_t num_in = '+ str(len(data))+   ";\n"
-				header_file.write('char mrf_vector[] = \n')
-				
-			elif(file.startswith("mvu-mrf")):
-				data = []
-				with open(mif_path+'/'+file) as f:
-					total_mrf = total_mrf + 1
-					for line in f:
-						mtx = re.match(dre, line)
-						if mtx:
-							data.append(mtx.groups()[1])
-					for d in data:
-						bytes = []
-						rev_d = d[::-1]
-						for i in range(0,width,8):
-							curr_byte = rev_d[i:i+8]
-							rev_byte  = curr_byte[::-1]
-						bytes.append(int(rev_byte,2))
-
-						out = '"'
-						for b in bytes:
-							if(b<16):
-								out = out + '\\x0' + format(b, 'x')
-							else:
-								out = out + '\\x' + format(b, 'x')
-						for i in range(len(bytes),64):
-							out = out + '\\x00'
-
-						out = out + '"'
-						header_file.write(out + "\n")
-
-			elif file.startswith("output"):		
-				data = []
-				tmp_vec = []
-				i=0
-				header_file.write(';' + "\n")
-				variables_string = variables_string + 'uint32_t num_mrf = '+ str(total_mrf)+  ";\n"
-				variables_string = variables_string + 'uint32_t words_per_mrf = '+ str(depth) + ";\n"
-				header_file.write('char output_vectors [] = \n')
-				with open(mif_path+'/'+file) as f:
-					for line in f:
-						line = line[:-2]
-						data.append(line)
-					for d in data:
-						bytes = []
-						rev_d = d[::-1]
-						if(len(rev_d)%8 != 0):
-							padded_zeros = RoundUp(len(rev_d))-len(rev_d)
-							tmp_str = "0" * padded_zeros 
-							rev_d = rev_d + tmp_str
-						
-						for i in range(0,len(rev_d),2):
-							curr_byte = rev_d[i:i+2]
-							rev_byte  = curr_byte[::-1]
-						bytes.append(int(rev_byte,16))
-
-						out = '"'
-						for b in bytes:
-							if(b<16):
-								out = out + '\\x0' + format(b, 'x')
-							else:
-								out = out + '\\x' + format(b, 'x')
-						for i in range(len(bytes),64):
-							out = out + '\\x00'
-
-						out = out + '"\n'
-						header_file.write(out)
-			elif file.startswith("top"):
-				header_file.write(';' + "\n")
-				variables_string = variables_string + 'uint32_t num_out = '+ str(len(data))+   ";\n"
-				variables_string = variables_string + 'uint32_t num_inst = '+ str(inst_depth) + ";\n"
-				header_file.write('char instructions[] = \n')
-				data = []
-				with open(mif_path+'/'+file) as f:
-					for line in f:
-						mtx = re.match(dre_inst, line)
-						if mtx:
-							data.append(mtx.groups()[1])
-					for d in data:
-						bytes = []
-						rev_d = d[::-1]
-						for i in range(0,inst_width,8):
-							curr_byte = rev_d[i:i+8]
-							rev_byte  = curr_byte[::-1]
-						bytes.append(int(rev_byte,2))
-				   	
-						out = '"'
-						for b in bytes:
-							if(b<16):
-								out = out + '\\x0' + format(b, 'x')
-							else:
-								out = out + '\\x' + format(b, 'x')
-						for i in range(len(bytes),64):
-							out = out + '\\x00'
-
-						out = out + '"'
-						header_file.write(out + "\n")
-				header_file.write(';' + "\n")
-
-		except Exception as e:
-			raise e
-			print('No files found here!')
-
-	variables_string = variables_string + 'uint32_t total_mem_buff_alloc_on_fpga = 11;\n'
-	variables_string = variables_string + 'uint32_t pc_start = 0;\n'
-	header_file.write(variables_string)
-	header_file.close()
+'''
+Generates the PAC C header file pac_dump/<filename>.h from the arrays of the low-level NPU checkpoints (see
+checkpoint_arrays). By default, the input vectors, MRF image, output vectors and instructions are emitted as C string
+literals with one 64-byte padded word per line. With blob set, the padded words are instead written to the raw binary
+sidecar pac_dump/<filename>.bin and the header only holds the byte offset and size of each array in that file.
+'''
+def generate_header_file(filename, mrf_image, inputs, insts, outputs, blob=False):
+	dump_dir = './pac_dump/'
+	arrays = [('input_vectors', inputs), ('mrf_vector', mrf_image.reshape(-1, mrf_image.shape[2])), \
+		('output_vectors', outputs), ('instructions', insts)]
+
+	with open(dump_dir + filename + '.h', 'w') as header_file:
+		if(blob):
+			header_file.write('const char blob_file[] = "' + filename + '.bin";\n')
+			offset = 0
+			with open(dump_dir + filename + '.bin', 'wb') as blob_file:
+				for name, words in arrays:
+					padded = pad_words(words)
+					blob_file.write(padded.tobytes())
+					header_file.write('uint64_t ' + name + '_offset = ' + str(offset) + ';\n')
+					header_file.write('uint64_t ' + name + '_bytes = ' + str(padded.size) + ';\n')
+					offset += padded.size
+		else:
+			for name, words in arrays:
+				header_file.write('char ' + name + '[] = \n')
+				header_file.write(c_string_text(words))
+				header_file.write(';\n')
+
+		header_file.write('uint32_t num_in = ' + str(len(inputs)) + ';\n')
+		header_file.write('uint32_t num_mrf = ' + str(mrf_image.shape[0]) + ';\n')
+		header_file.write('uint32_t words_per_mrf = ' + str(mrf_image.shape[1]) + ';\n')
+		header_file.write('uint32_t num_out = ' + str(len(outputs)) + ';\n')
+		header_file.write('uint32_t num_inst = ' + str(len(insts)) + ';\n')
+		header_file.write('uint32_t total_mem_buff_alloc_on_fpga = 11;\n')
+		header_file.write('uint32_t pc_start = 0;\n')
 
  
+# Stratix 10 NX resource limits on the architecture parameters
+mult_limit = 11200
+word_count_limit = 290304
+num_tiles_limit = 21
+num_dpes_limit = 120
+num_lanes_limit = 120
+
+# Checks a set of architecture parameters against the device limits. Returns the reason it is invalid, or an empty
+# string if it is valid.
+def check_arch_params(num_tiles, num_dpes, num_lanes, vrf_depth, mrf_depth):
+	if(arch_mults(num_tiles, num_dpes, num_lanes) > mult_limit):
+		return "Product of number of tiles, DPEs, and lanes must be less than or equal to "+str(mult_limit)+" to fit on the Stratix 10 NX device"
+	if(num_lanes % 10 != 0):
+		return "Number of lanes must be a multiple of 10"
+	if(num_dpes % num_lanes != 0):
+		return "Number of DPEs must be a multiple of the number of tiles"
+	if((num_tiles <= 0) or (num_lanes <= 0) or (num_dpes <= 0) or (vrf_depth <= 0) or (mrf_depth <= 0)):
+		return "All architecture parameters (Tiles, DPEs, Lanes, VRF depth, MRF depth) must have positive non-zero values"
+	if(arch_mem_words(num_tiles, num_dpes, vrf_depth, mrf_depth) > word_count_limit):
+		return "Total number of memory words in all MRFs and VRFs must be less than or equal to "+str(word_count_limit)+" to fit on the Stratix 10 NX device"
+	if(num_tiles > num_tiles_limit):
+		return "Number of tiles must be less than " + str(num_tiles_limit)
+	if(num_dpes > num_dpes_limit):
+		return "Number of DPEs must be less than " + str(num_dpes_limit)
+	if(num_lanes > num_lanes_limit):
+		return "Number of lanes must be less than " + str(num_lanes_limit)
+	return ''
+
+# Number of multipliers and of memory words (all MRFs and VRFs) used by a set of architecture parameters
+def arch_mults(num_tiles, num_dpes, num_lanes):
+	return num_tiles * num_dpes * num_lanes
+
+def arch_mem_words(num_tiles, num_dpes, vrf_depth, mrf_depth):
+	return mrf_depth * num_tiles * num_dpes + vrf_depth * num_tiles
+
 def initialize_npu(argv):
 	# default compiler parameters
 	name = 'test'
@@ -2815,12 +3281,31 @@ def initialize_npu(argv):
 	mrf_depth = 1024
 	verbose = 0
 	pac_gen = 0
+	pac_blob = 0
 	rtl_simulation = 0
 	perf_simulation = 0
 	mif_gen = 0
 	pcie_gen = 0
 	program_loops = 1
 	freq = 300
+	mvu_engine = 'tensor'
+	fsim_mode = 'step'
+	fsim_check = []
+	fsim_snapshot = 0
+	fsim_abort = 0
+	mem_report = 0
+	fsim_profile = 0
+	fsim_profile_sort = 'time'
+	fsim_jobs = 1
+	mif_jobs = 1
+	alloc_policy = 'first'
+	alloc_report = 0
+	vrf_reuse = 0
+	schedule = 0
+	estimate = 0
+	seed = None
+	cache = 0
+	cache_dir = './compile_cache'
 
 	# Capture parameters from command line
 	if('-n' in sys.argv):
@@ -2896,35 +3381,9 @@ def initialize_npu(argv):
 			sys.exit(1)
 
 	# Checks on input parameters
-	mult_limit = 11200
-	word_count_limit = 290304
-	num_tiles_limit = 21
-	num_dpes_limit = 120
-	num_lanes_limit = 120
-
-	if(num_tiles * num_dpes * num_lanes > mult_limit):
-		print(bcolors.FAIL + "\nInvalid Input: Product of number of tiles, DPEs, and lanes must be less than or equal to "+str(mult_limit)+" to fit on the Stratix 10 NX device" + bcolors.RESET)
-		sys.exit(1)
-	if(num_lanes % 10 != 0):
-		print(bcolors.FAIL + "\nInvalid Input: Number of lanes must be a multiple of 10" + bcolors.RESET)
-		sys.exit(1)
-	if(num_dpes % num_lanes != 0):
-		print(bcolors.FAIL + "\nInvalid Input: Number of DPEs must be a multiple of the number of tiles" + bcolors.RESET)
-		sys.exit(1)
-	if((num_tiles <= 0) or (num_lanes <= 0) or (num_dpes <= 0) or (vrf_depth <= 0) or (mrf_depth <= 0)):
-		print(bcolors.FAIL + "\nInvalid Input: All architecture parameters (Tiles, DPEs, Lanes, VRF depth, MRF depth) must have positive non-zero values" + bcolors.RESET)
-		sys.exit(1)
-	if((mrf_depth*num_tiles*num_dpes + vrf_depth*num_tiles) > word_count_limit):
-		print(bcolors.FAIL + "\nInvalid Input: Total number of memory words in all MRFs and VRFs must be less than or equal to "+str(word_count_limit)+" to fit on the Stratix 10 NX device" + bcolors.RESET)
-		sys.exit(1)
-	if(num_tiles > num_tiles_limit):
-		print(bcolors.FAIL + "\nInvalid Input: Number of tiles must be less than " + str(num_tiles_limit) + bcolors.RESET)
-		sys.exit(1)
-	if(num_dpes > num_dpes_limit):
-		print(bcolors.FAIL + "\nInvalid Input: Number of DPEs must be less than " + str(num_dpes_limit) + bcolors.RESET)
-		sys.exit(1)
-	if(num_lanes > num_lanes_limit):
-		print(bcolors.FAIL + "\nInvalid Input: Number of lanes must be less than " + str(num_lanes_limit) + bcolors.RESET)
+	arch_error = check_arch_params(num_tiles, num_dpes, num_lanes, vrf_depth, mrf_depth)
+	if(arch_error):
+		print(bcolors.FAIL + "\nInvalid Input: " + arch_error + bcolors.RESET)
 		sys.exit(1)
 
 	if((num_tiles != 7) or (num_dpes != 40) or (num_lanes != 40) or (vrf_depth != 512) or (mrf_depth != 1024)):
@@ -2939,6 +3398,10 @@ def initialize_npu(argv):
 	if('-pac' in sys.argv):
 		pac_gen = 1
 
+	if('-pac_blob' in sys.argv):
+		pac_gen = 1
+		pac_blob = 1
+
 	if('-rtlsim' in sys.argv):
 		mif_gen = 1
 		rtl_simulation = 1
@@ -2963,6 +3426,135 @@ def initialize_npu(argv):
 		print(bcolors.FAIL + "\nSpecified frequency must be a positive integer" + bcolors.RESET)
 		sys.exit(1)
 
+	if('-mvu_engine' in sys.argv):
+		if(sys.argv.index('-mvu_engine') + 1 >= len(sys.argv)):
+			print(bcolors.FAIL + "\nInvalid -mvu_engine argument!" + bcolors.RESET)
+			sys.exit(1)
+		mvu_engine = sys.argv[sys.argv.index('-mvu_engine') + 1]
+		if(mvu_engine not in ['loop', 'tensor']):
+			print(bcolors.FAIL + "\nInvalid -mvu_engine argument! Supported FSim MVU engines are loop and tensor" + bcolors.RESET)
+			sys.exit(1)
+
+	if('-fsim_mode' in sys.argv):
+		if(sys.argv.index('-fsim_mode') + 1 >= len(sys.argv)):
+			print(bcolors.FAIL + "\nInvalid -fsim_mode argument!" + bcolors.RESET)
+			sys.exit(1)
+		fsim_mode = sys.argv[sys.argv.index('-fsim_mode') + 1]
+		if(fsim_mode not in ['step', 'dataflow']):
+			print(bcolors.FAIL + "\nInvalid -fsim_mode argument! Supported FSim modes are step and dataflow" + bcolors.RESET)
+			sys.exit(1)
+
+	# Chains to cross-check against the step engine in dataflow mode (comma-separated chain indices or all)
+	if('-fsim_check' in sys.argv):
+		if(sys.argv.index('-fsim_check') + 1 >= len(sys.argv)):
+			print(bcolors.FAIL + "\nInvalid -fsim_check argument!" + bcolors.RESET)
+			sys.exit(1)
+		fsim_check = sys.argv[sys.argv.index('-fsim_check') + 1]
+		if(fsim_check != 'all'):
+			try:
+				fsim_check = [int(c) for c in fsim_check.split(',')]
+			except ValueError:
+				print(bcolors.FAIL + "\nInvalid -fsim_check argument!" + bcolors.RESET)
+				sys.exit(1)
+
+	if('-fsim_snapshot' in sys.argv):
+		if(sys.argv.index('-fsim_snapshot') + 1 >= len(sys.argv)):
+			print(bcolors.FAIL + "\nInvalid -fsim_snapshot argument!" + bcolors.RESET)
+			sys.exit(1)
+		try:
+			fsim_snapshot = int(sys.argv[sys.argv.index('-fsim_snapshot') + 1])
+		except ValueError:
+			print(bcolors.FAIL + "\nInvalid -fsim_snapshot argument!" + bcolors.RESET)
+			sys.exit(1)
+
+	if('-fsim_abort' in sys.argv):
+		fsim_abort = 1
+
+	if('-fsim_profile' in sys.argv):
+		fsim_profile = 1
+
+	if('-fsim_jobs' in sys.argv):
+		if(sys.argv.index('-fsim_jobs') + 1 >= len(sys.argv)):
+			print(bcolors.FAIL + "\nInvalid -fsim_jobs argument!" + bcolors.RESET)
+			sys.exit(1)
+		try:
+			fsim_jobs = int(sys.argv[sys.argv.index('-fsim_jobs') + 1])
+		except ValueError:
+			print(bcolors.FAIL + "\nInvalid -fsim_jobs argument!" + bcolors.RESET)
+			sys.exit(1)
+		if(fsim_jobs <= 0):
+			fsim_jobs = os.cpu_count()
+
+	if('-mif_jobs' in sys.argv):
+		if(sys.argv.index('-mif_jobs') + 1 >= len(sys.argv)):
+			print(bcolors.FAIL + "\nInvalid -mif_jobs argument!" + bcolors.RESET)
+			sys.exit(1)
+		try:
+			mif_jobs = int(sys.argv[sys.argv.index('-mif_jobs') + 1])
+		except ValueError:
+			print(bcolors.FAIL + "\nInvalid -mif_jobs argument!" + bcolors.RESET)
+			sys.exit(1)
+		if(mif_jobs <= 0):
+			mif_jobs = os.cpu_count()
+
+	if('-fsim_profile_sort' in sys.argv):
+		if(sys.argv.index('-fsim_profile_sort') + 1 >= len(sys.argv)):
+			print(bcolors.FAIL + "\nInvalid -fsim_profile_sort argument!" + bcolors.RESET)
+			sys.exit(1)
+		fsim_profile_sort = sys.argv[sys.argv.index('-fsim_profile_sort') + 1]
+		if(fsim_profile_sort not in fsim_profiler.SORT_KEYS):
+			print(bcolors.FAIL + "\nInvalid -fsim_profile_sort argument! Supported keys are " + ', '.join(fsim_profiler.SORT_KEYS) + bcolors.RESET)
+			sys.exit(1)
+
+	if('-alloc_policy' in sys.argv):
+		if(sys.argv.index('-alloc_policy') + 1 >= len(sys.argv)):
+			print(bcolors.FAIL + "\nInvalid -alloc_policy argument!" + bcolors.RESET)
+			sys.exit(1)
+		alloc_policy = sys.argv[sys.argv.index('-alloc_policy') + 1]
+		if(alloc_policy not in mem_allocator.POLICIES):
+			print(bcolors.FAIL + "\nInvalid -alloc_policy argument! Supported allocation policies are " + ', '.join(mem_allocator.POLICIES) + bcolors.RESET)
+			sys.exit(1)
+
+	if('-alloc_report' in sys.argv):
+		alloc_report = 1
+
+	if('-vrf_reuse' in sys.argv):
+		vrf_reuse = 1
+
+	if('-schedule' in sys.argv):
+		schedule = 1
+
+	if('-estimate' in sys.argv):
+		estimate = 1
+
+	# Seed of the synthetic weights generated by the front-end and of the test inputs, which workloads draw after
+	# initialize_npu (part of the compile cache key, which also hashes the input values)
+	if('-seed' in sys.argv):
+		if(sys.argv.index('-seed') + 1 >= len(sys.argv)):
+			print(bcolors.FAIL + "\nInvalid -seed argument!" + bcolors.RESET)
+			sys.exit(1)
+		try:
+			seed = int(sys.argv[sys.argv.index('-seed') + 1])
+		except ValueError:
+			print(bcolors.FAIL + "\nInvalid -seed argument!" + bcolors.RESET)
+			sys.exit(1)
+		np.random.seed(seed)
+
+	if('-cache' in sys.argv):
+		cache = 1
+
+	if('-cache_dir' in sys.argv):
+		if(sys.argv.index('-cache_dir') + 1 >= len(sys.argv)):
+			print(bcolors.FAIL + "\nInvalid -cache_dir argument!" + bcolors.RESET)
+			sys.exit(1)
+		cache = 1
+		cache_dir = sys.argv[sys.argv.index('-cache_dir') + 1]
+
+	# Peak-memory report per flow stage (memory is traced from here on, so program construction is included)
+	if('-mem_report' in sys.argv):
+		mem_report = 1
+		tracemalloc.start()
+
 
 	# Assign program name as well as verbose and RTL simulation options
 	checkpoint_name = name + '_' + str(num_tiles) + '_' + str(num_dpes) + '_' + str(num_lanes)
@@ -2981,13 +3573,32 @@ def initialize_npu(argv):
 	flow_opts = {
 		'checkpoint_name' : checkpoint_name,
 		'pac'  				    : pac_gen,
+		'pac_blob'        : pac_blob,
 		'rtl_sim' 			  : rtl_simulation,
 		'perf_sim' 			  : perf_simulation, 
 		'verbose' 			  : verbose,
 		'mif_gen'			    : mif_gen,
 		'freq'				    : freq,
 		'pcie_gen'			  : pcie_gen,
-		'program_loops'   : program_loops
+		'program_loops'   : program_loops,
+		'mvu_engine'      : mvu_engine,
+		'fsim_mode'       : fsim_mode,
+		'fsim_check'      : fsim_check,
+		'fsim_snapshot'   : fsim_snapshot,
+		'fsim_abort'      : fsim_abort,
+		'mem_report'      : mem_report,
+		'fsim_profile'    : fsim_profile,
+		'fsim_profile_sort' : fsim_profile_sort,
+		'fsim_jobs'       : fsim_jobs,
+		'mif_jobs'        : mif_jobs,
+		'alloc_policy'    : alloc_policy,
+		'alloc_report'    : alloc_report,
+		'vrf_reuse'       : vrf_reuse,
+		'schedule'        : schedule,
+		'estimate'        : estimate,
+		'seed'            : seed,
+		'cache'           : cache,
+		'cache_dir'       : cache_dir
 	}
 
 	return npu(arch_params, flow_opts)
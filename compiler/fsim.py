@@ -1,8 +1,14 @@
 import numpy as np
+import copy
 import re
 import sys
 import warnings
 import math
+import time
+import json
+import csv
+import concurrent.futures
+from multiprocessing import shared_memory
 
 if not sys.warnoptions:
     warnings.simplefilter("ignore")
@@ -118,21 +124,461 @@ class chain (object):
         self.mfu1_vrf1_rd_base = [0] * self.batch
         self.mfu1_tag = self.mfu0_tag
 
+### Integer opcodes of the pre-decoded (lowered) chain representation
+MVU_OPS  = {'nop': 0, 'matvec': 1}
+EVRF_OPS = {'nop': 0, 'move': 1, 'extvrf': 2}
+ACT_OPS  = {'nop': 0, 'move': 1, 'relu': 2, 'sig': 3, 'tanh': 4}
+ADD_OPS  = {'nop': 0, 'move': 1, 'add': 2, 'sub_a_b': 3, 'sub_b_a': 4, 'max': 5}
+MUL_OPS  = {'nop': 0, 'move': 1, 'mul': 2}
+LD_OPS   = {'nop': 0, 'in': 1, 'wb': 2, 'flush': 3}
+
+# Loader destination VRF ids: MVU tile VRFs are 0 .. ntile-1, followed by the eVRF and the four MFU VRFs.
+# VRF_NONE marks an unused destination ('--').
+VRF_NONE = -1
+EXT_VRF_OFFSET = {'extvrf': 0, 'mfu0.vrf0': 1, 'mfu0.vrf1': 2, 'mfu1.vrf0': 3, 'mfu1.vrf1': 4}
+
+def decode_vrf_id(vrf_op, ntile):
+  if(vrf_op[0:3] == 'mvu'):
+    return int(re.search('mvu(\d+)', vrf_op, re.IGNORECASE).group(1))
+  elif(vrf_op in EXT_VRF_OFFSET):
+    return ntile + EXT_VRF_OFFSET[vrf_op]
+  else:
+    return VRF_NONE
+
+### Class to represent a chain lowered to integer opcodes, destination VRF ids and address arrays. All
+### string decoding happens once here so that the simulators and encoders never parse op names again.
+class lowered_chain (object):
+  def __init__(self, inst, ntile):
+    self.src   = inst
+    self.batch = batch = inst.batch
+
+    self.mvu_op            = MVU_OPS[inst.mvu_op_type]
+    self.mvu_mrf_rd_base   = int(inst.mvu_mrf_rd_base)
+    self.mvu_mrf_rd_sz     = int(inst.mvu_mrf_rd_sz)
+    self.mvu_vrf_rd_base   = [int(a) for a in inst.mvu_vrf_rd_base]
+    self.mvu_vrf_rd_sz     = int(inst.mvu_vrf_rd_sz)
+    self.mvu_words_per_row = int(inst.mvu_words_per_row)
+    self.mvu_tag           = int(inst.mvu_tag)
+    # (batch, words) MVU VRF read addresses
+    self.mvu_vrf_rd_addr   = np.add.outer(self.mvu_vrf_rd_base[:batch], np.arange(self.mvu_vrf_rd_sz))
+
+    self.extvrf_op         = EVRF_OPS[inst.extvrf_op_type]
+    self.extvrf_rd_base    = [int(a) for a in inst.extvrf_rd_base]
+    self.extvrf_rd_sz      = int(inst.extvrf_rd_sz)
+    self.extvrf_tag        = int(inst.extvrf_tag)
+    # (words, batch) eVRF read addresses
+    self.extvrf_rd_addr    = np.add.outer(np.arange(self.extvrf_rd_sz), self.extvrf_rd_base[:batch])
+
+    for m in ['mfu0', 'mfu1']:
+      act = ACT_OPS[getattr(inst, m + '_act_op_type')]
+      add = ADD_OPS[getattr(inst, m + '_add_op_type')]
+      mul = MUL_OPS[getattr(inst, m + '_mul_op_type')]
+      size = int(getattr(inst, m + '_vrf_rd_size'))
+      vrf0_rd_base = [int(a) for a in getattr(inst, m + '_vrf0_rd_base')]
+      vrf1_rd_base = [int(a) for a in getattr(inst, m + '_vrf1_rd_base')]
+      setattr(self, m + '_act_op', act)
+      setattr(self, m + '_add_op', add)
+      setattr(self, m + '_mul_op', mul)
+      # FSim skips an MFU only if all of its stages are nop
+      setattr(self, m + '_en', not (act == ACT_OPS['nop'] and add == ADD_OPS['nop'] and mul == MUL_OPS['nop']))
+      setattr(self, m + '_vrf_rd_size', size)
+      setattr(self, m + '_vrf0_rd_base', vrf0_rd_base)
+      setattr(self, m + '_vrf1_rd_base', vrf1_rd_base)
+      setattr(self, m + '_tag', int(getattr(inst, m + '_tag')))
+      # (words, batch) MFU VRF read addresses
+      setattr(self, m + '_vrf0_rd_addr', np.add.outer(np.arange(size), vrf0_rd_base[:batch]))
+      setattr(self, m + '_vrf1_rd_addr', np.add.outer(np.arange(size), vrf1_rd_base[:batch]))
+
+    self.loader_op         = LD_OPS[inst.loader_src]
+    self.vrf_id0           = decode_vrf_id(inst.vrf_id0_op, ntile)
+    self.vrf_id0_wr_base   = [int(a) for a in inst.vrf_id0_wr_base]
+    self.vrf_id0_wr_size   = int(inst.vrf_id0_wr_size)
+    self.vrf_id1           = decode_vrf_id(inst.vrf_id1_op, ntile)
+    self.vrf_id1_wr_base   = [int(a) for a in inst.vrf_id1_wr_base]
+    self.vrf_id1_wr_size   = int(inst.vrf_id1_wr_size)
+    # Flattened (words * batch) loader write addresses (both destinations use the vrf_id0 size)
+    self.vrf_id0_wr_addr   = np.add.outer(np.arange(self.vrf_id0_wr_size), self.vrf_id0_wr_base[:batch]).ravel()
+    self.vrf_id1_wr_addr   = np.add.outer(np.arange(self.vrf_id0_wr_size), self.vrf_id1_wr_base[:batch]).ravel()
+
+    self.last_flag         = int(inst.last_flag)
+    self.write_to_obuf     = int(inst.write_to_obuf)
+
+  def print_chain(self):
+    self.src.print_chain()
+
+# Lower a list of chains (one-time pass before simulation or encoding)
+def lower_chains(inst_q, ntile):
+  return [inst if isinstance(inst, lowered_chain) else lowered_chain(inst, ntile) for inst in inst_q]
+
+# VRF words read and written by a lowered chain, as lists of (VRF ids, addresses). VRF ids follow decode_vrf_id
+# (MVU tile VRFs first, then the eVRF and the MFU VRFs); an MVU read touches the VRFs of all tiles.
+def chain_vrf_accesses(inst, ntile):
+  reads = []
+  writes = []
+  if(inst.mvu_op == MVU_OPS['matvec']):
+    reads.append((range(ntile), inst.mvu_vrf_rd_addr.ravel()))
+  if(inst.extvrf_op == EVRF_OPS['extvrf']):
+    reads.append(([ntile + EXT_VRF_OFFSET['extvrf']], inst.extvrf_rd_addr.ravel()))
+  for m in ['mfu0', 'mfu1']:
+    if(getattr(inst, m + '_add_op') not in [ADD_OPS['nop'], ADD_OPS['move']]):
+      reads.append(([ntile + EXT_VRF_OFFSET[m + '.vrf0']], getattr(inst, m + '_vrf0_rd_addr').ravel()))
+    if(getattr(inst, m + '_mul_op') == MUL_OPS['mul']):
+      reads.append(([ntile + EXT_VRF_OFFSET[m + '.vrf1']], getattr(inst, m + '_vrf1_rd_addr').ravel()))
+  if(inst.loader_op in [LD_OPS['in'], LD_OPS['wb']]):
+    for vrf_id, wr_addr in [(inst.vrf_id0, inst.vrf_id0_wr_addr), (inst.vrf_id1, inst.vrf_id1_wr_addr)]:
+      if(vrf_id != VRF_NONE):
+        writes.append(([vrf_id], wr_addr))
+  return reads, writes
+
+# Name of the architecture state holding a VRF id
+def vrf_state_name(vrf_id, ntile):
+  return 'mvu_vrfs' if vrf_id < ntile else ARCH_VRFS[vrf_id - ntile + 1]
+
+# Number of words of each VRF touched (read or written) by a lowered program
+def vrf_extents(inst_q, ntile):
+  extents = dict((name, 0) for name in ARCH_VRFS)
+  for inst in inst_q:
+    reads, writes = chain_vrf_accesses(inst, ntile)
+    for vrf_ids, addr in reads + writes:
+      if(addr.size):
+        for vrf_id in vrf_ids:
+          name = vrf_state_name(vrf_id, ntile)
+          extents[name] = max(extents[name], int(addr.max()) + 1)
+  return extents
+
+### Class for array-backed ring buffer FIFOs. Entries are rows of nlane elements and are pushed/popped
+### in blocks. The buffer is preallocated and only grows (doubling) if a producer runs far ahead.
+class fifo (object):
+  def __init__(self, nlane, dtype, capacity=512, data=None):
+    self.nlane = nlane
+    self.dtype = dtype
+    self.buf   = np.zeros((max(capacity, 1), nlane), dtype=dtype)
+    self.head  = 0
+    self.count = 0
+    if data is not None:
+      self.push(data)
+
+  def __len__(self):
+    return self.count
+
+  def __repr__(self):
+    return str(self.peek(self.count))
+
+  def grow(self, min_capacity):
+    capacity = len(self.buf)
+    while capacity < min_capacity:
+      capacity = capacity * 2
+    new_buf = np.zeros((capacity, self.nlane), dtype=self.dtype)
+    new_buf[:self.count] = self.peek(self.count)
+    self.buf  = new_buf
+    self.head = 0
+
+  # Push a block of rows (any shape ending in nlane) to the tail of the FIFO
+  def push(self, rows):
+    rows = np.asarray(rows).reshape(-1, self.nlane)
+    num_rows = len(rows)
+    if(self.count + num_rows > len(self.buf)):
+      self.grow(self.count + num_rows)
+    capacity = len(self.buf)
+    tail = (self.head + self.count) % capacity
+    first = min(num_rows, capacity - tail)
+    self.buf[tail:tail+first] = rows[:first]
+    self.buf[:num_rows-first] = rows[first:]
+    self.count += num_rows
+
+  # Return a copy of the first num_rows rows without removing them
+  def peek(self, num_rows):
+    assert num_rows <= self.count, 'FIFO underflow'
+    capacity = len(self.buf)
+    first = min(num_rows, capacity - self.head)
+    return np.concatenate((self.buf[self.head:self.head+first], self.buf[:num_rows-first]))
+
+  # Remove and return the first num_rows rows as a (num_rows, nlane) array
+  def pop(self, num_rows):
+    rows = self.peek(num_rows)
+    self.head = (self.head + num_rows) % len(self.buf)
+    self.count -= num_rows
+    return rows
+
+  # Return an independent FIFO with the same contents
+  def copy(self):
+    new_fifo = fifo(self.nlane, self.dtype, len(self.buf))
+    new_fifo.buf[:] = self.buf
+    new_fifo.head = self.head
+    new_fifo.count = self.count
+    return new_fifo
+
+### Opt-in FSim profiler. Records, for every chain and unit, the wall time, the number of elements the unit
+### produced (or wrote, for the loader), the occupancy of its output FIFO and the op it performed.
+class fsim_profiler (object):
+  FIFOS = ['mvu_ofifo', 'mfu0_ififo', 'mfu1_ififo', 'mfu1_ofifo']
+  SORT_KEYS = ['time', 'calls', 'elements', 'unit']
+
+  def __init__(self):
+    self.records = []
+    self.fifo_hwm = dict((name, 0) for name in self.FIFOS)
+
+  def record(self, chain_idx, unit, op, seconds, elements, fifo_rows):
+    self.records.append({'chain': chain_idx, 'unit': unit, 'op': op, 'time': seconds, 'elements': elements, 'fifo_rows': fifo_rows})
+
+  def sample_fifos(self, sim):
+    for name in self.FIFOS:
+      self.fifo_hwm[name] = max(self.fifo_hwm[name], len(getattr(sim, name)))
+
+  # Aggregate the records per (unit, op), sorted by sort_key (descending, except for unit)
+  def summary(self, sort_key='time'):
+    assert sort_key in self.SORT_KEYS, 'Invalid sort key ' + str(sort_key)
+    rows = {}
+    for rec in self.records:
+      row = rows.setdefault((rec['unit'], rec['op']), {'unit': rec['unit'], 'op': rec['op'], 'calls': 0, 'time': 0.0, 'elements': 0})
+      row['calls'] += 1
+      row['time'] += rec['time']
+      row['elements'] += rec['elements']
+    total_time = sum([row['time'] for row in rows.values()])
+    for row in rows.values():
+      row['time_pct'] = 100.0 * row['time'] / total_time if total_time > 0 else 0.0
+    return sorted(rows.values(), key=lambda row: row[sort_key], reverse=(sort_key != 'unit'))
+
+  def print_summary(self, sort_key='time'):
+    print('{:<6}{:<22}{:>8}{:>12}{:>8}{:>14}{:>12}'.format('Unit', 'Op', 'Calls', 'Time (ms)', '%', 'Elements', 'Melem/s'))
+    for row in self.summary(sort_key):
+      rate = row['elements'] / row['time'] / 1e6 if row['time'] > 0 else 0.0
+      print('{:<6}{:<22}{:>8}{:>12.3f}{:>8.1f}{:>14}{:>12.1f}'.format(row['unit'], row['op'], row['calls'], row['time'] * 1e3, \
+        row['time_pct'], row['elements'], rate))
+    print('FIFO high-water marks (rows): ' + ', '.join([name + '=' + str(self.fifo_hwm[name]) for name in self.FIFOS]))
+
+  def write_csv(self, path):
+    with open(path, 'w') as trace_file:
+      writer = csv.DictWriter(trace_file, fieldnames=['chain', 'unit', 'op', 'time', 'elements', 'fifo_rows'])
+      writer.writeheader()
+      writer.writerows(self.records)
+
+  def write_json(self, path):
+    with open(path, 'w') as trace_file:
+      json.dump({'records': self.records, 'fifo_hwm': self.fifo_hwm, 'summary': self.summary()}, trace_file, indent=1)
+
+# Architecture states captured by npu_isa_sim snapshots
+ARCH_VRFS  = ['mvu_vrfs', 'ext_vrf', 'mfu0_vrf0', 'mfu0_vrf1', 'mfu1_vrf0', 'mfu1_vrf1']
+ARCH_FIFOS = ['ibuf_q', 'mvu_ofifo', 'mfu0_ififo', 'mfu1_ififo', 'mfu1_ofifo']
+
+# Return the names of the architecture states that differ between two snapshots
+def diff_states(state0, state1):
+  diff = []
+  if(state0['pc'] != state1['pc']):
+    diff.append('pc')
+  for name in ARCH_VRFS:
+    if not np.array_equal(state0[name], state1[name]):
+      diff.append(name)
+  for name in ARCH_FIFOS:
+    if not np.array_equal(state0[name].peek(len(state0[name])), state1[name].peek(len(state1[name]))):
+      diff.append(name)
+  if not np.array_equal(np.asarray(state0['obuf_q']), np.asarray(state1['obuf_q'])):
+    diff.append('obuf_q')
+  return diff
+
+# Add the rows a lowered chain pushes to and pops from the MVU out, MFU0 in, MFU1 in and MFU1 out FIFOs to their
+# occupancy (a list of 4 row counts, updated in place)
+def update_fifo_occupancy(occupancy, inst, ndpe, nlane):
+  batch = inst.batch
+  if(inst.mvu_op == MVU_OPS['matvec']):
+    occupancy[0] += int(math.ceil(inst.mvu_mrf_rd_sz / inst.mvu_vrf_rd_sz)) * (ndpe // nlane) * batch
+  if(inst.extvrf_op == EVRF_OPS['move']):
+    occupancy[0] -= inst.extvrf_rd_sz * batch
+  if(inst.extvrf_op != EVRF_OPS['nop']):
+    occupancy[1] += inst.extvrf_rd_sz * batch
+  if(inst.mfu0_en):
+    occupancy[1] -= inst.mfu0_vrf_rd_size * batch
+    occupancy[2] += inst.mfu0_vrf_rd_size * batch
+  if(inst.mfu1_en):
+    occupancy[2] -= inst.mfu1_vrf_rd_size * batch
+    occupancy[3] += inst.mfu1_vrf_rd_size * batch
+  if(inst.loader_op in [LD_OPS['wb'], LD_OPS['flush']]):
+    occupancy[3] -= inst.vrf_id0_wr_size * batch
+
+# Split a lowered program into segments (first chain, last chain + 1) that end at the points where all FIFOs
+# (MVU out, MFU0 in, MFU1 in, MFU1 out) are empty, i.e. where every unit has finished the chains of the segment
+def fifo_segments(inst_q, ndpe, nlane):
+  segments = []
+  occupancy = [0, 0, 0, 0]
+  start = 0
+  for idx, inst in enumerate(inst_q):
+    update_fifo_occupancy(occupancy, inst, ndpe, nlane)
+    if(not any(occupancy)):
+      segments.append((start, idx + 1))
+      start = idx + 1
+  if(start < len(inst_q)):
+    segments.append((start, len(inst_q)))
+  return segments
+
+#### Parallel simulation of independent chain groups ####
+# Split a lowered program into groups of chains that can be simulated independently and assign each group to a
+# wave. The program is cut into segments where all FIFOs are empty. Segments are united along read-after-write
+# dependencies on their last writer (segments that read no VRF, like input loads, only join a group if all their
+# readers are in it), so a group is a set of segments that need not be contiguous (e.g. one batch of a batched
+# layer stack). Groups of one wave start from the same state:
+# - a group that reads words last written by another group runs in a later wave than that group
+# - a group that overwrites words another group read from its start state does not run in an earlier wave
+# Groups whose constraints form a cycle are merged. Returns the segments (first chain, last chain + 1), the group of
+# each segment, the wave of each group and, per group, the last segment of the group writing each VRF word (or -1).
+def partition_chains(inst_q, ntile, ndpe, nlane):
+  num_vrfs = ntile + len(EXT_VRF_OFFSET)
+  depth = max(list(vrf_extents(inst_q, ntile).values()) + [1])
+
+  segments = fifo_segments(inst_q, ndpe, nlane)
+
+  # Words read before being written (rbw) and words written by each segment
+  seg_rbw = []
+  seg_wr = []
+  for seg_start, seg_end in segments:
+    rbw = np.zeros((num_vrfs, depth), dtype=bool)
+    wr = np.zeros((num_vrfs, depth), dtype=bool)
+    for inst in inst_q[seg_start:seg_end]:
+      reads, writes = chain_vrf_accesses(inst, ntile)
+      for vrf_ids, addr in reads:
+        for vrf_id in vrf_ids:
+          rbw[vrf_id, addr] |= ~wr[vrf_id, addr]
+      for vrf_ids, addr in writes:
+        for vrf_id in vrf_ids:
+          wr[vrf_id, addr] = True
+    seg_rbw.append(rbw)
+    seg_wr.append(wr)
+
+  # Unite segments with the last writers of the words they read
+  parent = list(range(len(segments)))
+  def find(i):
+    while(parent[i] != i):
+      parent[i] = parent[parent[i]]
+      i = parent[i]
+    return i
+  last_writer = np.full((num_vrfs, depth), -1)
+  source_readers = {}
+  for i in range(len(segments)):
+    for j in np.unique(last_writer[seg_rbw[i]]):
+      if(j < 0):
+        continue
+      if(seg_rbw[j].any()):
+        parent[find(i)] = find(j)
+      else:
+        source_readers.setdefault(j, []).append(i)
+    last_writer[seg_wr[i]] = i
+  for j, readers in source_readers.items():
+    if(len(set([find(i) for i in readers])) == 1):
+      parent[find(j)] = find(readers[0])
+
+  while True:
+    # Groups numbered in the order of their first segment
+    group_ids = {}
+    seg_group = np.array([group_ids.setdefault(find(i), len(group_ids)) for i in range(len(segments))] + [-1])
+    num_groups = len(group_ids)
+
+    # Wave constraints: edges[h][g] is True if group g has to run in a later wave than group h (g reads words last
+    # written by h) and False if it only must not run in an earlier one (g overwrites words h read from its start state)
+    edges = [dict() for g in range(num_groups)]
+    last_writer = np.full((num_vrfs, depth), -1)
+    start_reads = [np.zeros((num_vrfs, depth), dtype=bool) for g in range(num_groups)]
+    for i in range(len(segments)):
+      g = seg_group[i]
+      writer_groups = seg_group[last_writer[seg_rbw[i]]]
+      for h in np.unique(writer_groups):
+        if(h >= 0 and h != g):
+          edges[h][g] = True
+      start_reads[g][seg_rbw[i]] |= (writer_groups != g)
+      for h in range(num_groups):
+        if(h != g and (start_reads[h] & seg_wr[i]).any()):
+          edges[h][g] = edges[h].get(g, False)
+      last_writer[seg_wr[i]] = i
+
+    # Merge the groups of each cycle, then assign the waves in topological order
+    reach = []
+    for g in range(num_groups):
+      seen = set([g])
+      stack = [g]
+      while(stack):
+        for h in edges[stack.pop()]:
+          if(h not in seen):
+            seen.add(h)
+            stack.append(h)
+      reach.append(seen)
+    cycles = [(g, h) for g in range(num_groups) for h in reach[g] if h != g and g in reach[h]]
+    if(not cycles):
+      break
+    roots = dict((g, find(int(np.nonzero(seg_group == g)[0][0]))) for g in range(num_groups))
+    for g, h in cycles:
+      parent[find(roots[g])] = find(roots[h])
+
+  levels = [0] * num_groups
+  indegree = [0] * num_groups
+  for g in range(num_groups):
+    for h in edges[g]:
+      indegree[h] += 1
+  ready = [g for g in range(num_groups) if indegree[g] == 0]
+  while(ready):
+    g = ready.pop()
+    for h, strict in edges[g].items():
+      levels[h] = max(levels[h], levels[g] + (1 if strict else 0))
+      indegree[h] -= 1
+      if(indegree[h] == 0):
+        ready.append(h)
+
+  group_last = [np.full((num_vrfs, depth), -1) for g in range(num_groups)]
+  for i in range(len(segments)):
+    group_last[seg_group[i]][seg_wr[i]] = i
+  return segments, list(seg_group[:-1]), levels, group_last
+
+# MRFs shared with the worker processes of a parallel simulation
+shared_mrfs_shm = None
+shared_mrfs = None
+
+def attach_shared_mrfs(shm_name, shape, dtype):
+  global shared_mrfs_shm, shared_mrfs
+  shared_mrfs_shm = shared_memory.SharedMemory(name=shm_name)
+  shared_mrfs = np.ndarray(shape, dtype=dtype, buffer=shared_mrfs_shm.buf)
+
+# Simulate one group of chains in a worker process. seg_ends are the chain counts at the ends of the segments of the
+# group. Returns the final architecture state and the output queue length at the end of each segment.
+def simulate_group(inst_q, ibuf_rows, seg_ends, vrfs, ntile, ndpe, nlane, vrf_init_sz, mvu_engine, mode):
+  sim = npu_isa_sim(inst_q, ibuf_rows, *vrfs, ntile, ndpe, nlane, vrf_init_sz, mvu_engine, mode)
+  sim.mvu_mrfs = shared_mrfs
+  obuf_ends = []
+  for seg_end in seg_ends:
+    while(sim.pc < seg_end):
+      sim.step()
+    obuf_ends.append(len(sim.obuf_q))
+  return sim.save_state(), obuf_ends
+
 ### Class for ISA simulator
 class npu_isa_sim (object):
-  def __init__(self,inst_q, ibuf_q, mvu_vrfs, ext_vrf, mfu0_vrf0, mfu0_vrf1, mfu1_vrf0, mfu1_vrf1, ntile, ndpe, nlane, vrf_init_sz):
-    self.inst_q = inst_q
-    self.ibuf_q = ibuf_q
+  def __init__(self,inst_q, ibuf_q, mvu_vrfs, ext_vrf, mfu0_vrf0, mfu0_vrf1, mfu1_vrf0, mfu1_vrf1, ntile, ndpe, nlane, vrf_init_sz, mvu_engine='tensor', \
+    mode='step', check_chains=[]):
+    self.inst_q = lower_chains(inst_q, ntile)
+    self.pc = 0
+    ibuf_data = np.asarray(ibuf_q).reshape(-1, nlane)
+    self.ibuf_q = fifo(nlane, ibuf_data.dtype, len(ibuf_data), ibuf_data)
     self.obuf_q = []
 
+    # MVU engine: 'loop' walks tile/DPE/batch per MRF word, 'tensor' contracts the whole chain at once
+    assert mvu_engine in ['loop', 'tensor'], 'Invalid MVU engine ' + str(mvu_engine)
+    self.mvu_engine = mvu_engine
+
+    # Simulation mode: 'step' models the FIFOs between the units, 'dataflow' evaluates each chain as one fused
+    # expression. Chains listed in check_chains (or 'all') are cross-checked against the step engine in dataflow mode.
+    assert mode in ['step', 'dataflow'], 'Invalid FSim mode ' + str(mode)
+    self.mode = mode
+    self.check_chains = check_chains
+    self.num_fused = 0
+    self.num_checked = 0
+
+    # Opt-in profiler (an fsim_profiler instance), None disables profiling
+    self.profiler = None
+
     # HW 
     self.ndpe   = ndpe
     self.nlane  = nlane
     self.ntile  = ntile
     self.vrf_init_sz = vrf_init_sz
 
-    # MVU states
-    self.mvu_ofifo = []
+    # MVU states (accumulations are kept untruncated until the eVRF)
+    self.mvu_ofifo = fifo(self.nlane, np.int64)
     self.mvu_mrfs  = []   
     self.mvu_accs  = [0] * self.ndpe
 
@@ -148,14 +594,28 @@ class npu_isa_sim (object):
     # MFU0 states
     self.mfu0_vrf0  = mfu0_vrf0
     self.mfu0_vrf1  = mfu0_vrf1
-    self.mfu0_ififo = []
+    self.mfu0_ififo = fifo(self.nlane, acc_d_type)
     self.mfu0_ofifo = []
 
     # MFU1 states
     self.mfu1_vrf0  = mfu1_vrf0
     self.mfu1_vrf1  = mfu1_vrf1
-    self.mfu1_ofifo = []
-    self.mfu1_ififo = []
+    self.mfu1_ofifo = fifo(self.nlane, acc_d_type)
+    self.mfu1_ififo = fifo(self.nlane, acc_d_type)
+
+  # Return the VRF addressed by a loader destination id (see decode_vrf_id) for writing
+  def get_vrf(self, vrf_id):
+    if(vrf_id < self.ntile):
+      return self.own_state('mvu_vrfs')[vrf_id]
+    return self.own_state(ARCH_VRFS[vrf_id - self.ntile + 1])
+
+  # VRFs may be handed to the simulator as read-only views of the compiler state; they are copied on the first write
+  def own_state(self, name):
+    state = getattr(self, name)
+    if(not state.flags.writeable):
+      state = np.copy(state)
+      setattr(self, name, state)
+    return state
    
   #### MVU macro functionality ####
   # MVU matvec
@@ -166,7 +626,7 @@ class npu_isa_sim (object):
     mvu_result = [[([0] * batch) for d in range(self.ndpe)] for t in range(num_steps)]
     mrf_addr = cur_chain.mvu_mrf_rd_base
     for t in range(num_steps):
-      vrf_addr = cur_chain.mvu_vrf_rd_base[:]
+      vrf_addr = list(cur_chain.mvu_vrf_rd_base)
       while(vrf_addr[0] < cur_chain.mvu_vrf_rd_base[0] + cur_chain.mvu_vrf_rd_sz):
         for tile in range(self.ntile):
           for dpe in range(self.ndpe):
@@ -178,22 +638,53 @@ class npu_isa_sim (object):
         for b in range(batch):
           vrf_addr[b] += 1
 
+    mvu_rows = []
     for t in range(num_steps):
       for chunk in range(int(self.ndpe/self.nlane)):
         for b in range(batch):
-          for lane in range(self.nlane):
-            self.mvu_ofifo.append(mvu_result[t][(chunk*self.nlane)+lane][b])
+          mvu_rows.append([mvu_result[t][(chunk*self.nlane)+lane][b] for lane in range(self.nlane)])
+    self.mvu_ofifo.push(mvu_rows)
+
+    if(verbose):
+      print("MVU Output FIFO: ", self.mvu_ofifo)
+
+  # MVU matvec as one tensor contraction over the (tiles, dpes, words, lanes) MRF slab. Accumulation is
+  # done in int64 and only truncated at the eVRF (same as the loop engine), so results are bit-identical.
+  def mvu_matvec_tensor(self, cur_chain):
+    num_steps = int(math.ceil(cur_chain.mvu_mrf_rd_sz / cur_chain.mvu_vrf_rd_sz))
+    num_words = cur_chain.mvu_vrf_rd_sz
+    batch = cur_chain.batch
+
+    # MRF slab: (tiles, dpes, steps, words, lanes) -> (steps * dpes, tiles * words * lanes)
+    mrf_base = cur_chain.mvu_mrf_rd_base
+    mrf_data = self.mvu_mrfs[:, :, mrf_base:mrf_base + (num_steps * num_words), :]
+    mrf_data = mrf_data.reshape(self.ntile, self.ndpe, num_steps, num_words, self.nlane)
+    mrf_data = mrf_data.transpose(2, 1, 0, 3, 4).reshape(num_steps * self.ndpe, -1).astype(np.int64)
+
+    # VRF rows for all batch slots: (tiles, batch, words, lanes) -> (tiles * words * lanes, batch)
+    vrf_data = np.asarray(self.mvu_vrfs)[:, cur_chain.mvu_vrf_rd_addr, :]
+    vrf_data = vrf_data.transpose(0, 2, 3, 1).reshape(-1, batch).astype(np.int64)
+
+    # (steps, dpes, batch) -> FIFO order (steps, dpe chunk, batch, lane)
+    mvu_result = np.dot(mrf_data, vrf_data).reshape(num_steps, self.ndpe // self.nlane, self.nlane, batch)
+    return mvu_result.transpose(0, 1, 3, 2).reshape(-1, self.nlane)
+
+  def exe_mvu_m_inst_matvec_tensor(self, cur_chain, verbose):
+    self.mvu_ofifo.push(self.mvu_matvec_tensor(cur_chain))
 
     if(verbose):
       print("MVU Output FIFO: ", self.mvu_ofifo)
   
   # Complete MVU
   def exe_mvu_m_inst (self, cur_chain, verbose):
-    if cur_chain.mvu_op_type=='matvec':
+    if cur_chain.mvu_op==MVU_OPS['matvec']:
       if(verbose):
         print('MVU performing matvec')    	
-      self.exe_mvu_m_inst_matvec(cur_chain, verbose)
-    elif cur_chain.mvu_op_type=='nop':
+      if(self.mvu_engine == 'tensor'):
+        self.exe_mvu_m_inst_matvec_tensor(cur_chain, verbose)
+      else:
+        self.exe_mvu_m_inst_matvec(cur_chain, verbose)
+    elif cur_chain.mvu_op==MVU_OPS['nop']:
       if(verbose):	
         print('MVU performing nop')
     else:
@@ -203,94 +694,89 @@ class npu_isa_sim (object):
   # Extvrf move 
   def exe_extvrf_inst_move(self, cur_chain, verbose):
     batch = cur_chain.batch
-    for i in range(cur_chain.extvrf_rd_sz):
-      for b in range(batch):
-        for j in range(self.nlane):
-          self.mfu0_ififo.append((self.mvu_ofifo.pop(0)).astype(acc_d_type))
+    self.mfu0_ififo.push(self.mvu_ofifo.pop(cur_chain.extvrf_rd_sz * batch).astype(acc_d_type))
 
     if(verbose):
       print("eVRF Output FIFO: ", self.mfu0_ififo)
 
   # Extvrf active: reading from external vrf 
   def exe_extvrf_inst_extvrf(self, cur_chain, verbose):
-    batch = cur_chain.batch
-    extvrf_rd_addr_tmp = cur_chain.extvrf_rd_base[:]
-    for i in range(cur_chain.extvrf_rd_sz):
-      for b in range(batch):
-        for j in range(self.nlane):
-          self.mfu0_ififo.append(self.ext_vrf[extvrf_rd_addr_tmp[b]][j])
-        extvrf_rd_addr_tmp[b] += 1  
+    # Read addresses in (word, batch) order
+    self.mfu0_ififo.push(self.ext_vrf[cur_chain.extvrf_rd_addr])
 
     if(verbose):
       print("eVRF Output FIFO: ", self.mfu0_ififo)
   
   # Complete Extvrf  
   def exe_extverf_m_inst (self, cur_chain, verbose):
-    if cur_chain.extvrf_op_type == 'move':
+    if cur_chain.extvrf_op == EVRF_OPS['move']:
       if(verbose):
         print('eVRF performing move')
       self.exe_extvrf_inst_move(cur_chain, verbose)
-    elif cur_chain.extvrf_op_type == 'extvrf':
+    elif cur_chain.extvrf_op == EVRF_OPS['extvrf']:
       if(verbose):
         print('eVRF performing read')
       self.exe_extvrf_inst_extvrf(cur_chain, verbose)
-    elif cur_chain.extvrf_op_type == 'nop':
+    elif cur_chain.extvrf_op == EVRF_OPS['nop']:
       if(verbose):
         print('eVRF performing nop')
     else:
       raise AssertionError()
 
+  #### MFU macro functionality ####
+  # Apply an MFU op triple (act, add/sub/max, mul) to a (vrf_rd_size * batch, lanes) block. VRF operands are
+  # gathered with the (words, batch) read addresses of the chain. Bypassed ('move'/'nop') stages are no-ops.
+  def exe_mfu_ops(self, mfu_in, vrf0, vrf1, vrf0_rd_addr, vrf1_rd_addr, act_op, add_op, mul_op, vrf_rd_size, batch):
+    temp = mfu_in.reshape(vrf_rd_size, batch, self.nlane).astype(acc_d_type)
+
+    if(act_op==ACT_OPS['nop'] or act_op==ACT_OPS['move']):
+      pass
+    elif(act_op==ACT_OPS['relu']):
+      temp = myReLU(temp).astype(acc_d_type)
+    elif(act_op==ACT_OPS['tanh']):
+      temp = myTanh(temp).astype(acc_d_type)
+    elif(act_op==ACT_OPS['sig']):
+      temp = mySigmoid(temp).astype(acc_d_type)
+    else:
+      raise AssertionError()
+
+    if(add_op==ADD_OPS['nop'] or add_op==ADD_OPS['move']):
+      pass
+    else:
+      vrf0_data = vrf0[vrf0_rd_addr]
+      if(add_op==ADD_OPS['add']):
+        temp = (vrf0_data + temp).astype(acc_d_type)
+      elif(add_op==ADD_OPS['sub_a_b']):
+        temp = (temp - vrf0_data).astype(acc_d_type)
+      elif(add_op==ADD_OPS['sub_b_a']):
+        temp = (vrf0_data - temp).astype(acc_d_type)
+      elif(add_op==ADD_OPS['max']):
+        temp = np.maximum(vrf0_data, temp).astype(acc_d_type)
+      else:
+        raise AssertionError()
+
+    if(mul_op==MUL_OPS['nop'] or mul_op==MUL_OPS['move']):
+      pass
+    elif(mul_op==MUL_OPS['mul']):
+      temp = (vrf1[vrf1_rd_addr] * temp).astype(acc_d_type)
+    else:
+      raise AssertionError()
+
+    return temp
+
   #### MFU0 macro functionality ####
   def exe_mfu0_m_inst(self, cur_chain, verbose): 
     batch = cur_chain.batch
-    mfu0_vrf0_idx = cur_chain.mfu0_vrf0_rd_base[:]
-    mfu0_vrf1_idx = cur_chain.mfu0_vrf1_rd_base[:]
 
-    if(cur_chain.mfu0_act_op_type=='nop' and cur_chain.mfu0_add_op_type=='nop' and cur_chain.mfu0_mul_op_type=='nop'):
+    if(not cur_chain.mfu0_en):
       if(verbose):
         print('MFU0 performing nop')
     else:
       if(verbose):
-        print('MFU0 performing ' + cur_chain.mfu0_act_op_type + ', ' + cur_chain.mfu0_add_op_type + ', ' + cur_chain.mfu0_mul_op_type)
-      for i in range (cur_chain.mfu0_vrf_rd_size):
-        for b in range(batch):
-          for j in range (self.nlane):
-            if(cur_chain.mfu0_act_op_type=='nop' or cur_chain.mfu0_act_op_type=='move'):
-              temp = (self.mfu0_ififo.pop(0)).astype(acc_d_type)
-            elif(cur_chain.mfu0_act_op_type=='relu'):
-              temp = myReLU((self.mfu0_ififo.pop(0)).astype(acc_d_type))
-            elif(cur_chain.mfu0_act_op_type=='tanh'):
-              temp = myTanh((self.mfu0_ififo.pop(0)).astype(acc_d_type))
-            elif(cur_chain.mfu0_act_op_type=='sig'):
-              temp = mySigmoid((self.mfu0_ififo.pop(0)).astype(acc_d_type))
-            else:
-              raise AssertionError()
-
-            if(cur_chain.mfu0_add_op_type=='nop' or cur_chain.mfu0_add_op_type=='move'):
-              temp = temp
-            elif(cur_chain.mfu0_add_op_type=='add'):
-              temp = (self.mfu0_vrf0[mfu0_vrf0_idx[b]][j] + temp).astype(acc_d_type)
-            elif(cur_chain.mfu0_add_op_type=='sub_a_b'):
-              temp = (temp - self.mfu0_vrf0[mfu0_vrf0_idx[b]][j]).astype(acc_d_type)
-            elif(cur_chain.mfu0_add_op_type=='sub_b_a'):
-              temp = (self.mfu0_vrf0[mfu0_vrf0_idx[b]][j] - temp).astype(acc_d_type)
-            elif(cur_chain.mfu0_add_op_type=='max'):
-              temp = max(self.mfu0_vrf0[mfu0_vrf0_idx[b]][j],temp).astype(acc_d_type)
-            else:
-              raise AssertionError()
-
-            if(cur_chain.mfu0_mul_op_type=='nop' or cur_chain.mfu0_mul_op_type=='move'):
-              temp = temp
-            elif(cur_chain.mfu0_mul_op_type=='mul'):
-              temp = (self.mfu0_vrf1[mfu0_vrf1_idx[b]][j] * temp).astype(acc_d_type)
-              
-            else:
-              raise AssertionError()
-
-            self.mfu1_ififo.append(temp)
-
-          mfu0_vrf0_idx[b] = mfu0_vrf0_idx[b] + 1
-          mfu0_vrf1_idx[b] = mfu0_vrf1_idx[b] + 1
+        print('MFU0 performing ' + cur_chain.src.mfu0_act_op_type + ', ' + cur_chain.src.mfu0_add_op_type + ', ' + cur_chain.src.mfu0_mul_op_type)
+      mfu_in = self.mfu0_ififo.pop(cur_chain.mfu0_vrf_rd_size * batch)
+      self.mfu1_ififo.push(self.exe_mfu_ops(mfu_in, self.mfu0_vrf0, self.mfu0_vrf1, cur_chain.mfu0_vrf0_rd_addr, cur_chain.mfu0_vrf1_rd_addr, \
+        cur_chain.mfu0_act_op, cur_chain.mfu0_add_op, cur_chain.mfu0_mul_op, cur_chain.mfu0_vrf_rd_size, batch))
 
       if(verbose):
         print("MFU0 Output FIFO: ", self.mfu1_ififo)
@@ -299,54 +785,16 @@ class npu_isa_sim (object):
   #### MFU1 macro functionality ####
   def exe_mfu1_m_inst(self, cur_chain, verbose): 
     batch = cur_chain.batch
-    mfu1_vrf0_idx = cur_chain.mfu1_vrf0_rd_base[:]
-    mfu1_vrf1_idx = cur_chain.mfu1_vrf1_rd_base[:]
 
-    if(cur_chain.mfu1_act_op_type=='nop' and cur_chain.mfu1_add_op_type=='nop' and cur_chain.mfu1_mul_op_type=='nop'):
+    if(not cur_chain.mfu1_en):
       if(verbose):
         print('MFU1 performing nop')
     else:
       if(verbose):
-        print('MFU1 performing ' + cur_chain.mfu1_act_op_type + ', ' + cur_chain.mfu1_add_op_type + ', ' + cur_chain.mfu1_mul_op_type)
-      for i in range (cur_chain.mfu1_vrf_rd_size):
-        for b in range(batch):
-          for j in range (self.nlane):
-            if(cur_chain.mfu1_act_op_type=='nop' or cur_chain.mfu1_act_op_type=='move'):
-              temp = (self.mfu1_ififo.pop(0)).astype(acc_d_type)
-            elif(cur_chain.mfu1_act_op_type=='relu'):
-              temp = myReLU((self.mfu1_ififo.pop(0)).astype(acc_d_type))
-            elif(cur_chain.mfu1_act_op_type=='tanh'):
-              temp = myTanh((self.mfu1_ififo.pop(0)).astype(acc_d_type))
-            elif(cur_chain.mfu1_act_op_type=='sig'):
-              temp = mySigmoid((self.mfu1_ififo.pop(0)).astype(acc_d_type))
-            else:
-              raise AssertionError()
-
-            if(cur_chain.mfu1_add_op_type=='nop' or cur_chain.mfu1_add_op_type=='move'):
-              temp = temp
-            elif(cur_chain.mfu1_add_op_type=='add'):
-              temp = (self.mfu1_vrf0[mfu1_vrf0_idx[b]][j] + temp).astype(acc_d_type)
-            elif(cur_chain.mfu1_add_op_type=='sub_a_b'):
-              temp = (temp - self.mfu1_vrf0[mfu1_vrf0_idx[b]][j]).astype(acc_d_type)
-            elif(cur_chain.mfu1_add_op_type=='sub_b_a'):
-              temp = (self.mfu1_vrf0[mfu1_vrf0_idx[b]][j] - temp).astype(acc_d_type)
-            elif(cur_chain.mfu1_add_op_type=='max'):
-              temp = max(self.mfu1_vrf0[mfu1_vrf0_idx[b]][j],temp).astype(acc_d_type)
-            else:
-              raise AssertionError()
-
-            if(cur_chain.mfu1_mul_op_type=='nop' or cur_chain.mfu1_mul_op_type=='move'):
-              temp = temp
-            elif(cur_chain.mfu1_mul_op_type=='mul'):
-              temp = (self.mfu1_vrf1[mfu1_vrf1_idx[b]][j] * temp).astype(acc_d_type)
-          
-            else:
-              raise AssertionError()
-
-            self.mfu1_ofifo.append(temp)
-
-          mfu1_vrf0_idx[b] = mfu1_vrf0_idx[b] + 1
-          mfu1_vrf1_idx[b] = mfu1_vrf1_idx[b] + 1 
+        print('MFU1 performing ' + cur_chain.src.mfu1_act_op_type + ', ' + cur_chain.src.mfu1_add_op_type + ', ' + cur_chain.src.mfu1_mul_op_type)
+      mfu_in = self.mfu1_ififo.pop(cur_chain.mfu1_vrf_rd_size * batch)
+      self.mfu1_ofifo.push(self.exe_mfu_ops(mfu_in, self.mfu1_vrf0, self.mfu1_vrf1, cur_chain.mfu1_vrf0_rd_addr, cur_chain.mfu1_vrf1_rd_addr, \
+        cur_chain.mfu1_act_op, cur_chain.mfu1_add_op, cur_chain.mfu1_mul_op, cur_chain.mfu1_vrf_rd_size, batch))
 
       if(verbose):
         print("MFU1 Output FIFO: ", self.mfu1_ififo) 
@@ -354,52 +802,20 @@ class npu_isa_sim (object):
   #### Loader macro functionality ####
   # Loader for the input   
   def exe_ld_inst_in(self, cur_chain):
-    curr_obuf_q = []
-    for i in range (cur_chain.vrf_id0_wr_size):
-      for b in range(cur_chain.batch):
-        vrf_addr = cur_chain.vrf_id0_wr_base[b] + i
-        wb_data = self.ibuf_q.pop(0)
-
-        # Loading to MVU VRFs
-        seprator = ''
-        id_str_0 = cur_chain.vrf_id0_op
-        src_0 = seprator.join(id_str_0[0:3])
-        id_str_1 = cur_chain.vrf_id1_op
-        src_1 = seprator.join(id_str_1[0:3])
-        if(src_0 == 'mvu'):
-          m = re.search('mvu(\d+)',id_str_0,re.IGNORECASE)
-          vrf_id = int(m.group(1))
-          self.mvu_vrfs[vrf_id][vrf_addr][:]= wb_data
-        if(src_1 == 'mvu'):
-          m = re.search('mvu(\d+)',id_str_0,re.IGNORECASE)
-          vrf_id = int(m.group(1))
-          self.mvu_vrfs[vrf_id][vrf_addr][:]= wb_data
-
-        # Loading to eVRF
-        if((cur_chain.vrf_id0_op=='extvrf') or (cur_chain.vrf_id1_op=='extvrf')):
-          self.ext_vrf[vrf_addr][:]= wb_data
-        # Loading to MFU0 VRF0
-        elif((cur_chain.vrf_id0_op=='mfu0.vrf0') or (cur_chain.vrf_id1_op=='mfu0.vrf0')):
-          self.mfu0_vrf0[vrf_addr][:]= wb_data
-        # Loading to MFU0 VRF1
-        elif((cur_chain.vrf_id0_op=='mfu0.vrf1') or (cur_chain.vrf_id1_op=='mfu0.vrf1')):
-          self.mfu0_vrf1[vrf_addr][:]= wb_data
-        # Loading to MFU1 VRF0
-        elif((cur_chain.vrf_id0_op=='mfu1.vrf0') or (cur_chain.vrf_id1_op=='mfu1.vrf0')):
-          self.mfu1_vrf0[vrf_addr][:]= wb_data
-        # Loading to MFU1 VRF1
-        elif((cur_chain.vrf_id0_op=='mfu1.vrf1') or (cur_chain.vrf_id1_op=='mfu1.vrf1')):
-          self.mfu1_vrf1[vrf_addr][:]= wb_data
-
-        if(cur_chain.write_to_obuf == 1):
-          self.obuf_q.append(wb_data)
+    # Input rows arrive in (word, batch) order and are written like write backs: each destination at its own
+    # addresses, as in the RTL and C++ loaders
+    wb_data = self.ibuf_q.pop(cur_chain.vrf_id0_wr_size * cur_chain.batch)
+    if(cur_chain.vrf_id0 != VRF_NONE):
+      self.get_vrf(cur_chain.vrf_id0)[cur_chain.vrf_id0_wr_addr] = wb_data
+    if(cur_chain.vrf_id1 != VRF_NONE):
+      self.get_vrf(cur_chain.vrf_id1)[cur_chain.vrf_id1_wr_addr] = wb_data
+
+    if(cur_chain.write_to_obuf == 1):
+      self.obuf_q.extend(wb_data)
 
   # flush is used to make the fifo empty if loader wb instruction don't read all the data in fifo
   def exe_ld_inst_flush(self, cur_chain, verbose):
-    for i in range(cur_chain.vrf_id0_wr_size):
-      for b in range(cur_chain.batch):
-        for j in range (self.nlane):
-          temp_nul = self.mfu1_ofifo.pop(0)
+    self.mfu1_ofifo.pop(cur_chain.vrf_id0_wr_size * cur_chain.batch)
     if(verbose):
       print("Loader Output FIFO: ", self.mfu1_ofifo)
      
@@ -407,70 +823,32 @@ class npu_isa_sim (object):
   def exe_ld_inst_wb(self, cur_chain, verbose):
     if(verbose):
       print("Loader Output FIFO: ", self.mfu1_ofifo)
-    seprator = ''
-    id_str_0 = cur_chain.vrf_id0_op
-    id_str_1 = cur_chain.vrf_id1_op
-    curr_obuf_q = []
-    for i in range(cur_chain.vrf_id0_wr_size):
-      for b in range(cur_chain.batch):
-        curr_obuf_val = []
-        tmp_addr0 = cur_chain.vrf_id0_wr_base[b] + i
-        tmp_addr1 = cur_chain.vrf_id1_wr_base[b] + i
-        for j in range (self.nlane):
-          wb_data = self.mfu1_ofifo.pop(0)
-          curr_obuf_val.append(wb_data)
-          # wb0:write back to the first destination
-          if (seprator.join(id_str_0[0:3]) == 'mvu'):
-            m = re.search('mvu(\d+)',id_str_0,re.IGNORECASE)
-            id_int_0 = int(m.group(1))
-            self.mvu_vrfs[id_int_0][tmp_addr0][j]= wb_data
-            #if (self.mvu_vrfs[id_int_0][tmp_addr0][j] == -128):
-            #  self.mvu_vrfs[id_int_0][tmp_addr0][j] = 0
-          if(cur_chain.vrf_id0_op=='mfu0.vrf0'):
-            self.mfu0_vrf0[tmp_addr0][j]= wb_data
-          if(cur_chain.vrf_id0_op=='mfu0.vrf1'):
-            self.mfu0_vrf1[tmp_addr0][j] = wb_data 
-          if(cur_chain.vrf_id0_op=='mfu1.vrf0'):
-            self.mfu1_vrf0[tmp_addr0][j] = wb_data
-          if(cur_chain.vrf_id0_op=='mfu1.vrf1'):
-            self.mfu1_vrf1[tmp_addr0][j] = wb_data 
-          if(cur_chain.vrf_id0_op=='extvrf'):
-            self.ext_vrf[tmp_addr0][j] = wb_data 
-          # wb1:write back to the second destination 
-          if (seprator.join(id_str_1[0:3]) == 'mvu'):
-            m = re.search('mvu(\d+)',id_str_1,re.IGNORECASE)
-            id_int_1 = int(m.group(1))
-            self.mvu_vrfs[id_int_1][tmp_addr1][j]= wb_data
-            #if (self.mvu_vrfs[id_int_1][tmp_addr1][j] == -128):
-            #  self.mvu_vrfs[id_int_1][tmp_addr1][j] = 0
-          if(cur_chain.vrf_id1_op=='mfu0.vrf0'):
-            self.mfu0_vrf0[tmp_addr1][j] = wb_data
-          if(cur_chain.vrf_id1_op=='mfu0.vrf1'):
-            self.mfu0_vrf1[tmp_addr1][j] = wb_data 
-          if(cur_chain.vrf_id1_op=='mfu1.vrf0'):
-            self.mfu1_vrf0[tmp_addr1][j] = wb_data
-          if(cur_chain.vrf_id1_op=='mfu1.vrf1'):
-            self.mfu1_vrf1[tmp_addr1][j] = wb_data 
-          if(cur_chain.vrf_id1_op=='extvrf'):
-            self.ext_vrf[tmp_addr1][j] = wb_data 
-        if(cur_chain.write_to_obuf == 1):
-          self.obuf_q.append(curr_obuf_val)
+    # Write back rows leave the MFU1 in (word, batch) order
+    wb_data = self.mfu1_ofifo.pop(cur_chain.vrf_id0_wr_size * cur_chain.batch)
+    # wb0:write back to the first destination
+    if(cur_chain.vrf_id0 != VRF_NONE):
+      self.get_vrf(cur_chain.vrf_id0)[cur_chain.vrf_id0_wr_addr] = wb_data
+    # wb1:write back to the second destination 
+    if(cur_chain.vrf_id1 != VRF_NONE):
+      self.get_vrf(cur_chain.vrf_id1)[cur_chain.vrf_id1_wr_addr] = wb_data
+    if(cur_chain.write_to_obuf == 1):
+      self.obuf_q.extend(wb_data)
 
   # Complete loader 
   def exe_ld_m_inst (self, cur_chain, verbose):
-    if cur_chain.loader_src == 'in':
+    if cur_chain.loader_op == LD_OPS['in']:
       if(verbose):
         print('Loader performing input load')
       self.exe_ld_inst_in(cur_chain)
-    elif(cur_chain.loader_src =='wb'):
+    elif(cur_chain.loader_op == LD_OPS['wb']):
       if(verbose):
         print('Loader performing write back')
       self.exe_ld_inst_wb(cur_chain, verbose)
-    elif(cur_chain.loader_src =='flush'):
+    elif(cur_chain.loader_op == LD_OPS['flush']):
       if(verbose):
         print('Loader performing flush')
       self.exe_ld_inst_flush(cur_chain, verbose)
-    elif(cur_chain.loader_src =='nop'):
+    elif(cur_chain.loader_op == LD_OPS['nop']):
       if(verbose):
         print('Loader performing nop')
     else:
@@ -478,11 +856,229 @@ class npu_isa_sim (object):
   
   # execute all macro insts in the chain
   def step(self, verbose=0):
-    cur_chain = self.inst_q.pop(0)
+    if(self.mode == 'dataflow'):
+      self.step_dataflow(verbose)
+    else:
+      self.step_units(verbose)
+
+  # execute the chain unit by unit through the FIFOs
+  def step_units(self, verbose=0):
+    cur_chain = self.inst_q[self.pc]
+    self.pc += 1
     if(verbose):
       cur_chain.print_chain()
+    if(self.profiler is not None):
+      self.profile_units(cur_chain, verbose)
+      return
     self.exe_mvu_m_inst(cur_chain, verbose)
     self.exe_extverf_m_inst(cur_chain, verbose)
     self.exe_mfu0_m_inst(cur_chain, verbose)
     self.exe_mfu1_m_inst(cur_chain, verbose)  
     self.exe_ld_m_inst(cur_chain, verbose)
+
+  # Same as the unit sequence of step_units, but every unit is timed and its output FIFO is sampled
+  def profile_units(self, cur_chain, verbose):
+    chain_idx = self.pc - 1
+    src = cur_chain.src
+    units = [('MVU', self.exe_mvu_m_inst, 'mvu_ofifo', src.mvu_op_type), \
+      ('eVRF', self.exe_extverf_m_inst, 'mfu0_ififo', src.extvrf_op_type), \
+      ('MFU0', self.exe_mfu0_m_inst, 'mfu1_ififo', src.mfu0_act_op_type + '/' + src.mfu0_add_op_type + '/' + src.mfu0_mul_op_type), \
+      ('MFU1', self.exe_mfu1_m_inst, 'mfu1_ofifo', src.mfu1_act_op_type + '/' + src.mfu1_add_op_type + '/' + src.mfu1_mul_op_type)]
+    for unit, exe, out_fifo, op in units:
+      out_rows = len(getattr(self, out_fifo))
+      start = time.perf_counter()
+      exe(cur_chain, verbose)
+      seconds = time.perf_counter() - start
+      fifo_rows = len(getattr(self, out_fifo))
+      self.profiler.record(chain_idx, unit, op, seconds, max(fifo_rows - out_rows, 0) * self.nlane, fifo_rows)
+      self.profiler.sample_fifos(self)
+
+    # The loader drains the input buffer or the MFU1 output FIFO
+    in_rows = len(self.ibuf_q) + len(self.mfu1_ofifo)
+    start = time.perf_counter()
+    self.exe_ld_m_inst(cur_chain, verbose)
+    seconds = time.perf_counter() - start
+    consumed_rows = in_rows - len(self.ibuf_q) - len(self.mfu1_ofifo)
+    written_rows = 0 if cur_chain.loader_op == LD_OPS['flush'] else consumed_rows
+    self.profiler.record(chain_idx, 'LD', src.loader_src, seconds, written_rows * self.nlane, len(self.mfu1_ofifo))
+    self.profiler.sample_fifos(self)
+
+  #### Dataflow fast path ####
+  # A chain can be fused if nothing is left in the intermediate FIFOs and every enabled unit consumes exactly
+  # what the previous one produces. Only the MFU1 output FIFO (consumed by later write backs) is kept.
+  def is_fusable(self, cur_chain):
+    if(len(self.mvu_ofifo) or len(self.mfu0_ififo) or len(self.mfu1_ififo)):
+      return False
+    batch = cur_chain.batch
+    if(cur_chain.mvu_op == MVU_OPS['matvec']):
+      num_steps = int(math.ceil(cur_chain.mvu_mrf_rd_sz / cur_chain.mvu_vrf_rd_sz))
+      if(cur_chain.extvrf_op != EVRF_OPS['move'] or num_steps * self.ndpe != cur_chain.extvrf_rd_sz * self.nlane):
+        return False
+    elif(cur_chain.extvrf_op == EVRF_OPS['move']):
+      return False
+    if(cur_chain.extvrf_op == EVRF_OPS['nop']):
+      return not (cur_chain.mfu0_en or cur_chain.mfu1_en)
+    return cur_chain.mfu0_en and cur_chain.mfu1_en and \
+      cur_chain.mfu0_vrf_rd_size == cur_chain.extvrf_rd_sz and cur_chain.mfu1_vrf_rd_size == cur_chain.extvrf_rd_sz
+
+  # Evaluate ld(mfu1(mfu0(evrf(mvu)))) directly on the VRF arrays
+  def exe_chain_fused(self, cur_chain, verbose):
+    batch = cur_chain.batch
+    if(cur_chain.extvrf_op == EVRF_OPS['move']):
+      if(self.mvu_engine == 'tensor'):
+        data = self.mvu_matvec_tensor(cur_chain).astype(acc_d_type)
+      else:
+        self.exe_mvu_m_inst_matvec(cur_chain, 0)
+        data = self.mvu_ofifo.pop(len(self.mvu_ofifo)).astype(acc_d_type)
+    elif(cur_chain.extvrf_op == EVRF_OPS['extvrf']):
+      data = self.ext_vrf[cur_chain.extvrf_rd_addr]
+    else:
+      data = None
+
+    if(data is not None):
+      data = self.exe_mfu_ops(data, self.mfu0_vrf0, self.mfu0_vrf1, cur_chain.mfu0_vrf0_rd_addr, cur_chain.mfu0_vrf1_rd_addr, \
+        cur_chain.mfu0_act_op, cur_chain.mfu0_add_op, cur_chain.mfu0_mul_op, cur_chain.mfu0_vrf_rd_size, batch)
+      data = self.exe_mfu_ops(data, self.mfu1_vrf0, self.mfu1_vrf1, cur_chain.mfu1_vrf0_rd_addr, cur_chain.mfu1_vrf1_rd_addr, \
+        cur_chain.mfu1_act_op, cur_chain.mfu1_add_op, cur_chain.mfu1_mul_op, cur_chain.mfu1_vrf_rd_size, batch)
+      self.mfu1_ofifo.push(data)
+
+    self.exe_ld_m_inst(cur_chain, verbose)
+
+  # Return a copy of the simulator with its own architecture state (the MRFs are shared, they are read-only)
+  def clone(self):
+    sim = copy.copy(self)
+    for name in ARCH_VRFS:
+      setattr(sim, name, np.copy(getattr(self, name)))
+    for name in ARCH_FIFOS:
+      setattr(sim, name, getattr(self, name).copy())
+    sim.obuf_q = list(self.obuf_q)
+    return sim
+
+  # Return a snapshot of the architecture state (VRFs, FIFOs, output buffer and program counter). The
+  # snapshot owns its arrays, so it stays valid while the simulation continues.
+  def save_state(self):
+    state = {'pc': self.pc}
+    for name in ARCH_VRFS:
+      state[name] = np.copy(getattr(self, name))
+    for name in ARCH_FIFOS:
+      state[name] = getattr(self, name).copy()
+    state['obuf_q'] = [np.copy(row) for row in self.obuf_q]
+    return state
+
+  # Restore the architecture state from a snapshot (the snapshot itself is left untouched)
+  def load_state(self, state):
+    self.pc = state['pc']
+    for name in ARCH_VRFS:
+      setattr(self, name, np.copy(state[name]))
+    for name in ARCH_FIFOS:
+      setattr(self, name, state[name].copy())
+    self.obuf_q = [np.copy(row) for row in state['obuf_q']]
+
+  # Simulate the whole program on a pool of jobs processes, one independent group of chains per task (see
+  # partition_chains). Groups of one wave run in parallel. Each VRF word takes the value of the group holding its last
+  # writer, and the output rows of the segments are concatenated in program order, so the final state is the same as
+  # a serial run.
+  def run_parallel(self, jobs):
+    assert self.pc == 0, 'Parallel simulation has to start from the first chain'
+    segments, seg_group, levels, group_last = partition_chains(self.inst_q, self.ntile, self.ndpe, self.nlane)
+    ibuf_data = self.ibuf_q.peek(len(self.ibuf_q))
+    ibuf_offsets = [0]
+    for first, last in segments:
+      ibuf_offsets.append(ibuf_offsets[-1] + sum([inst.vrf_id0_wr_size * inst.batch for inst in self.inst_q[first:last] \
+        if inst.loader_op == LD_OPS['in']]))
+    group_segs = [[] for g in levels]
+    for seg, g in enumerate(seg_group):
+      group_segs[g].append(seg)
+
+    state = self.save_state()
+    owner = np.full(group_last[0].shape if levels else (0, 0), -1)
+    results = [None] * len(levels)
+    shm = shared_memory.SharedMemory(create=True, size=max(self.mvu_mrfs.nbytes, 1))
+    try:
+      mrfs = np.ndarray(self.mvu_mrfs.shape, dtype=self.mvu_mrfs.dtype, buffer=shm.buf)
+      mrfs[...] = self.mvu_mrfs
+      with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=attach_shared_mrfs, \
+        initargs=(shm.name, self.mvu_mrfs.shape, self.mvu_mrfs.dtype)) as pool:
+        for wave in range(max(levels + [-1]) + 1):
+          members = [g for g in range(len(levels)) if levels[g] == wave]
+          vrfs = [state[name] for name in ARCH_VRFS]
+          futures = {}
+          for g in members:
+            group_insts = [inst for seg in group_segs[g] for inst in self.inst_q[segments[seg][0]:segments[seg][1]]]
+            group_ibuf = np.concatenate([ibuf_data[ibuf_offsets[seg]:ibuf_offsets[seg+1]] for seg in group_segs[g]])
+            seg_ends = np.cumsum([segments[seg][1] - segments[seg][0] for seg in group_segs[g]])
+            futures[g] = pool.submit(simulate_group, group_insts, group_ibuf, seg_ends, vrfs, \
+              self.ntile, self.ndpe, self.nlane, self.vrf_init_sz, self.mvu_engine, self.mode)
+          for g in members:
+            results[g] = futures[g].result()
+          # A word takes the value of the group holding its latest writer (in program order) so far
+          for g in members:
+            for vrf_id in range(owner.shape[0]):
+              name = vrf_state_name(vrf_id, self.ntile)
+              vrf = state[name][vrf_id] if name == 'mvu_vrfs' else state[name]
+              group_vrf = results[g][0][name][vrf_id] if name == 'mvu_vrfs' else results[g][0][name]
+              depth = min(len(vrf), owner.shape[1])
+              mask = group_last[g][vrf_id, :depth] > owner[vrf_id, :depth]
+              vrf[:depth][mask] = group_vrf[:depth][mask]
+              owner[vrf_id, :depth][mask] = group_last[g][vrf_id, :depth][mask]
+      del mrfs
+    finally:
+      shm.close()
+      shm.unlink()
+
+    # Output rows of each segment, in program order
+    obuf_q = []
+    obuf_pos = [0] * len(levels)
+    seg_pos = [0] * len(levels)
+    for g in seg_group:
+      group_state, obuf_ends = results[g]
+      obuf_q.extend(group_state['obuf_q'][obuf_pos[g]:obuf_ends[seg_pos[g]]])
+      obuf_pos[g] = obuf_ends[seg_pos[g]]
+      seg_pos[g] += 1
+    state['pc'] = len(self.inst_q)
+    state['obuf_q'] = obuf_q
+    state['ibuf_q'] = fifo(self.nlane, ibuf_data.dtype, len(ibuf_data), ibuf_data[ibuf_offsets[-1]:])
+    # Only the last segment may leave data in the FIFOs
+    if(segments):
+      for name in ARCH_FIFOS[1:]:
+        state[name] = results[seg_group[-1]][0][name]
+    self.load_state(state)
+    return len(levels), max(levels + [-1]) + 1
+
+  # Return the names of the architecture states that differ between two simulators
+  def diff_state(self, other):
+    return diff_states(self.save_state(), other.save_state())
+
+  # execute the chain as one fused expression (falls back to the step engine if the chain cannot be fused)
+  def step_dataflow(self, verbose=0):
+    chain_idx = self.pc
+    cur_chain = self.inst_q[chain_idx]
+    if(not self.is_fusable(cur_chain)):
+      self.step_units(verbose)
+      return
+
+    check = (self.check_chains == 'all') or (chain_idx in self.check_chains)
+    if(check):
+      ref_sim = self.clone()
+      ref_sim.step_units(0)
+
+    self.pc += 1
+    if(verbose):
+      cur_chain.print_chain()
+      print('Dataflow evaluation of chain ' + str(chain_idx))
+    if(self.profiler is not None):
+      start = time.perf_counter()
+    self.exe_chain_fused(cur_chain, verbose)
+    self.num_fused += 1
+    if(self.profiler is not None):
+      # Fused chains are recorded as one unit, elements are the ones produced by the fused expression
+      seconds = time.perf_counter() - start
+      op = cur_chain.src.mvu_op_type + '>' + cur_chain.src.extvrf_op_type + '>' + cur_chain.src.loader_src
+      produced_rows = cur_chain.extvrf_rd_sz * cur_chain.batch if cur_chain.extvrf_op != EVRF_OPS['nop'] else 0
+      self.profiler.record(chain_idx, 'FUSED', op, seconds, produced_rows * self.nlane, len(self.mfu1_ofifo))
+      self.profiler.sample_fifos(self)
+
+    if(check):
+      diff = self.diff_state(ref_sim)
+      assert not diff, 'Dataflow cross-check failed at chain ' + str(chain_idx) + ': ' + ', '.join(diff) + ' differ'
+      self.num_checked += 1
@@ -1,29 +1,27 @@
 import math
 import numpy as np
 import os
-os.environ['TF_CPP_MIN_LOG_LEVEL'] = "2"
-import tensorflow as tf
-from tensorflow import keras
-from tensorflow.keras import layers
+import hashlib
+import json
 
 from compiler import *
 
 def npu_dense(npu, layer_name, layer_idx, num_inputs, time_steps, input_size, output_size, w_data, dest_memspace, inputs=None, activation=None, style='normal', last_layer=0):
     SIM_BATCH = 3
     BATCH = 6
-    # Allocate weight matrix
-    wdata = np.random.randint(0, 127, size=(output_size, input_size), dtype=np.int8)
+    # Allocate weight matrix (synthetic if no weights are given)
+    wdata = np.random.randint(0, 127, size=(output_size, input_size), dtype=np.int8) if w_data is None else w_data
     W = npu.malloc(layer_name+'W', input_size, output_size, 'mvu_mrf', wdata)
 
     # Allocate output vectors
-    h = [[[None] * SIM_BATCH] * int(num_inputs/BATCH)] * time_steps
+    h = [[[None] * SIM_BATCH for k in range(int(num_inputs/BATCH))] for t in range(time_steps)]
     for t in range(time_steps):
         for k in range(int(num_inputs / BATCH)):
             for i in range(SIM_BATCH):
                 h[t][k][i] = npu.malloc(layer_name+'_h'+str(t)+'_'+str(k)+'_'+str(i), output_size, None, dest_memspace)
 
     # Allocate or retrieve input vectors
-    x = [[[None] * SIM_BATCH] * int(num_inputs/BATCH)] * time_steps
+    x = [[[None] * SIM_BATCH for k in range(int(num_inputs/BATCH))] for t in range(time_steps)]
     if(layer_idx == 0):
         for t in range(time_steps):
             for k in range(int(num_inputs / BATCH)):
@@ -68,8 +66,8 @@ def npu_rnn(npu, layer_name, layer_idx, time_steps, num_inputs, input_size, unit
 
     # Allocate output and intermediate vectors
     hz = [None] * SIM_BATCH
-    h1 = [[[None] * SIM_BATCH] * int(num_inputs/BATCH)] * 1
-    h2 = [[[None] * SIM_BATCH] * int(num_inputs/BATCH)] * 1
+    h1 = [[[None] * SIM_BATCH for k in range(int(num_inputs/BATCH))]]
+    h2 = [[[None] * SIM_BATCH for k in range(int(num_inputs/BATCH))]]
     for k in range(int(num_inputs / BATCH)):
         for i in range(SIM_BATCH):
                 h1[0][k][i] = npu.malloc(layer_name+'_h1', output_size, None, dest_memspace)
@@ -81,7 +79,7 @@ def npu_rnn(npu, layer_name, layer_idx, time_steps, num_inputs, input_size, unit
         tmp[i] = npu.malloc('tmp',  output_size, None, 'mfu0_add')
 
     # Allocate or retrieve input vectors
-    x = [[[None] * SIM_BATCH] * int(num_inputs/BATCH)] * time_steps
+    x = [[[None] * SIM_BATCH for k in range(int(num_inputs/BATCH))] for t in range(time_steps)]
     if(layer_idx == 0):
         for t in range(time_steps):
             for k in range(int(num_inputs / BATCH)):
@@ -165,7 +163,7 @@ def npu_gru(npu, layer_name, layer_idx, time_steps, num_inputs, input_size, unit
         htmpz[i] = npu.malloc('hz', output_size, None, 'mfu1_mul')
 
     hz = [None] * SIM_BATCH
-    h = [[[None] * SIM_BATCH] * int(num_inputs/BATCH)] * 1
+    h = [[[None] * SIM_BATCH for k in range(int(num_inputs/BATCH))]]
     for k in range(int(num_inputs / BATCH)):
         for i in range(SIM_BATCH):
                 h[0][k][i] = npu.malloc(layer_name+'_h', output_size, None, dest_memspace)
@@ -173,7 +171,7 @@ def npu_gru(npu, layer_name, layer_idx, time_steps, num_inputs, input_size, unit
         hz[i] = npu.malloc(layer_name+'_hz', output_size, None, dest_memspace)
     
     # Allocate or retrieve input vectors
-    x = [[[None] * SIM_BATCH] * int(num_inputs/BATCH)] * time_steps
+    x = [[[None] * SIM_BATCH for k in range(int(num_inputs/BATCH))] for t in range(time_steps)]
     if(layer_idx == 0):
         for t in range(time_steps):
             for k in range(int(num_inputs / BATCH)):
@@ -295,7 +293,7 @@ def npu_lstm(npu, layer_name, layer_idx, time_steps, num_inputs, input_size, uni
         ctz[i] = npu.malloc('ctz', output_size, None, 'evrf')
 
     hz = [None] * SIM_BATCH
-    h = [[[None] * SIM_BATCH] * int(num_inputs/BATCH)] * 1
+    h = [[[None] * SIM_BATCH for k in range(int(num_inputs/BATCH))]]
     for k in range(int(num_inputs / BATCH)):
         for i in range(SIM_BATCH):
                 h[0][k][i] = npu.malloc(layer_name+'_h', output_size, None, dest_memspace)
@@ -303,7 +301,7 @@ def npu_lstm(npu, layer_name, layer_idx, time_steps, num_inputs, input_size, uni
         hz[i] = npu.malloc(layer_name+'_hz', output_size, None, dest_memspace)
     
     # Allocate or retrieve input vectors
-    x = [[[None] * SIM_BATCH] * int(num_inputs/BATCH)] * time_steps
+    x = [[[None] * SIM_BATCH for k in range(int(num_inputs/BATCH))] for t in range(time_steps)]
     if(layer_idx == 0):
         for t in range(time_steps):
             for k in range(int(num_inputs / BATCH)):
@@ -411,7 +409,7 @@ def npu_preprocessing(npu, max_tokens, seq_length, num_inputs):
     SIM_BATCH = 3
     BATCH = 6
 
-    x = [[[None] * SIM_BATCH] * int(num_inputs/BATCH)] * time_steps
+    x = [[[None] * SIM_BATCH for k in range(int(num_inputs/BATCH))] for t in range(time_steps)]
     for t in range(time_steps):
         for k in range(int(num_inputs / BATCH)):
             for i in range(SIM_BATCH):
@@ -422,144 +420,254 @@ def npu_preprocessing(npu, max_tokens, seq_length, num_inputs):
 
     npu.operands.append(x)
 
-class NPUSequential(keras.Sequential):
-    def __init__(self, layers=None, name=None):
-        super(NPUSequential, self).__init__(layers, name)
-
-    def compile_for_npu(self, npu, inputs):
-        unsupported_layers = []
-        ops = 0
-        for i in range(len(self.layers)):
-            config = self.layers[i].get_config()
-            layer_name = self.layers[i].name
-            layer_idx = i
-            weights = self.layers[i].get_weights()
-
-            if isinstance(self.layers[i], keras.layers.Dense):
-                w_data = np.transpose(weights[0])
-                input_size = int(w_data.shape[1])
-                output_size = int(w_data.shape[0])
-                w_data = np.random.randint(0, 127, size=(output_size, input_size), dtype=np.int8)
-                if (i == 0):
-                    num_inputs = int(math.ceil(int(inputs.shape[0]) / 6.0)) * 6
-                else:
-                    num_inputs = len(npu.operands[i-1][0]) * 6
-                input_data = np.random.randint(-128, 127, size=(num_inputs, input_size), dtype=np.int8)
-                dest_memspace = 'mvu_vrf'
-                activation = config['activation']
-                style = 'normal'
-                npu_dense(npu, layer_name, layer_idx, num_inputs, 1, input_size, output_size, w_data, dest_memspace, input_data, activation, style, i==len(self.layers)-1)
-                ops = ops + (num_inputs * input_size * output_size * 2)
-            
-            elif isinstance(self.layers[i], keras.layers.Embedding):
-                w_data = np.transpose(weights[0])
-                input_size = config['input_dim']
-                output_size = config['output_dim']
-                dest_memspace = 'mvu_vrf'
-                if(i == 0):
-                    num_inputs = int(math.ceil(int(inputs.shape[0]) / 6.0)) * 6
-                    time_steps = inputs.shape[1]
-                else:
-                    num_inputs = len(npu.operands[i-1][0]) * 6
-                    time_steps = len(npu.operands[i-1])
-                activation = None
-                style = 'embedding'
-                npu_dense(npu, layer_name, layer_idx, num_inputs, time_steps, input_size, output_size, w_data, dest_memspace, inputs, activation, style)
-                ops = ops + (num_inputs * time_steps * input_size * output_size * 2)
-
-            elif isinstance(self.layers[i], keras.layers.SimpleRNN):
-                wx_data = weights[0]
-                wh_data = weights[1]
-                input_size = int(wx_data.shape[0])
-                units = config['units']
-                output_size = int(wx_data.shape[1])
-                wx_data = np.random.randint(0, 127, size=(output_size, input_size), dtype=np.int8)
-                wh_data = np.random.randint(0, 127, size=(output_size, input_size), dtype=np.int8)
-                if(i == 0):
-                    time_steps = inputs.shape[0]
-                    num_inputs = int(math.ceil(int(inputs.shape[1]) / 6.0)) * 6
-                    assert input_size == int(inputs.shape[2]), 'Incompatible input dimensions for ('+layer_name+')'
-                else:
-                    time_steps = len(npu.operands[i-1])
-                    num_inputs = len(npu.operands[i-1][0]) * 6
-                input_data = np.random.randint(-128, 127, size=(time_steps, num_inputs, input_size), dtype=np.int8)
-                dest_memspace = 'mvu_vrf'
-                activation = config['activation']
-                assert activation in ['relu', 'sigmoid', 'tanh'], 'Specified activation function for ('+layer_name+') is not supported by NPU'
-                npu_rnn(npu, layer_name, layer_idx, time_steps, num_inputs, input_size, units, output_size, wx_data, wh_data, dest_memspace, input_data, activation)
+'''
+TensorFlow-free model description. A model is a list of layers, each a dict with:
+- type: dense, embedding, rnn, gru or lstm
+- units: output size of the layer (output_dim for embedding)
+- input_size: input size of the layer (default: last input dimension for the first layer, units of the previous
+  layer otherwise; input_dim for embedding)
+- name: layer name (default: layer<index + 1>)
+- activation / recurrent_activation: relu, sigmoid or tanh (dense: none, recurrent layers: tanh / sigmoid)
+- weights: optional list of weight matrices (arrays or .npy files) of shape (units, input_size) for the input weights
+  and (units, units) for the recurrent ones, in the order of LAYER_WEIGHTS. Float matrices are quantized to int8 with
+  a per-tensor scale while they are copied into the MRFs. Synthetic random weights are used if there are none.
+The inputs are an array of (batch, input_size) for dense layers, (batch, time_steps) token indices for embedding
+layers and (time_steps, batch, input_size) for recurrent layers. Float inputs are quantized to int8 with a per-tensor
+scale. The scales are recorded in npu.quant_scales.
+'''
+LAYER_DEFAULTS = {
+    'dense'     : {'activation': None},
+    'embedding' : {},
+    'rnn'       : {'activation': 'tanh'},
+    'gru'       : {'activation': 'tanh', 'recurrent_activation': 'sigmoid'},
+    'lstm'      : {'activation': 'tanh', 'recurrent_activation': 'sigmoid'}
+}
+# Input and recurrent weight matrices of each layer type (in the order of the npu_* layer arguments)
+LAYER_WEIGHTS = {
+    'dense'     : (['w'], []),
+    'embedding' : (['w'], []),
+    'rnn'       : (['wx'], ['wh']),
+    'gru'       : (['uz', 'uc', 'ur'], ['wz', 'wc', 'wr']),
+    'lstm'      : (['uf', 'uc', 'ui', 'uo'], ['wf', 'wc', 'wi', 'wo'])
+}
+
+# Weight matrices of a layer (given or synthetic) in the order of LAYER_WEIGHTS
+def layer_weights(layer, input_size, output_size):
+    input_weights, recurrent_weights = LAYER_WEIGHTS[layer['type']]
+    weights = []
+    for w, name in enumerate(input_weights + recurrent_weights):
+        size = (output_size, input_size) if name in input_weights else (output_size, output_size)
+        if(layer.get('weights') is None):
+            weights.append(np.random.randint(0, 127, size=size, dtype=np.int8))
+            continue
+        data = layer['weights'][w]
+        data = np.load(data) if isinstance(data, str) else np.asarray(data)
+        assert data.shape == size, 'Weight matrix ' + name + ' of (' + layer['name'] + ') has shape ' + str(data.shape) + \
+            ' instead of ' + str(size)
+        weights.append(data)
+    return weights
+
+# Description of a layer in the compile cache key (weight matrices are hashed)
+def layer_key(layer):
+    desc = dict(layer)
+    if(desc.get('weights') is not None):
+        desc['weights'] = [hashlib.sha256(np.ascontiguousarray(np.load(w) if isinstance(w, str) else np.asarray(w)).tobytes()).hexdigest() \
+            for w in desc['weights']]
+    return desc
+
+# This function lowers a model description (see LAYER_DEFAULTS) through the npu_* layer functions
+def compile_layers(npu, layers, inputs):
+    input_shape = [int(d) for d in (inputs.shape if hasattr(inputs, 'shape') else np.shape(inputs))]
+    specs = []
+    for i, layer in enumerate(layers):
+        spec = {'name': 'layer'+str(i+1)}
+        spec.update(LAYER_DEFAULTS.get(layer['type'], {}))
+        spec.update(layer)
+        specs.append(spec)
+    layers = specs
+
+    # With -cache, reload the program if the same model was compiled before (see npu.compile_key)
+    cache_key = None
+    if(npu.flow_opts['cache']):
+        # The input values are compiled into the program (input loads and golden outputs), so they are hashed too
+        input_data = np.asarray(inputs)
+        if(input_data.dtype == object):
+            input_data = input_data.astype(str)
+        model_desc = {'layers': [layer_key(layer) for layer in layers], 'inputs': input_shape, \
+            'input_data': hashlib.sha256(np.ascontiguousarray(input_data).tobytes()).hexdigest()}
+        cache_key = npu.compile_key(model_desc)
+        if(npu.load_compiled(cache_key)):
+            return
+
+    unsupported_layers = []
+    ops = 0
+    prev_units = None
+    for i in range(len(layers)):
+        layer = layers[i]
+        layer_name = layer['name']
+        layer_idx = i
+        output_size = layer.get('units')
+        if(layer['type'] == 'embedding'):
+            input_size = layer['input_size']
+        else:
+            input_size = layer.get('input_size', input_shape[-1] if i == 0 else prev_units)
+        prev_units = output_size
+
+        if(layer['type'] == 'dense'):
+            if (i == 0):
+                num_inputs = int(math.ceil(input_shape[0] / 6.0)) * 6
+            else:
+                num_inputs = len(npu.operands[i-1][0]) * 6
+            w_data = layer_weights(layer, input_size, output_size)[0]
+            npu.quant_scales[layer_name] = [int8_scale(w_data)]
+            input_data = None
+            if (i == 0):
+                input_data = np.zeros((num_inputs, input_size), dtype=np.int8)
+                npu.quant_scales['input'] = quantize_int8(inputs, input_data[:input_shape[0]])
+            dest_memspace = 'mvu_vrf'
+            activation = layer['activation']
+            style = 'normal'
+            npu_dense(npu, layer_name, layer_idx, num_inputs, 1, input_size, output_size, w_data, dest_memspace, input_data, activation, style, i==len(layers)-1)
+            ops = ops + (num_inputs * input_size * output_size * 2)
+
+        elif(layer['type'] == 'embedding'):
+            dest_memspace = 'mvu_vrf'
+            if(i == 0):
+                num_inputs = int(math.ceil(input_shape[0] / 6.0)) * 6
+                time_steps = input_shape[1]
+            else:
+                num_inputs = len(npu.operands[i-1][0]) * 6
+                time_steps = len(npu.operands[i-1])
+            w_data = layer_weights(layer, input_size, output_size)[0]
+            npu.quant_scales[layer_name] = [int8_scale(w_data)]
+            activation = None
+            style = 'embedding'
+            npu_dense(npu, layer_name, layer_idx, num_inputs, time_steps, input_size, output_size, w_data, dest_memspace, inputs, activation, style)
+            ops = ops + (num_inputs * time_steps * input_size * output_size * 2)
+
+        elif(layer['type'] in ['rnn', 'gru', 'lstm']):
+            units = output_size
+            if(i == 0):
+                time_steps = input_shape[0]
+                num_inputs = int(math.ceil(input_shape[1] / 6.0)) * 6
+                assert input_size == input_shape[2], 'Incompatible input dimensions for ('+layer_name+')'
+            else:
+                time_steps = len(npu.operands[i-1])
+                num_inputs = len(npu.operands[i-1][0]) * 6
+            # Weight Matrices
+            w_data = layer_weights(layer, input_size, output_size)
+            npu.quant_scales[layer_name] = [int8_scale(w) for w in w_data]
+            input_data = None
+            if(i == 0):
+                input_data = np.zeros((time_steps, num_inputs, input_size), dtype=np.int8)
+                npu.quant_scales['input'] = quantize_int8(inputs, input_data[:, :input_shape[1]])
+            # Other params
+            dest_memspace = 'mvu_vrf'
+            activation = layer['activation']
+            assert activation in ['relu', 'sigmoid', 'tanh'], 'Specified activation function for ('+layer_name+') is not supported by NPU'
+            if(layer['type'] == 'rnn'):
+                npu_rnn(npu, layer_name, layer_idx, time_steps, num_inputs, input_size, units, output_size, *w_data, dest_memspace, input_data, activation)
                 ops = ops + (time_steps * num_inputs * input_size * output_size * 2 * 2)
-
-            elif isinstance(self.layers[i], keras.layers.GRU):
-                # Dimensions 
-                input_size = int(weights[0].shape[0])
-                output_size = int(int(weights[0].shape[1]) / 3)
-                units = config['units']
-                if(i == 0):
-                    time_steps = int(inputs.shape[0])
-                    num_inputs = int(math.ceil(int(inputs.shape[1]) / 6.0)) * 6
-                    assert input_size == int(inputs.shape[2]), 'Incompatible input dimensions for ('+layer_name+')'
-                else:
-                    time_steps = len(npu.operands[i-1])
-                    num_inputs = len(npu.operands[i-1][0]) * 6
-                # Weight Matrices
-                uz_data = np.random.randint(0, 127, size=(output_size, input_size), dtype=np.int8)
-                uc_data = np.random.randint(0, 127, size=(output_size, input_size), dtype=np.int8)
-                ur_data = np.random.randint(0, 127, size=(output_size, input_size), dtype=np.int8)
-                wz_data = np.random.randint(0, 127, size=(output_size, input_size), dtype=np.int8)
-                wc_data = np.random.randint(0, 127, size=(output_size, input_size), dtype=np.int8)
-                wr_data = np.random.randint(0, 127, size=(output_size, input_size), dtype=np.int8)
-                input_data = np.random.randint(-128, 127, size=(time_steps, num_inputs, input_size), dtype=np.int8)
-                # Other params
-                dest_memspace = 'mvu_vrf'
-                activation = config['activation']
-                assert activation in ['relu', 'sigmoid', 'tanh'], 'Specified activation function for ('+layer_name+') is not supported by NPU'
-                recurrent_activation = config['recurrent_activation']
-                assert recurrent_activation in ['relu', 'sigmoid', 'tanh'], 'Specified recurrent activation function for ('+layer_name+') is not supported by NPU'
-                npu_gru(npu, layer_name, layer_idx, time_steps, num_inputs, input_size, units, output_size, uz_data, uc_data, ur_data, \
-                    wz_data, wc_data, wr_data, dest_memspace, input_data, activation, recurrent_activation)
+                continue
+            recurrent_activation = layer['recurrent_activation']
+            assert recurrent_activation in ['relu', 'sigmoid', 'tanh'], 'Specified recurrent activation function for ('+layer_name+') is not supported by NPU'
+            if(layer['type'] == 'gru'):
+                npu_gru(npu, layer_name, layer_idx, time_steps, num_inputs, input_size, units, output_size, *w_data, dest_memspace, \
+                    input_data, activation, recurrent_activation)
                 ops = ops + (time_steps * num_inputs * input_size * output_size * 6 * 2)
-
-            elif isinstance(self.layers[i], keras.layers.LSTM):
-                # Dimensions 
-                input_size = int(weights[0].shape[0])
-                output_size = int(int(weights[0].shape[1]) / 4)
-                units = config['units']
-                if(i == 0):
-                    time_steps = int(inputs.shape[0])
-                    num_inputs = int(math.ceil(int(inputs.shape[1]) / 6.0)) * 6
-                    assert input_size == int(inputs.shape[2]), 'Incompatible input dimensions for ('+layer_name+')'
-                else:
-                    time_steps = len(npu.operands[i-1])
-                    num_inputs = len(npu.operands[i-1][0]) * 6
-                # Weight Matrices
-                uf_data = np.random.randint(0, 127, size=(output_size, input_size), dtype=np.int8) 
-                uc_data = np.random.randint(0, 127, size=(output_size, input_size), dtype=np.int8) 
-                ui_data = np.random.randint(0, 127, size=(output_size, input_size), dtype=np.int8) 
-                uo_data = np.random.randint(0, 127, size=(output_size, input_size), dtype=np.int8) 
-                wf_data = np.random.randint(0, 127, size=(output_size, input_size), dtype=np.int8) 
-                wc_data = np.random.randint(0, 127, size=(output_size, input_size), dtype=np.int8) 
-                wi_data = np.random.randint(0, 127, size=(output_size, input_size), dtype=np.int8) 
-                wo_data = np.random.randint(0, 127, size=(output_size, input_size), dtype=np.int8)
-                input_data = np.random.randint(-128, 127, size=(time_steps, num_inputs, input_size), dtype=np.int8) 
-                # Other params
-                dest_memspace = 'mvu_vrf'
-                activation = config['activation']
-                assert activation in ['relu', 'sigmoid', 'tanh'], 'Specified activation function for ('+layer_name+') is not supported by NPU'
-                recurrent_activation = config['recurrent_activation']
-                assert recurrent_activation in ['relu', 'sigmoid', 'tanh'], 'Specified recurrent activation function for ('+layer_name+') is not supported by NPU'
-                npu_lstm(npu, layer_name, layer_idx, time_steps, num_inputs, input_size, units, output_size, uf_data, uc_data, ui_data, uo_data, \
-                    wf_data, wc_data, wi_data, wo_data, dest_memspace, input_data, activation, recurrent_activation)
+            else:
+                npu_lstm(npu, layer_name, layer_idx, time_steps, num_inputs, input_size, units, output_size, *w_data, dest_memspace, \
+                    input_data, activation, recurrent_activation)
                 ops = ops + (time_steps * num_inputs * input_size * output_size * 8 * 2)
 
-            elif isinstance(self.layers[i], keras.layers.experimental.preprocessing.TextVectorization):
-                max_tokens = config['max_tokens']
-                seq_length = config['output_sequence_length']
-                num_inputs = int(math.ceil(len(inputs) / 6.0)) * 6
-                npu_preprocessing(npu, max_tokens, seq_length, num_inputs)
+        elif(layer['type'] == 'text_vectorization'):
+            max_tokens = layer['max_tokens']
+            seq_length = layer['output_sequence_length']
+            num_inputs = int(math.ceil(len(inputs) / 6.0)) * 6
+            npu_preprocessing(npu, max_tokens, seq_length, num_inputs)
+
+        else:
+            print(layer_name+' type is not supported by NPU')
+            exit(0)
+
+    npu.unsupported_layers = unsupported_layers
+    npu.ops = ops
+    if(cache_key is not None):
+        npu.save_compiled(cache_key)
+
+class NPUModel(object):
+    def __init__(self, layers, name='npu_model'):
+        self.layers = list(layers)
+        self.name = name
+
+    # Load a model description from a JSON file, either a list of layers or {"name": ..., "layers": [...]}.
+    # Weight files are relative to the JSON file.
+    @staticmethod
+    def from_json(path):
+        with open(path) as json_file:
+            desc = json.load(json_file)
+        if isinstance(desc, list):
+            desc = {'layers': desc}
+        for layer in desc['layers']:
+            if(layer.get('weights') is not None):
+                layer['weights'] = [os.path.join(os.path.dirname(os.path.abspath(path)), w) for w in layer['weights']]
+        return NPUModel(desc['layers'], desc.get('name', os.path.splitext(os.path.basename(path))[0]))
+
+    def summary(self):
+        print('Model: "' + str(self.name) + '"')
+        print('{:<28}{:>12}{:>12}'.format('Layer (type)', 'Units', 'Matrices'))
+        for i, layer in enumerate(self.layers):
+            print('{:<28}{:>12}{:>12}'.format(layer.get('name', 'layer'+str(i+1)) + ' (' + layer['type'] + ')', str(layer.get('units')), \
+                sum([len(names) for names in LAYER_WEIGHTS.get(layer['type'], [])])))
 
-            else:
-                print(layer_name+' type is not supported by NPU')
-                exit(0)
-
-        npu.unsupported_layers = unsupported_layers
-        npu.ops = ops
+    def compile_for_npu(self, npu, inputs):
+        compile_layers(npu, self.layers, inputs)
+
+# Model description of a Keras layer. The float weights are passed as views of the Keras kernels (transposed and split
+# per gate), so they are only copied when they are quantized into the MRFs.
+def keras_layer_spec(layer):
+    from tensorflow import keras
+    config = layer.get_config()
+    weights = layer.get_weights()
+    if isinstance(layer, keras.layers.Dense):
+        return {'type': 'dense', 'name': layer.name, 'input_size': int(weights[0].shape[0]), 'units': int(weights[0].shape[1]), \
+            'activation': config['activation'], 'weights': [weights[0].T]}
+    elif isinstance(layer, keras.layers.Embedding):
+        return {'type': 'embedding', 'name': layer.name, 'input_size': config['input_dim'], 'units': config['output_dim'], \
+            'weights': [weights[0].T]}
+    elif isinstance(layer, keras.layers.SimpleRNN):
+        return {'type': 'rnn', 'name': layer.name, 'input_size': int(weights[0].shape[0]), 'units': int(weights[0].shape[1]), \
+            'activation': config['activation'], 'weights': [weights[0].T, weights[1].T]}
+    elif isinstance(layer, keras.layers.GRU) or isinstance(layer, keras.layers.LSTM):
+        # Keras gate order: z, r, h (GRU) and i, f, c, o (LSTM)
+        if isinstance(layer, keras.layers.GRU):
+            layer_type, gates = 'gru', [0, 2, 1]
+        else:
+            layer_type, gates = 'lstm', [1, 2, 0, 3]
+        units = int(weights[1].shape[0])
+        kernels = [weights[0][:, g * units:(g + 1) * units].T for g in gates]
+        recurrent_kernels = [weights[1][:, g * units:(g + 1) * units].T for g in gates]
+        return {'type': layer_type, 'name': layer.name, 'input_size': int(weights[0].shape[0]), 'units': units, \
+            'activation': config['activation'], 'recurrent_activation': config['recurrent_activation'], \
+            'weights': kernels + recurrent_kernels}
+    elif isinstance(layer, keras.layers.experimental.preprocessing.TextVectorization):
+        return {'type': 'text_vectorization', 'name': layer.name, 'max_tokens': config['max_tokens'], \
+            'output_sequence_length': config['output_sequence_length']}
+    return {'type': type(layer).__name__, 'name': layer.name}
+
+# Keras front-end: a keras.Sequential model with a compile_for_npu method. TensorFlow is only imported when the first
+# Keras model is built.
+keras_sequential = None
+
+def NPUSequential(layers=None, name=None):
+    global keras_sequential
+    if(keras_sequential is None):
+        os.environ['TF_CPP_MIN_LOG_LEVEL'] = "2"
+        from tensorflow import keras
+
+        class npu_sequential(keras.Sequential):
+            def compile_for_npu(self, npu, inputs):
+                compile_layers(npu, [keras_layer_spec(layer) for layer in self.layers], inputs)
+
+        keras_sequential = npu_sequential
+    return keras_sequential(layers, name)
@@ -0,0 +1,130 @@
+#ifndef NPU_BUNDLE_HPP
+#define NPU_BUNDLE_HPP
+
+// Reader of the binary PCIe bundle (npu_bundle.bin) written by the NPU compiler with -pcie. The bundle holds the
+// MRF image, the instructions and the input/golden output vectors of a program. Every input/output vector is sent
+// once per core and per program loop; this replication is described in the header and not stored in the file.
+//
+// Layout (little-endian):
+//   header:   magic "NPUPCIE\0" (8 bytes), version, header_bytes, program_loops, cores, num_sections, reserved (uint32)
+//   sections: name (8 bytes), offset (uint64), dim0, dim1, row_bytes, reserved (uint32), one per section
+//   data:     dim0 x dim1 rows of row_bytes bytes per section, starting at its offset
+// Sections: "mrfs" (dim0 MRFs of dim1 words), "insts" (instructions followed by the program loops word),
+// "inputs" and "outputs" (dim0 = 1).
+
+#include <stdint.h>
+#include <stdio.h>
+#include <string.h>
+#include <vector>
+
+#define NPU_BUNDLE_VERSION 1
+
+struct npu_bundle_section {
+    uint64_t offset;
+    uint32_t dim0;
+    uint32_t dim1;
+    uint32_t row_bytes;
+};
+
+struct npu_bundle {
+    uint32_t version;
+    uint32_t program_loops;
+    uint32_t cores;
+    npu_bundle_section mrfs;
+    npu_bundle_section insts;
+    npu_bundle_section inputs;
+    npu_bundle_section outputs;
+    std::vector<uint8_t> data;
+
+    // Number of rows of a section
+    uint64_t rows(const npu_bundle_section& s) const {
+        return (uint64_t) s.dim0 * s.dim1;
+    }
+
+    // Byte col of a row of a section (zero past the end of the row)
+    uint8_t byte(const npu_bundle_section& s, uint64_t row, uint32_t col) const {
+        return (col < s.row_bytes) ? data[s.offset + row * s.row_bytes + col] : 0;
+    }
+
+    // Number of lines of the input/output stream after core and loop replication
+    uint64_t stream_lines(const npu_bundle_section& s) const {
+        return rows(s) * cores * program_loops;
+    }
+
+    // Row of the input/output section sent as a line of the replicated stream
+    uint64_t stream_row(const npu_bundle_section& s, uint64_t line) const {
+        return (line / cores) % rows(s);
+    }
+};
+
+static uint32_t npu_bundle_u32(const uint8_t* p) {
+    return (uint32_t) p[0] | ((uint32_t) p[1] << 8) | ((uint32_t) p[2] << 16) | ((uint32_t) p[3] << 24);
+}
+
+static uint64_t npu_bundle_u64(const uint8_t* p) {
+    return (uint64_t) npu_bundle_u32(p) | ((uint64_t) npu_bundle_u32(p + 4) << 32);
+}
+
+// Loads a bundle file. Returns false if it cannot be read, is not a bundle or has an unsupported version.
+static bool load_npu_bundle(const char* path, npu_bundle& bundle) {
+    FILE* file = fopen(path, "rb");
+    if (file == NULL) {
+        return false;
+    }
+    fseek(file, 0, SEEK_END);
+    long size = ftell(file);
+    fseek(file, 0, SEEK_SET);
+    bundle.data.resize(size > 0 ? size : 0);
+    size_t read = (size > 0) ? fread(&bundle.data[0], 1, size, file) : 0;
+    fclose(file);
+    if ((size < 32) || (read != (size_t) size) || (memcmp(&bundle.data[0], "NPUPCIE", 8) != 0)) {
+        fprintf(stderr, "%s is not an NPU PCIe bundle\n", path);
+        return false;
+    }
+
+    const uint8_t* header = &bundle.data[0];
+    bundle.version = npu_bundle_u32(header + 8);
+    bundle.program_loops = npu_bundle_u32(header + 16);
+    bundle.cores = npu_bundle_u32(header + 20);
+    uint32_t num_sections = npu_bundle_u32(header + 24);
+    if (bundle.version != NPU_BUNDLE_VERSION) {
+        fprintf(stderr, "%s has version %u, expected %u\n", path, bundle.version, NPU_BUNDLE_VERSION);
+        return false;
+    }
+    if (32 + 32 * (uint64_t) num_sections > (uint64_t) size) {
+        fprintf(stderr, "%s is truncated\n", path);
+        return false;
+    }
+
+    memset(&bundle.mrfs, 0, sizeof(npu_bundle_section));
+    memset(&bundle.insts, 0, sizeof(npu_bundle_section));
+    memset(&bundle.inputs, 0, sizeof(npu_bundle_section));
+    memset(&bundle.outputs, 0, sizeof(npu_bundle_section));
+    for (uint32_t i = 0; i < num_sections; i++) {
+        const uint8_t* entry = header + 32 + 32 * i;
+        char name[9];
+        memcpy(name, entry, 8);
+        name[8] = '\0';
+        npu_bundle_section section;
+        section.offset = npu_bundle_u64(entry + 8);
+        section.dim0 = npu_bundle_u32(entry + 16);
+        section.dim1 = npu_bundle_u32(entry + 20);
+        section.row_bytes = npu_bundle_u32(entry + 24);
+        if (section.offset + (uint64_t) section.dim0 * section.dim1 * section.row_bytes > (uint64_t) size) {
+            fprintf(stderr, "%s: section %s is truncated\n", path, name);
+            return false;
+        }
+        if (strcmp(name, "mrfs") == 0) {
+            bundle.mrfs = section;
+        } else if (strcmp(name, "insts") == 0) {
+            bundle.insts = section;
+        } else if (strcmp(name, "inputs") == 0) {
+            bundle.inputs = section;
+        } else if (strcmp(name, "outputs") == 0) {
+            bundle.outputs = section;
+        }
+    }
+    return true;
+}
+
+#endif /* NPU_BUNDLE_HPP */
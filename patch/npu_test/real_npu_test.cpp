@@ -14,6 +14,7 @@
 #include <sys/time.h>
 #include "intel_fpga_pcie_api.hpp"
 #include "dma_test.hpp"
+#include "npu_bundle.hpp"
 #include <stdio.h>
 #include <stdlib.h>
 
@@ -40,6 +41,7 @@ static void dma_show_config(bool run_rd, bool run_wr, bool run_simul,
                             unsigned int num_dw, unsigned int num_desc);
 static void do_npu_test_file(intel_fpga_pcie_dev *dev);
 static void add_tags(uint32_t* pos, int line_width, int bank, int addr, int dest, int line_num, int lines_per_itr);
+static void read_bytes(FILE* database, const npu_bundle* bundle, const npu_bundle_section& section, uint64_t row, int k, int* tmp);
 
 int main(int argc, char **argv)
 {
@@ -271,6 +273,19 @@ static void add_tags(uint32_t* pos, int line_width, int bank, int addr, int dest
     }
 }
 
+// Read the 4 bytes at offset 4*k of a line, either from a row of a section of the PCIe bundle or as the next 4
+// values of a .dat file
+static void read_bytes(FILE* database, const npu_bundle* bundle, const npu_bundle_section& section, uint64_t row, int k, int* tmp)
+{
+    if (bundle != NULL) {
+        for (int b = 0; b < 4; b++) {
+            tmp[b] = bundle->byte(section, row, 4*k + b);
+        }
+    } else {
+        fscanf(database, "%d %d %d %d", &tmp[0], &tmp[1], &tmp[2], &tmp[3]);
+    }
+}
+
 // main NPU routine
 // Total DMA buffer size up to 1MB
 // We use low 512KB for DMA write and high 512KB for DMA read
@@ -310,22 +325,38 @@ static void do_npu_test_file(intel_fpga_pcie_dev *dev)
 
     printf("Allocate Kernel memory succesully!\n");
 
+    //---------------------------------------------------------
+    // read the PCIe bundle written by the compiler (npu_bundle.bin), or the .dat files if there is none
+    //---------------------------------------------------------
+    npu_bundle bundle_data;
+    npu_bundle* bundle = NULL;
+    if (load_npu_bundle("npu_bundle.bin", bundle_data)) {
+        bundle = &bundle_data;
+        printf("Reading npu_bundle.bin (version %u, %u program loops)\n", bundle->version, bundle->program_loops);
+    }
+
     //---------------------------------------------------------
     // read mrfs.dat to a buffer
     //---------------------------------------------------------
 
-    database = fopen("mrfs.dat", "r");
+    database = (bundle != NULL) ? NULL : fopen("mrfs.dat", "r");
     ofstream mrf_data_file;
     mrf_data_file.open("mrf_data_host");
 
-    if (NULL == database)
+    if ((bundle == NULL) && (NULL == database))
     {
         perror("can't open mrfs.dat");
         return;
     }
 
     // read mrfs metadata
-    fscanf(database, "%d %d %d", &bank_num, &bank_depth, &bank_width);
+    if (bundle != NULL) {
+        bank_num = bundle->mrfs.dim0;
+        bank_depth = bundle->mrfs.dim1;
+        bank_width = bundle->mrfs.row_bytes;
+    } else {
+        fscanf(database, "%d %d %d", &bank_num, &bank_depth, &bank_width);
+    }
 
     // read mrfs data
     int mrfs_size = ((bank_num*bank_depth+1+4095)/4096)*4096*16;
@@ -349,10 +380,10 @@ static void do_npu_test_file(intel_fpga_pcie_dev *dev)
             // Construct data for one cache line
             uint32_t* line_pos;
             for (k = 0; k < bank_width/4; k++) {
-                int tmp0, tmp1, tmp2, tmp3;
-                fscanf(database, "%d %d %d %d", &tmp0, &tmp1, &tmp2, &tmp3);
+                int tmp[4];
+                read_bytes(database, bundle, bundle_data.mrfs, (uint64_t) i*bank_depth + j, k, tmp);
                 line_pos = mrfs + 16 + (j*bank_num+i)*16 + k + (16-bank_width/4);
-                *line_pos = ((tmp0 & 0xFF) + ((tmp1 & 0xFF) << 8) + ((tmp2 & 0xFF) << 16) + ((tmp3 & 0xFF) << 24));
+                *line_pos = ((tmp[0] & 0xFF) + ((tmp[1] & 0xFF) << 8) + ((tmp[2] & 0xFF) << 16) + ((tmp[3] & 0xFF) << 24));
             }
             add_tags(line_pos-15, bank_width, i, j, 1, bank_num*bank_depth, bank_num*bank_depth);
         }
@@ -377,16 +408,16 @@ static void do_npu_test_file(intel_fpga_pcie_dev *dev)
     }
 #endif
     mrf_data_file.close();
-    fclose(database);
+    if (database != NULL) fclose(database);
     printf("Finished parsing MRF file!\n");
 
     //---------------------------------------------------------
     //read instructions.dat to a buffer
     //---------------------------------------------------------
     
-    database = fopen("instructions.dat", "r");
+    database = (bundle != NULL) ? NULL : fopen("instructions.dat", "r");
 
-    if (NULL == database)
+    if ((bundle == NULL) && (NULL == database))
     {
          perror("can't open instructions.dat");
         return;
@@ -394,7 +425,12 @@ static void do_npu_test_file(intel_fpga_pcie_dev *dev)
 
     // read instructions metadata
     int num_instr;
-    fscanf(database, "%d %d", &num_instr, &bank_width);
+    if (bundle != NULL) {
+        num_instr = bundle->rows(bundle->insts);
+        bank_width = bundle->insts.row_bytes;
+    } else {
+        fscanf(database, "%d %d", &num_instr, &bank_width);
+    }
     ofstream inst_data_file;
     inst_data_file.open("inst_data_host");
 
@@ -418,10 +454,10 @@ static void do_npu_test_file(intel_fpga_pcie_dev *dev)
     for (i = 0; i < num_instr; i++) {
         uint32_t* line_pos;
         for (j = 0; j < bank_width/4; j++) {
-            int tmp0, tmp1, tmp2, tmp3;
-            fscanf(database, "%d %d %d %d", &tmp0, &tmp1, &tmp2, &tmp3);
+            int tmp[4];
+            read_bytes(database, bundle, bundle_data.insts, i, j, tmp);
             line_pos = instruction + 16 + i*16 + j + (16-bank_width/4);
-            *line_pos = ((tmp0 & 0xFF) + ((tmp1 & 0xFF) << 8) + ((tmp2 & 0xFF) << 16) + ((tmp3 & 0xFF) << 24));
+            *line_pos = ((tmp[0] & 0xFF) + ((tmp[1] & 0xFF) << 8) + ((tmp[2] & 0xFF) << 16) + ((tmp[3] & 0xFF) << 24));
         }
         add_tags(line_pos-15, bank_width, 0, i, 2, num_instr, num_instr);
     }
@@ -444,26 +480,34 @@ static void do_npu_test_file(intel_fpga_pcie_dev *dev)
     }
 #endif
     inst_data_file.close();
-    fclose(database);
+    if (database != NULL) fclose(database);
     printf("Finished parsing Instructions file!\n");
 
     //-------------------------------------------------
     //read inputs.dat then send out input data to FPGA
     //------------------------------------------------
     int num_inputs, input_width, num_outputs, output_width, lines_per_iteration;
-    database = fopen("inputs.dat", "r");
+    database = (bundle != NULL) ? NULL : fopen("inputs.dat", "r");
 
     ofstream input_data_file;
     input_data_file.open("input_data_host");
 
-    if (NULL == database)
+    if ((bundle == NULL) && (NULL == database))
     {
          perror("can't open inputs.dat");
         return;
     }
 
-    // read inputs metadata
-    fscanf(database, "%d %d %d %d %d", &num_inputs, &input_width, &num_outputs, &output_width, &lines_per_iteration);
+    // read inputs metadata (the bundle stores every vector once, it is sent once per core and per program loop)
+    if (bundle != NULL) {
+        num_inputs = bundle->stream_lines(bundle->inputs);
+        input_width = bundle->inputs.row_bytes;
+        num_outputs = bundle->stream_lines(bundle->outputs);
+        output_width = bundle->outputs.row_bytes;
+        lines_per_iteration = bundle->rows(bundle->inputs) * bundle->cores;
+    } else {
+        fscanf(database, "%d %d %d %d %d", &num_inputs, &input_width, &num_outputs, &output_width, &lines_per_iteration);
+    }
 
     int input_buf_size = ((num_inputs+2+4095)/4096)*4096*16;
     printf("Filling input memory with %d elements x %d words\n", input_width, num_inputs);
@@ -496,10 +540,10 @@ static void do_npu_test_file(intel_fpga_pcie_dev *dev)
         uint32_t* line_pos;
         // Construct data for one cache line
         for (j = 0; j < input_width/4; j++) {
-            int tmp0, tmp1, tmp2, tmp3;
-            fscanf(database, "%d %d %d %d", &tmp0, &tmp1, &tmp2, &tmp3);
+            int tmp[4];
+            read_bytes(database, bundle, bundle_data.inputs, (bundle != NULL) ? bundle->stream_row(bundle->inputs, i) : 0, j, tmp);
             line_pos = input_data + 32 + i*16 + j + (16-input_width/4);
-            *line_pos = ((tmp0 & 0xFF) + ((tmp1 & 0xFF) << 8) + ((tmp2 & 0xFF) << 16) + ((tmp3 & 0xFF) << 24));
+            *line_pos = ((tmp[0] & 0xFF) + ((tmp[1] & 0xFF) << 8) + ((tmp[2] & 0xFF) << 16) + ((tmp[3] & 0xFF) << 24));
         }
         add_tags(line_pos-15, input_width, 0, 0, 3+(i%2), i, lines_per_iteration);
     }
@@ -524,17 +568,17 @@ static void do_npu_test_file(intel_fpga_pcie_dev *dev)
 #endif
 
     input_data_file.close();
-    fclose(database);
+    if (database != NULL) fclose(database);
     printf("Finished parsing Inputs file!\n");
     
     //-----------------------------------------------------------------------
     //read outputs.dat then read data from FPGA to compare with golden data
     //-----------------------------------------------------------------------
-    database = fopen("outputs.dat", "r");
+    database = (bundle != NULL) ? NULL : fopen("outputs.dat", "r");
     ofstream golden_data_file;
     golden_data_file.open("golden_data_host");
 
-    if (NULL == database)
+    if ((bundle == NULL) && (NULL == database))
     {
         perror("can't open outputs.dat");
         return;
@@ -547,10 +591,10 @@ static void do_npu_test_file(intel_fpga_pcie_dev *dev)
     for (i = 0; i < num_outputs; i++) {
         // Construct data for one cache line
         for (j = 0; j < output_width/4; j++) {
-            int tmp0, tmp1, tmp2, tmp3;
-            fscanf(database, "%d %d %d %d", &tmp0, &tmp1, &tmp2, &tmp3);
+            int tmp[4];
+            read_bytes(database, bundle, bundle_data.outputs, (bundle != NULL) ? bundle->stream_row(bundle->outputs, i) : 0, j, tmp);
             uint32_t *line_pos = golden_data + i*16 + j;
-            *line_pos = ((tmp0 & 0xFF) + ((tmp1 & 0xFF) << 8) + ((tmp2 & 0xFF) << 16) + ((tmp3 & 0xFF) << 24));
+            *line_pos = ((tmp[0] & 0xFF) + ((tmp[1] & 0xFF) << 8) + ((tmp[2] & 0xFF) << 16) + ((tmp[3] & 0xFF) << 24));
         }
         for (j = output_width/4; j < 16; j++) {
             uint32_t *line_pos = golden_data + i*16 + j;
@@ -577,7 +621,7 @@ static void do_npu_test_file(intel_fpga_pcie_dev *dev)
 #endif
 
     golden_data_file.close();
-    fclose(database);
+    if (database != NULL) fclose(database);
     printf("Finished parsing Golden Outputs file!\n");
 
     //-----------------------------------------------------------------------
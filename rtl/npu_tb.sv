@@ -145,6 +145,7 @@ initial begin
 	init_done = $fopen("init_done", "w");
 	$fwrite(init_done, "init done\n");
 	$fclose(init_done);
+	$display("Simulation setup done");
 
 	// Step 1: Load MRF values
 	/*mrf_wr_id = 0;
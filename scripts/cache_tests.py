@@ -0,0 +1,58 @@
+from os import listdir, chdir
+from os.path import isfile, join
+import sys
+import subprocess
+import tempfile
+import shutil
+
+# Define colors for printing
+class colors:
+	PASS = '\x1b[42m'
+	FAIL = '\x1b[41m'
+	BOLD = '\033[1m'
+	RESET = '\033[0;0m'
+
+# Compile cache check: each workload is run twice with the same seed and a fresh cache directory. The first run has to
+# compile the program and store it, the second run has to load it from the cache without adding an entry.
+keyword = ''
+seed = '0'
+if ('--run_test' in sys.argv):
+	keyword = sys.argv[sys.argv.index('--run_test')+1]
+if ('--seed' in sys.argv):
+	seed = sys.argv[sys.argv.index('--seed')+1]
+
+# Get list of existing workloads
+path = './workloads/'
+workloads = [f for f in listdir(path) if isfile(join(path, f))]
+workloads = [f for f in workloads if keyword in f]
+workloads.sort()
+for i in range(len(workloads)):
+	workloads[i] = workloads[i].split('.')[0]
+
+print(colors.BOLD + '{:<35}{:<4}    {:<6}    {:<6}    {:<7}'.format('WORKLOAD', 'TEST', 'RUN 1', 'RUN 2', 'ENTRIES') + colors.RESET)
+
+chdir('../compiler')
+failed = 0
+for workload in workloads:
+	subprocess.call(['cp', '../scripts/workloads/'+workload+'.py', './'], shell=False)
+	sys.stdout.write('{:<35}'.format(workload))
+	sys.stdout.flush()
+	cache_dir = tempfile.mkdtemp()
+	hits = []
+	for run in range(2):
+		outfile = open('../scripts/reports/'+workload+'_cache'+str(run+1)+'.rpt', 'w')
+		subprocess.call(['python', workload+'.py', '-cache_dir', cache_dir, '-seed', seed], stdout=outfile, shell=False)
+		outfile.close()
+		rptfile = open('../scripts/reports/'+workload+'_cache'+str(run+1)+'.rpt', 'r')
+		hits.append(any('Loaded compiled NPU program from cache' in line for line in rptfile))
+	entries = len(listdir(cache_dir))
+	shutil.rmtree(cache_dir)
+	if ((not hits[0]) and hits[1] and entries == 1):
+		print(colors.PASS + 'PASS' + colors.RESET, end='')
+	else:
+		print(colors.FAIL + 'FAIL' + colors.RESET, end='')
+		failed += 1
+	print('    {:<6}    {:<6}    {:<7}'.format('HIT' if hits[0] else 'MISS', 'HIT' if hits[1] else 'MISS', entries))
+	subprocess.call(['rm', workload+'.py'], shell=False)
+
+sys.exit(1 if failed else 0)
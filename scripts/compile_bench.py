@@ -0,0 +1,59 @@
+import os
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = "2"
+from os import chdir
+import sys
+import time
+import io
+import contextlib
+import numpy as np
+
+# Define colors for printing
+class colors:
+	BOLD = '\033[1m'
+	RESET = '\033[0;0m'
+
+# Program construction (compile) time of a recurrent layer for an increasing number of time steps. With tags computed
+# from the last-writer index, the time per chain should stay flat (linear growth of the total compile time).
+layer = 'gru'
+size = 256
+steps = [64, 256, 1024]
+if ('--layer' in sys.argv):
+	layer = sys.argv[sys.argv.index('--layer')+1]
+if ('--size' in sys.argv):
+	size = int(sys.argv[sys.argv.index('--size')+1])
+if ('--steps' in sys.argv):
+	steps = [int(t) for t in sys.argv[sys.argv.index('--steps')+1].split(',')]
+if (layer not in ['rnn', 'gru', 'lstm']):
+	print('Invalid --layer argument! Supported layers are rnn, gru and lstm')
+	sys.exit(1)
+
+chdir('../compiler')
+sys.path.insert(0, '.')
+from compiler import *
+from npu_layers import *
+
+NUM_INPUTS = 6
+num_mats = {'rnn': 2, 'gru': 6, 'lstm': 8}[layer]
+print(colors.BOLD + '{:<8}{:>10}{:>12}{:>16}{:>12}'.format('STEPS', 'CHAINS', 'TIME (s)', 'US PER CHAIN', 'SCALING') + colors.RESET)
+base_time_per_chain = None
+for time_steps in steps:
+	# Deep VRFs (and shallow MRFs to stay within the device word limit) so that long sequences fit
+	sys.argv = [sys.argv[0], '-vd', '8192', '-md', '512']
+	np.random.seed(0)
+	x = np.random.randint(-128, 127, size=(time_steps, NUM_INPUTS, size), dtype=np.int8)
+	mats = [np.random.randint(0, 127, size=(size, size), dtype=np.int8) for _ in range(num_mats)]
+	start = time.time()
+	with contextlib.redirect_stdout(io.StringIO()):
+		npu = initialize_npu(sys.argv)
+	if (layer == 'rnn'):
+		npu_rnn(npu, 'layer1', 0, time_steps, NUM_INPUTS, size, size, size, *mats, 'mvu_vrf', x, 'tanh')
+	elif (layer == 'gru'):
+		npu_gru(npu, 'layer1', 0, time_steps, NUM_INPUTS, size, size, size, *mats, 'mvu_vrf', x, 'tanh', 'sigmoid')
+	else:
+		npu_lstm(npu, 'layer1', 0, time_steps, NUM_INPUTS, size, size, size, *mats, 'mvu_vrf', x, 'tanh', 'sigmoid')
+	npu.end_npu_program()
+	elapsed = time.time() - start
+	time_per_chain = elapsed / len(npu.inst_q)
+	if (base_time_per_chain is None):
+		base_time_per_chain = time_per_chain
+	print('{:<8}{:>10}{:>12.3f}{:>16.2f}{:>11.2f}x'.format(time_steps, len(npu.inst_q), elapsed, time_per_chain * 1e6, time_per_chain / base_time_per_chain))
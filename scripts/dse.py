@@ -0,0 +1,138 @@
+import os
+from os import chdir
+from os.path import isfile, join, basename, abspath
+import sys
+import re
+import subprocess
+import tempfile
+import shutil
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Define colors for printing
+class colors:
+	PASS = '\x1b[42m'
+	FAIL = '\x1b[41m'
+	BOLD = '\033[1m'
+	RESET = '\033[0;0m'
+
+# Design-space exploration of the architecture parameters for one workload. Every legal configuration of the given
+# tiles/DPEs/lanes/VRF depth/MRF depth values is compiled and scored with the analytical timing model (-estimate) or,
+# with --perfsim, the performance simulator. The Pareto frontier of cycles against multipliers and memory words is
+# printed and all results are written to ../scripts/reports/<workload>_dse.csv.
+def parse_list(flag, default):
+	if (flag not in sys.argv):
+		return default
+	try:
+		return [int(v) for v in sys.argv[sys.argv.index(flag)+1].split(',')]
+	except (IndexError, ValueError):
+		print('Invalid ' + flag + ' argument! Expected a comma-separated list of integers')
+		sys.exit(1)
+
+if ('--workload' not in sys.argv or sys.argv.index('--workload')+1 >= len(sys.argv)):
+	print('Usage: python dse.py --workload <name or path> [--tiles 4,7] [--dpes 40] [--lanes 40] [--vd 512] [--md 1024] [--jobs N] [--perfsim]')
+	sys.exit(1)
+workload = sys.argv[sys.argv.index('--workload')+1]
+workload_path = abspath(workload) if isfile(workload) else abspath('./workloads/' + workload + '.py')
+if (not isfile(workload_path)):
+	print('Workload ' + workload + ' not found!')
+	sys.exit(1)
+workload = basename(workload_path).split('.')[0]
+
+tiles = parse_list('--tiles', [2, 3, 4, 5, 6, 7, 8, 10, 12, 14])
+dpes = parse_list('--dpes', [20, 40, 60, 80, 120])
+lanes = parse_list('--lanes', [10, 20, 40])
+vrf_depths = parse_list('--vd', [512])
+mrf_depths = parse_list('--md', [512, 1024, 2048])
+jobs = parse_list('--jobs', [os.cpu_count()])[0]
+perf_sim = ('--perfsim' in sys.argv)
+# The performance simulator builds and runs in the shared ../simulator directory, so with --perfsim the configurations
+# run one at a time in ../compiler. Otherwise each configuration runs in its own working directory, since the flow
+# deletes and writes its dump files (and __pycache__) in the working directory.
+if (perf_sim):
+	jobs = 1
+
+chdir('../compiler')
+sys.path.insert(0, '.')
+from compiler import check_arch_params, arch_mults, arch_mem_words
+
+# Legal configurations (within the Stratix 10 NX limits enforced by initialize_npu)
+configs = []
+for t in tiles:
+	for d in dpes:
+		for l in lanes:
+			for vd in vrf_depths:
+				for md in mrf_depths:
+					if (not check_arch_params(t, d, l, vd, md)):
+						configs.append((t, d, l, vd, md))
+if (not configs):
+	print('None of the configurations fits on the device!')
+	sys.exit(1)
+
+# Compile a workload for one configuration and return its (cycles, TOPS), or None if it does not compile or fails
+def run_config(config):
+	t, d, l, vd, md = config
+	args = ['python', abspath(workload + '.py'), '-perfsim' if perf_sim else '-estimate', '-t', str(t), '-d', str(d), \
+		'-l', str(l), '-vd', str(vd), '-md', str(md)]
+	work_dir = '.' if perf_sim else tempfile.mkdtemp(prefix=workload + '_dse_')
+	try:
+		result = subprocess.run(args, cwd=work_dir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+	finally:
+		if (not perf_sim):
+			shutil.rmtree(work_dir)
+	output = re.sub('\x1b\\[[0-9;]*m', '', result.stdout)
+	if (perf_sim):
+		output = output.split('C++ Performance Simulation')[-1]
+		match = re.search('PASSED \\((\\d+) cycles - \\S+ ms - (\\S+) TOPS\\)', output)
+	else:
+		match = re.search('Estimated runtime \\.\\.\\. (\\d+) cycles - \\S+ ms - (\\S+) TOPS', output)
+	if (result.returncode != 0 or match is None):
+		return None
+	return int(match.group(1)), float(match.group(2))
+
+subprocess.call(['cp', workload_path, './' + workload + '.py'], shell=False)
+print(colors.BOLD + 'Exploring ' + str(len(configs)) + ' configurations of ' + workload + ' with ' + \
+	('the performance simulator' if perf_sim else 'the analytical model') + ' (' + str(jobs) + ' jobs)' + colors.RESET)
+results = {}
+with ThreadPoolExecutor(max_workers=jobs) as pool:
+	futures = dict((pool.submit(run_config, config), config) for config in configs)
+	for done, future in enumerate(as_completed(futures)):
+		results[futures[future]] = future.result()
+		sys.stdout.write('\rEvaluated {}/{}'.format(done+1, len(configs)))
+		sys.stdout.flush()
+print('')
+subprocess.call(['rm', workload + '.py'], shell=False)
+
+# Pareto frontier: configurations not dominated in (cycles, multipliers, memory words)
+points = []
+for config, score in results.items():
+	if (score is not None):
+		t, d, l, vd, md = config
+		points.append((score[0], arch_mults(t, d, l), arch_mem_words(t, d, vd, md), score[1], config))
+points.sort()
+frontier = []
+for point in points:
+	dominated = False
+	for other in points:
+		if (other[:3] != point[:3] and all([other[i] <= point[i] for i in range(3)])):
+			dominated = True
+			break
+	if (not dominated):
+		frontier.append(point)
+
+failed = len(configs) - len(points)
+if (failed > 0):
+	print(colors.FAIL + str(failed) + ' configuration(s) did not compile or failed simulation' + colors.RESET)
+print(colors.BOLD + '{:<6}{:<6}{:<6}{:<6}{:<6}{:>10}{:>8}{:>8}{:>10}'.format('TILES', 'DPES', 'LANES', 'VD', 'MD', 'CYCLES', 'TOPS', \
+	'MULTS', 'WORDS') + colors.RESET)
+for cycles, mults, words, tops, (t, d, l, vd, md) in frontier:
+	print('{:<6}{:<6}{:<6}{:<6}{:<6}{:>10}{:>8.2f}{:>8}{:>10}'.format(t, d, l, vd, md, cycles, tops, mults, words))
+
+csv = open('../scripts/reports/' + workload + '_dse.csv', 'w')
+csv.write('tiles,dpes,lanes,vrf_depth,mrf_depth,cycles,tops,mults,words,pareto\n')
+for config in configs:
+	t, d, l, vd, md = config
+	score = results[config]
+	on_frontier = any([point[4] == config for point in frontier])
+	csv.write(','.join([str(v) for v in config]) + ',' + (str(score[0]) + ',' + str(score[1]) if score else ',') + ',' + \
+		str(arch_mults(t, d, l)) + ',' + str(arch_mem_words(t, d, vd, md)) + ',' + str(int(on_frontier)) + '\n')
+csv.close()
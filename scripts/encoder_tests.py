@@ -0,0 +1,177 @@
+import os
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = "2"
+from os import listdir, chdir
+from os.path import isfile, join
+import sys
+import io
+import contextlib
+import runpy
+
+# Define colors for printing
+class colors:
+	PASS = '\x1b[42m'
+	FAIL = '\x1b[41m'
+	BOLD = '\033[1m'
+	RESET = '\033[0;0m'
+
+# Instruction encoder check: the VLIW words that encode_insts packs for all chains at once are compared, chain by
+# chain, with the bit strings of the original per-chain encoder below (one macro-instruction at a time from the LSB:
+# loader, MFU1, MFU0, eVRF and MVU). Each workload runs its default flow (compilation and functional simulation).
+keyword = ''
+if ('--run_test' in sys.argv):
+	keyword = sys.argv[sys.argv.index('--run_test')+1]
+
+# Get list of existing workloads
+path = './workloads/'
+workloads = [f for f in listdir(path) if isfile(join(path, f))]
+workloads = [f for f in workloads if keyword in f]
+workloads.sort()
+for i in range(len(workloads)):
+	workloads[i] = workloads[i].split('.')[0]
+
+chdir('../compiler')
+sys.path.insert(0, '.')
+from compiler import *
+from fsim import lower_chains, MVU_OPS, EVRF_OPS, ACT_OPS, ADD_OPS, MUL_OPS, LD_OPS, VRF_NONE
+
+# MVU macro-instruction of a chain
+def mvu_minst(npu, inst):
+	minst = 0
+	shift = 0
+	if (inst.mvu_op != MVU_OPS['nop']):
+		minst = 1
+		shift += 1
+		minst += (int(inst.mvu_tag) << shift)
+		shift += npu.NTAGW
+		minst += (int(inst.mvu_words_per_row) << shift)
+		shift += npu.NSIZEW
+		minst += (int(inst.mvu_mrf_rd_sz) << shift)
+		shift += npu.NSIZEW
+		minst += (int(inst.mvu_mrf_rd_base) << shift)
+		shift += npu.MRFAW
+		minst += (int(inst.mvu_vrf_rd_sz) << shift)
+		shift += npu.NSIZEW
+		for b in [2, 1, 0]:
+			minst += (int(inst.mvu_vrf_rd_base[b]) << shift)
+			shift += npu.VRFAW
+	return minst
+
+# eVRF macro-instruction of a chain
+def evrf_minst(npu, inst):
+	minst = 0
+	shift = 0
+	if (inst.extvrf_op != EVRF_OPS['nop']):
+		minst += (int(inst.batch) << shift)
+		shift += 2
+		minst += (0x1 << shift)
+		shift += 1
+		minst += (int(inst.extvrf_tag) << shift)
+		shift += npu.NTAGW
+		if (inst.extvrf_op != EVRF_OPS['move']):
+			minst += (0x1 << shift)
+		shift += 1
+		minst += (int(inst.extvrf_rd_sz) << shift)
+		shift += npu.NSIZEW
+		for b in [2, 1, 0]:
+			minst += (int(inst.extvrf_rd_base[b]) << shift)
+			shift += npu.VRFAW
+	return minst
+
+# MFU macro-instruction of a chain (mfu is 'mfu0' or 'mfu1')
+def mfu_minst(npu, inst, mfu):
+	minst = 0
+	shift = 0
+	add_op = getattr(inst, mfu + '_add_op')
+	mul_op = getattr(inst, mfu + '_mul_op')
+	if (getattr(inst, mfu + '_act_op') != ACT_OPS['nop'] and add_op != ADD_OPS['nop'] and mul_op != MUL_OPS['nop']):
+		minst += (int(inst.batch) << shift)
+		shift += 2
+		minst += (0x40 << shift)
+		if (add_op == ADD_OPS['add']):
+			minst += (0x02 << shift)
+		elif (add_op == ADD_OPS['sub_a_b']):
+			minst += (0x04 << shift)
+		elif (add_op == ADD_OPS['sub_b_a']):
+			minst += (0x06 << shift)
+		elif (add_op == ADD_OPS['max']):
+			minst += (0x08 << shift)
+		if (mul_op == MUL_OPS['mul']):
+			minst += (0x01 << shift)
+		shift += 7
+		minst += (int(getattr(inst, mfu + '_tag')) << shift)
+		shift += npu.NTAGW
+		minst += (int(getattr(inst, mfu + '_vrf_rd_size')) << shift)
+		shift += npu.NSIZEW
+		for vrf in ['vrf1', 'vrf0']:
+			for b in [2, 1, 0]:
+				minst += (int(getattr(inst, mfu + '_' + vrf + '_rd_base')[b]) << shift)
+				shift += npu.VRFAW
+	return minst
+
+# Loader macro-instruction of a chain
+def ld_minst(npu, inst):
+	minst = 0
+	shift = 0
+	if (inst.loader_op != LD_OPS['nop']):
+		minst += (int(inst.write_to_obuf) << shift)
+		shift += 1
+		minst += (int(inst.last_flag) << shift)
+		shift += 1
+		minst += (int(inst.batch) << shift)
+		shift += 2
+		minst += (0x1 << shift)
+		shift += 1
+		if (inst.loader_op == LD_OPS['wb'] or inst.loader_op == LD_OPS['flush']):
+			minst += (0x1 << shift)
+		shift += 1
+		minst += (int(inst.vrf_id0_wr_size) << shift)
+		shift += npu.NSIZEW
+		for vrf in ['vrf_id1', 'vrf_id0']:
+			for b in [2, 1, 0]:
+				minst += (int(getattr(inst, vrf + '_wr_base')[b]) << shift)
+				shift += npu.VRFAW
+		if (inst.vrf_id0 != VRF_NONE):
+			minst += (0x1 << (2*int(inst.vrf_id0))) << shift
+		if (inst.vrf_id1 != VRF_NONE):
+			minst += (0x3 << (2*int(inst.vrf_id1))) << shift
+	return minst
+
+# Bit string (MSB first) of a chain encoded by the per-chain encoder
+def chain_bit_string(npu, inst):
+	minst_chain = 0
+	shift = 0
+	for minst, width in [(ld_minst(npu, inst), npu.MIW_LD), (mfu_minst(npu, inst, 'mfu1'), npu.MIW_MFU), \
+		(mfu_minst(npu, inst, 'mfu0'), npu.MIW_MFU), (evrf_minst(npu, inst), npu.MIW_EVRF), (mvu_minst(npu, inst), npu.MIW_MVU)]:
+		minst_chain += (minst << shift)
+		shift += width
+	return bin(minst_chain & int(pow(2, npu.MICW)-1))[2:].zfill(npu.MICW)
+
+# Bit string (MSB first) of a chain encoded by encode_insts
+def word_bit_string(npu, words):
+	minst_chain = 0
+	for w in range(len(words)):
+		minst_chain += (int(words[w]) << (64*w))
+	return bin(minst_chain)[2:].zfill(npu.MICW)
+
+print(colors.BOLD + '{:<35}{:<4}    {:>6}    {:<6}'.format('WORKLOAD', 'TEST', 'CHAINS', 'FIRST MISMATCH') + colors.RESET)
+
+failed = 0
+for workload in workloads:
+	sys.stdout.write('{:<35}'.format(workload))
+	sys.stdout.flush()
+	# The workload runs in this process so that its compiled program (npu.inst_q) is available after the flow
+	sys.argv = [workload+'.py']
+	with open('../scripts/reports/'+workload+'_encoder.rpt', 'w') as outfile, contextlib.redirect_stdout(outfile):
+		npu = runpy.run_path('../scripts/workloads/'+workload+'.py', run_name='__main__')['npu']
+	npu.set_inst_params()
+	words = npu.encode_insts(npu.inst_q)
+	insts = lower_chains(npu.inst_q, npu.NTILE)
+	mismatches = [i for i in range(len(insts)) if chain_bit_string(npu, insts[i]) != word_bit_string(npu, words[i])]
+	if (len(words) == len(insts) and not mismatches):
+		print(colors.PASS + 'PASS' + colors.RESET, end='')
+	else:
+		print(colors.FAIL + 'FAIL' + colors.RESET, end='')
+		failed += 1
+	print('    {:>6}    {:<6}'.format(len(insts), str(mismatches[0]) if mismatches else '-'))
+
+sys.exit(1 if failed else 0)
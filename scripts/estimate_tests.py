@@ -0,0 +1,75 @@
+import os
+from os import listdir, chdir
+from os.path import isfile, join
+import sys
+import re
+import subprocess
+
+# Define colors for printing
+class colors:
+	PASS = '\x1b[42m'
+	FAIL = '\x1b[41m'
+	BOLD = '\033[1m'
+	RESET = '\033[0;0m'
+
+# Calibration of the analytical timing model (-estimate) against the performance simulator baseline. The estimate is
+# flagged if it is off by more than the tolerance (in percent).
+keyword = ''
+tolerance = 10.0
+if ('--run_test' in sys.argv):
+	keyword = sys.argv[sys.argv.index('--run_test')+1]
+if ('--tolerance' in sys.argv):
+	tolerance = float(sys.argv[sys.argv.index('--tolerance')+1])
+
+# Get list of existing workloads (--workloads selects another directory under scripts/, e.g. keras_workloads for
+# the Keras front-end workloads, which need TensorFlow)
+path = './workloads/'
+if ('--workloads' in sys.argv):
+	path = './' + sys.argv[sys.argv.index('--workloads')+1].strip('./') + '/'
+workloads = [f for f in listdir(path) if isfile(join(path, f))]
+workloads = [f for f in workloads if keyword in f]
+workloads.sort()
+for i in range(len(workloads)):
+	workloads[i] = workloads[i].split('.')[0]
+
+# Parse baseline results
+baseline_results = {}
+baseline = open('../scripts/perf_baseline', 'r')
+for line in baseline:
+	split_line = line.split(' ')
+	baseline_results[split_line[0]] = float(split_line[1])
+
+print(colors.BOLD + '{:<35}{:<4}    {:>8}    {:>6}    {:>6}    {:<6}'.format('WORKLOAD', 'TEST', 'CYCLES', 'TOPS', 'BASE', 'ERROR') + colors.RESET)
+
+chdir('../compiler')
+errors = []
+for workload in workloads:
+	subprocess.call(['cp', '../scripts/'+path+workload+'.py', './'], shell=False)
+	sys.stdout.write('{:<35}'.format(workload))
+	sys.stdout.flush()
+	outfile = open('../scripts/reports/'+workload+'_estimate.rpt', 'w')
+	subprocess.call(['python', workload+'.py', '-estimate'], stdout=outfile, shell=False)
+	rptfile = open('../scripts/reports/'+workload+'_estimate.rpt', 'r')
+	parsed = False
+	for line in rptfile:
+		if ('Estimated runtime ... ' in line):
+			args = re.sub('\x1b\\[[0-9;]*m', '', line).split()
+			cycles = args[3]
+			result = float(args[9])
+			parsed = True
+			if workload in baseline_results:
+				error = ((result/baseline_results[workload])-1) * 100
+				errors.append(abs(error))
+				if (abs(error) <= tolerance):
+					print(colors.PASS + 'PASS' + colors.RESET, end='')
+				else:
+					print(colors.FAIL + 'FAIL' + colors.RESET, end='')
+				print('    {:>8}    {:>6.2f}    {:>6.2f}    {:+.2f}%'.format(cycles, result, baseline_results[workload], error))
+			else:
+				print(colors.PASS + 'PASS' + colors.RESET + '    {:>8}    {:>6.2f}    {:>6}    N/A'.format(cycles, result, 'N/A'))
+	if(not parsed):
+		print(colors.FAIL + 'FAIL' + colors.RESET)
+	subprocess.call(['rm', workload+'.py'], shell=False)
+
+if(errors):
+	print(colors.BOLD + 'Mean error: {:.2f}%    Max error: {:.2f}%'.format(sum(errors)/len(errors), max(errors)) + colors.RESET)
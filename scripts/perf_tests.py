@@ -15,8 +15,16 @@ keyword = ''
 if ('--run_test' in sys.argv):
 	keyword = sys.argv[sys.argv.index('--run_test')+1]
 
-# Get list of existing workloads
+# With --cache, workloads are run with a fixed seed and reuse the programs compiled by earlier runs
+cache_args = []
+if ('--cache' in sys.argv):
+	cache_args = ['-cache', '-seed', '0']
+
+# Get list of existing workloads (--workloads selects another directory under scripts/, e.g. keras_workloads for
+# the Keras front-end workloads, which need TensorFlow)
 path = './workloads/'
+if ('--workloads' in sys.argv):
+	path = './' + sys.argv[sys.argv.index('--workloads')+1].strip('./') + '/'
 workloads = [f for f in listdir(path) if isfile(join(path, f))]
 workloads = [f for f in workloads if keyword in f]
 workloads.sort()
@@ -34,11 +42,11 @@ print(colors.BOLD + '{:<35}{:<4}    {:<5}    {:<6}'.format('WORKLOAD', 'TEST', '
 
 chdir('../compiler')
 for workload in workloads:
-	subprocess.call(['cp', '../scripts/workloads/'+workload+'.py', './'], shell=False)
+	subprocess.call(['cp', '../scripts/'+path+workload+'.py', './'], shell=False)
 	sys.stdout.write('{:<35}'.format(workload))
 	sys.stdout.flush()
 	outfile = open('../scripts/reports/'+workload+'_perf.rpt', 'w')
-	subprocess.call(['python', workload+'.py', '-perfsim'], stdout=outfile, shell=False)
+	subprocess.call(['python', workload+'.py', '-perfsim'] + cache_args, stdout=outfile, shell=False)
 	rptfile = open('../scripts/reports/'+workload+'_perf.rpt', 'r')
 	parse_perf_res = False
 	for line in rptfile:
@@ -1,8 +1,3 @@
-import os
-os.environ['TF_CPP_MIN_LOG_LEVEL'] = "2"
-import tensorflow as tf
-from tensorflow import keras
-from tensorflow.keras import layers
 #import sys
 #sys.path.append('../compiler/')
 
@@ -15,17 +10,11 @@ from npu_layers import *
 INPUT_SIZE = 1024
 L1_SIZE = 1024
 
-# Define model architecture using Keras Sequential Model
-model = NPUSequential([
-	layers.Dense(L1_SIZE, name="layer1"),
+# Define model architecture using the NPU model description (no TensorFlow needed)
+model = NPUModel([
+	{'type': 'dense', 'units': L1_SIZE, 'name': 'layer1'},
 ])
 
-# Random test inputs for different types of layers
-test_input = tf.random.uniform(shape=[6, INPUT_SIZE], dtype=tf.int32, minval=-128, maxval=127)
-
-# Call model on example input
-y = model(test_input)
-
 # Print model summary
 model.summary()
 
@@ -33,6 +22,8 @@ model.summary()
 
 # Initialize NPU
 npu = initialize_npu(sys.argv)
+# Random test inputs for different types of layers (drawn after initialize_npu, which applies -seed)
+test_input = np.random.randint(-128, 127, size=(6, INPUT_SIZE))
 # Compile model for NPU
 model.compile_for_npu(npu, test_input)
 # Run NPU flow
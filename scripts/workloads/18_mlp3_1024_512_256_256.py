@@ -1,8 +1,3 @@
-import os
-os.environ['TF_CPP_MIN_LOG_LEVEL'] = "2"
-import tensorflow as tf
-from tensorflow import keras
-from tensorflow.keras import layers
 
 from compiler import *
 from npu_layers import *
@@ -15,19 +10,13 @@ DENSE_L1_SIZE = 512
 DENSE_L2_SIZE = 256
 DENSE_L3_SIZE = 256
 
-# Define model architecture using Keras Sequential Model
-model = NPUSequential([
-	layers.Dense(DENSE_L1_SIZE, activation="relu", name="layer1"),
-	layers.Dense(DENSE_L2_SIZE, activation="relu", name="layer2"),
-	layers.Dense(DENSE_L3_SIZE, activation="relu", name="layer3"),
+# Define model architecture using the NPU model description (no TensorFlow needed)
+model = NPUModel([
+	{'type': 'dense', 'units': DENSE_L1_SIZE, 'activation': 'relu', 'name': 'layer1'},
+	{'type': 'dense', 'units': DENSE_L2_SIZE, 'activation': 'relu', 'name': 'layer2'},
+	{'type': 'dense', 'units': DENSE_L3_SIZE, 'activation': 'relu', 'name': 'layer3'},
 ])
 
-# Random test inputs for different types of layers
-test_input = tf.random.uniform(shape=[6, INPUT_VEC_SIZE], minval=-128, maxval=127)
-
-# Call model on example input
-y = model(test_input)
-
 # Print model summary
 model.summary()
 
@@ -35,6 +24,8 @@ model.summary()
 
 # Initialize NPU
 npu = initialize_npu(sys.argv)
+# Random test inputs for different types of layers (drawn after initialize_npu, which applies -seed)
+test_input = np.random.randint(-128, 127, size=(6, INPUT_VEC_SIZE))
 # Compile model for NPU
 model.compile_for_npu(npu, test_input)
 # Run NPU flow
@@ -219,7 +219,7 @@ void simulate_compiler_code(unsigned int& cycle_count){
     }
 	
 	auto end = std::chrono::high_resolution_clock::now();
-	auto duration = std::chrono::duration_cast<std::chrono::seconds>(end - start);
+	auto duration = std::chrono::duration_cast<std::chrono::milliseconds>(end - start);
 
     for(unsigned int t = 0; t < 100; t++){
     	npu->clock(cycle_count);
@@ -228,10 +228,9 @@ void simulate_compiler_code(unsigned int& cycle_count){
     cycle_count -= 100;
 	
 	// Simulation Report
-	ofstream sim_done;
-  	sim_done.open ("./sim_done");
 	cout << "************************************************" << endl;
 	cout << "Total Simulation Time = " << cycle_count << " cycle(s)" << endl;
+	cout << "Simulation Duration = " << duration.count() / 1000.0 << " sec" << endl;
 	cout << "************************************************" << endl;
 	bool flag = true;
 	for(unsigned int i = 0; i < num_outputs; i++){
@@ -244,12 +243,8 @@ void simulate_compiler_code(unsigned int& cycle_count){
 
 	if(flag){
 		cout << "Outputs match!" << endl;
-		sim_done << "PASS" << endl;
-		sim_done << cycle_count << endl; 
-		sim_done << duration.count() << endl;
 	} else {
 		cout << "Outputs don't match!" << endl;
-		sim_done << "FAILED" << endl;
 		for(unsigned int i = 0; i < num_outputs; i++){
 			cout << "NPU: ";
 			print_vector(npu_results[i]);
@@ -257,9 +252,7 @@ void simulate_compiler_code(unsigned int& cycle_count){
 			print_vector(golden_results[i]);
 			cout << "------------" << endl;
 		}
-		sim_done << duration.count() << endl;
 	}
-	sim_done.close();
 
 	delete npu;
 	delete tester_vliw;